@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the case upload: one request per file against the batch upload
+
+Each mode creates a case and uploads the same files into it:
+  - per file:  one POST .../files request per file (one file-count update each)
+  - batch:     one multipart POST .../files/batch request with all files
+  - zip:       one POST .../files/batch request with a zip of all files
+  - tar.gz:    one POST .../files/batch request with a gzipped tar of all files
+
+Without --url, the server runs in this process (FastAPI TestClient) on a temporary
+DATA_DIR, so the network and MongoDB are not included; with --url, a running server
+is used (the device must exist there).
+
+Usage:
+    python bench_upload.py --files 400 --size-kb 512
+    python bench_upload.py --dicom-dir ./0.inputs --url http://localhost:8000 --device-id pfcc_gect_catphan604
+"""
+
+import io
+import os
+import sys
+import time
+import shutil
+import tarfile
+import zipfile
+import tempfile
+import argparse
+from pathlib import Path
+
+script_dir = Path(__file__).parent
+sys.path.insert(0, str(script_dir))
+
+
+def load_files(dicom_dir, count, size_kb):
+    """(name, bytes) of the files to upload: the files of dicom_dir, or synthetic files"""
+    if dicom_dir:
+        paths = sorted(p for p in Path(dicom_dir).iterdir() if p.is_file())[:count]
+        return [(p.name, p.read_bytes()) for p in paths]
+    return [(f"CT{i:04d}.dcm", os.urandom(size_kb * 1024)) for i in range(count)]
+
+
+def make_archive(files, kind):
+    """zip or tar.gz of the files, in memory"""
+    buffer = io.BytesIO()
+    if kind == "zip":
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+            for name, data in files:
+                archive.writestr(name, data)
+    else:
+        with tarfile.open(fileobj=buffer, mode="w:gz", compresslevel=1) as archive:
+            for name, data in files:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def create_case(client, device_id):
+    """New case id (case ids have a one-second resolution, so a new one is waited for)"""
+    last = getattr(create_case, "last", None)
+    while True:
+        response = client.post(f"/api/devices/{device_id}/cases")
+        response.raise_for_status()
+        case_id = response.json()["case_id"]
+        if case_id != last:
+            create_case.last = case_id
+            return case_id
+        time.sleep(0.2)
+
+
+def upload_per_file(client, device_id, case_id, files):
+    for name, data in files:
+        response = client.post(f"/api/devices/{device_id}/cases/{case_id}/files",
+                               files={"file": (name, data, "application/dicom")})
+        response.raise_for_status()
+
+
+def upload_batch(client, device_id, case_id, files, expected_count):
+    parts = [("files", (name, data, "application/dicom")) for name, data in files]
+    response = client.post(f"/api/devices/{device_id}/cases/{case_id}/files/batch", files=parts)
+    response.raise_for_status()
+    file_count = response.json()["file_count"]
+    if file_count != expected_count:
+        raise Exception(f"{file_count} files saved, expected {expected_count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-file against batch case uploads")
+    parser.add_argument("--url", help="Running server (default: in-process TestClient on a temporary DATA_DIR)")
+    parser.add_argument("--device-id", default="bench_device", help="Device to create the cases for")
+    parser.add_argument("--dicom-dir", help="Folder of DICOM files to upload (default: synthetic files)")
+    parser.add_argument("--files", type=int, default=400, help="Number of files (default: 400)")
+    parser.add_argument("--size-kb", type=int, default=512, help="Size of the synthetic files in KB (default: 512)")
+    args = parser.parse_args()
+
+    files = load_files(args.dicom_dir, args.files, args.size_kb)
+    total_mb = sum(len(data) for _, data in files) / 1e6
+    print(f"{len(files)} files, {total_mb:.1f} MB")
+
+    data_dir = None
+    if args.url:
+        import httpx
+        client = httpx.Client(base_url=args.url, timeout=600)
+    else:
+        data_dir = Path(tempfile.mkdtemp(prefix="bench_upload_"))
+        (data_dir / args.device_id).mkdir()
+        os.environ["DATA_DIR"] = str(data_dir)
+        from fastapi.testclient import TestClient
+        import main as server
+        client = TestClient(server.app)
+
+    try:
+        archives = {kind: make_archive(files, kind) for kind in ("zip", "tar.gz")}
+        modes = [
+            ("per file", lambda case_id: upload_per_file(client, args.device_id, case_id, files)),
+            ("batch", lambda case_id: upload_batch(client, args.device_id, case_id, files, len(files))),
+            ("zip", lambda case_id: upload_batch(client, args.device_id, case_id,
+                                                 [("case.zip", archives["zip"])], len(files))),
+            ("tar.gz", lambda case_id: upload_batch(client, args.device_id, case_id,
+                                                    [("case.tar.gz", archives["tar.gz"])], len(files))),
+        ]
+        results = []
+        for label, upload in modes:
+            case_id = create_case(client, args.device_id)
+            start = time.perf_counter()
+            upload(case_id)
+            results.append((label, time.perf_counter() - start))
+
+        base = results[0][1]
+        print(f"\n  {'mode':<10} {'requests':>9} {'seconds':>9} {'files/s':>9} {'speedup':>8}")
+        for label, seconds in results:
+            requests = len(files) if label == "per file" else 1
+            print(f"  {label:<10} {requests:>9} {seconds:9.3f} {len(files) / seconds:9.0f} {base / seconds:7.1f}x")
+    finally:
+        client.close()
+        if data_dir is not None:
+            shutil.rmtree(data_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the worker startup time and the per-job overhead of the worker modes
+
+Startup: time to import the job modules (worker.py with SimpleITK and CTQA), warm the
+imports used on first use (pydicom) and preload a device baseline, in a fresh interpreter.
+
+Per job: a report regeneration of a case (cheap, so the overhead dominates), run
+  - fork, cold:      a forked process per job from a worker that only imported the modules
+                     (RQ Worker without CTQA_PRELOAD_BASELINES)
+  - fork, preloaded: a forked process per job from a worker with imports and baseline warm
+                     (RQ Worker, run_worker.py with CTQA_PRELOAD_BASELINES)
+  - in-process:      in the worker process itself (RQ SimpleWorker, CTQA_WORKER_MODE=simple)
+The report is written to a copy of the case. Run from the directory containing _data/devices.
+
+Usage:
+    python bench_worker_overhead.py ./_data/devices/<device_id>/cases/<case_id> --jobs 10
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+# Import the worker module from this directory
+script_dir = Path(__file__).parent
+sys.path.insert(0, str(script_dir))
+
+STARTUP_SCRIPT = """
+import sys, time
+sys.path.insert(0, {script_dir!r})
+t0 = time.perf_counter()
+import worker
+t1 = time.perf_counter()
+worker.warm_imports()
+t2 = time.perf_counter()
+from ctqa import CTQA
+CTQA(machine_param_file={param_file!r}, device_id={device_id!r}).preload_baseline()
+t3 = time.perf_counter()
+print(t1 - t0, t2 - t1, t3 - t2)
+"""
+
+
+def measure_startup(param_file, device_id):
+    """(import, warm imports, preload baseline) seconds in a fresh interpreter"""
+    script = STARTUP_SCRIPT.format(script_dir=str(script_dir), param_file=param_file, device_id=device_id)
+    out = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+    return [float(v) for v in out.stdout.strip().splitlines()[-1].split()]
+
+
+def run_job(param_file, device_id, case_dir, mongo):
+    """One job: (MongoDB ping,) CTQA construction and report regeneration"""
+    import worker
+    from ctqa import CTQA
+    if mongo:
+        jobs_collection, _ = worker.get_collections()
+        jobs_collection.database.client.admin.command("ping")
+    CTQA(machine_param_file=param_file, device_id=device_id).regenerate_report(case_dir)
+
+
+def time_forked_jobs(n, *job_args):
+    """Seconds per job, each run in a process forked from this one (as RQ's Worker does)"""
+    times = []
+    for _ in range(n):
+        start = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_job(*job_args)
+            except Exception as e:
+                print(f"Job failed: {e}", file=sys.stderr)
+                code = 1
+            os._exit(code)
+        _, status = os.waitpid(pid, 0)
+        if status != 0:
+            raise Exception("Forked job failed")
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def time_jobs(n, *job_args):
+    """Seconds per job, run in this process (as RQ's SimpleWorker does)"""
+    times = []
+    for _ in range(n):
+        start = time.perf_counter()
+        run_job(*job_args)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark worker startup and per-job overhead")
+    parser.add_argument("case_dir", help="Analyzed case directory (with 3.analysis)")
+    parser.add_argument("--machine-param", help="Device param.txt (default: param.txt two levels above the case)")
+    parser.add_argument("--jobs", type=int, default=10, help="Jobs per mode (default: 10)")
+    parser.add_argument("--mongo", action="store_true", help="Include the MongoDB connection (MONGODB_URL) in each job")
+    args = parser.parse_args()
+
+    case_dir = Path(args.case_dir)
+    param_file = args.machine_param or str(case_dir.parent.parent / "param.txt")
+    device_id = Path(param_file).parent.name
+    if not (case_dir / "3.analysis").exists():
+        print(f"ERROR: 3.analysis not found in {case_dir}")
+        return 1
+
+    print("Startup (fresh interpreter):")
+    import_s, warm_s, preload_s = measure_startup(param_file, device_id)
+    for label, seconds in (("import worker (SimpleITK, CTQA)", import_s), ("warm imports (pydicom)", warm_s),
+                           (f"preload baseline ({device_id})", preload_s)):
+        print(f"  {label + ':':<40} {seconds:7.3f} s")
+
+    # Report regeneration on a copy of the case
+    work_dir = Path(tempfile.mkdtemp(prefix="bench_worker_"))
+    try:
+        work_case = work_dir / case_dir.name
+        shutil.copytree(case_dir / "3.analysis", work_case / "3.analysis")
+        if (case_dir / "info.txt").exists():
+            shutil.copy2(case_dir / "info.txt", work_case / "info.txt")
+        job_args = (param_file, device_id, str(work_case), args.mongo)
+
+        import worker  # noqa: F401 (the modules a worker has imported before it takes jobs)
+        results = {"fork, cold": time_forked_jobs(args.jobs, *job_args)}
+
+        worker.warm_imports()
+        from ctqa import CTQA
+        CTQA(machine_param_file=param_file, device_id=device_id).preload_baseline()
+        results["fork, preloaded"] = time_forked_jobs(args.jobs, *job_args)
+        results["in-process"] = time_jobs(args.jobs, *job_args)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    base = statistics.median(results["in-process"])
+    print(f"\nPer job ({args.jobs} report regenerations{', with MongoDB' if args.mongo else ''}):")
+    print(f"  {'mode':<16} {'median':>9} {'min':>9} {'overhead':>9}")
+    for mode, times in results.items():
+        median = statistics.median(times)
+        print(f"  {mode:<16} {median:8.3f}s {min(times):8.3f}s {median - base:8.3f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
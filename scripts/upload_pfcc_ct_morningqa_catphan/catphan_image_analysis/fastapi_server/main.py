@@ -7,19 +7,21 @@ import os
 import sys
 import uuid
 import shutil
+import tarfile
+import zipfile
 from pathlib import Path
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
 from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, FileResponse, HTMLResponse
 from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from dotenv import load_dotenv
 import redis
-from rq import Queue
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
 from pymongo.errors import ConnectionFailure
 
 # Load environment variables
@@ -28,7 +30,10 @@ load_dotenv()
 # Add parent directory to path to import CTQA modules
 sys.path.insert(0, str(Path(__file__).parent.parent.parent / "python_app"))
 
-from worker import process_ctqa_analysis
+from worker import process_ctqa_analysis, process_review_images, process_compile_baseline, process_regenerate_reports
+from dicomtools import (SERIES_INDEX_FILE, index_dicom_directory, summarize_dicom_series, ingest_dicom_file,
+                        ingest_dicom_files)
+from queues import PRIORITIES, DEFAULT_PRIORITY, get_queues, enqueue_device_job, queue_status
 
 app = FastAPI(title="CTQA Analysis API", version="1.0.0")
 
@@ -56,13 +61,14 @@ try:
 except Exception as e:
     print(f"Warning: Could not connect to MongoDB: {e}. Some features may not work.")
 
-# Redis connection for RQ
+# Redis connection for RQ (priority queues, see queues.py)
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6381/0")
+redis_conn = None
 job_queue = None
 try:
     redis_conn = redis.from_url(REDIS_URL, socket_connect_timeout=5)
     redis_conn.ping()
-    job_queue = Queue("ctqa_analysis", connection=redis_conn)
+    job_queue = get_queues(redis_conn, [DEFAULT_PRIORITY])[0]
     print("Connected to Redis")
 except Exception as e:
     print(f"Warning: Could not connect to Redis: {e}. Job queue may not work.")
@@ -71,6 +77,12 @@ except Exception as e:
 DATA_DIR = Path(os.getenv("DATA_DIR", "./_data/devices"))
 DEFAULT_DEVICE_ID = os.getenv("DEFAULT_DEVICE_ID", "pfcc_gect_catphan604")
 JOB_TIMEOUT = int(os.getenv("JOB_TIMEOUT", "600"))  # Default 10 minutes
+# Parse each uploaded slice on arrival into the slice store of 0.inputs (see dicomtools.ingest_dicom_file),
+# so the conversion to CT.mhd copies the slices instead of reading and decoding every file again
+CTQA_INGEST_SLICES = os.getenv("CTQA_INGEST_SLICES", "false").lower() in ("1", "true", "yes")
+# Limits of one batch upload (files and bytes after extracting the archives)
+CTQA_MAX_UPLOAD_FILES = int(os.getenv("CTQA_MAX_UPLOAD_FILES", "5000"))
+CTQA_MAX_UPLOAD_MB = int(os.getenv("CTQA_MAX_UPLOAD_MB", "2048"))
 
 def get_device_dir(device_id: str) -> Path:
     """Get the data directory for a specific device"""
@@ -90,6 +102,15 @@ def get_baseline_dir(device_id: str) -> Path:
     """Get the baseline directory for a specific device"""
     return get_device_dir(device_id) / "baseline"
 
+def get_compiled_baseline_dir(device_id: str) -> Path:
+    """Get the compiled baseline directory (label maps, ROIs) for a specific device"""
+    return get_device_dir(device_id) / "baseline_compiled"
+
+def check_priority(priority: str):
+    """Validate a job priority query parameter"""
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Unknown priority {priority} (expected one of {PRIORITIES})")
+
 # Default upload directory (for backwards compatibility with browsing endpoints)
 CASES_DIR = get_cases_dir(DEFAULT_DEVICE_ID)
 
@@ -207,6 +228,7 @@ async def get_device_info(device_id: str):
         "cases_dir": str(cases_dir),
         "has_config": param_file.exists(),
         "has_baseline": baseline_dir.exists(),
+        "has_compiled_baseline": (get_compiled_baseline_dir(device_id) / "compiled.json").exists(),
         "case_count": case_count
     }
 
@@ -357,16 +379,27 @@ async def get_job_report(job_id: str):
 # ============================================================================
 
 @app.post("/api/devices/{device_id}/cases")
-async def create_case(device_id: str):
+async def create_case(device_id: str, expected_file_count: Optional[int] = None, series_uid: Optional[str] = None,
+                      priority: str = "urgent"):
     """
     Create a new case folder for uploading DICOM files
     
+    With expected_file_count, the analysis is queued by the upload of the last file
+    (no separate analyze call); this needs MongoDB, which counts the uploaded files.
+    
     Args:
         device_id: Device identifier (e.g., pfcc_gect_catphan604)
+        expected_file_count: Number of files the client will upload (optional, enables auto-analysis)
+        series_uid: SeriesInstanceUID to analyze when auto-analyzed (optional, default: the largest CT series)
+        priority: Job queue of the auto-analysis: urgent (default), normal or batch
     
     Returns:
         Case ID (formatted as YYYYMMDD_HHMMSS)
     """
+    check_priority(priority)
+    if expected_file_count is not None and expected_file_count < 1:
+        raise HTTPException(status_code=400, detail="expected_file_count must be at least 1")
+    
     # Verify device exists
     device_dir = get_device_dir(device_id)
     if not device_dir.exists():
@@ -389,26 +422,35 @@ async def create_case(device_id: str):
             "created_at": datetime.utcnow().isoformat(),
             "updated_at": datetime.utcnow().isoformat(),
             "file_count": 0,
+            "uploaded_files": [],
+            "expected_file_count": expected_file_count,
+            "series_uid": series_uid,
+            "priority": priority,
             "case_dir": str(case_dir),
             "inputs_dir": str(inputs_dir)
         }
         jobs_collection.insert_one(case_doc)
     
-    return {"case_id": case_id, "device_id": device_id, "status": "created"}
+    return {"case_id": case_id, "device_id": device_id, "status": "created",
+            "auto_analyze": expected_file_count is not None and jobs_collection is not None}
 
 
 @app.post("/api/devices/{device_id}/cases/{case_id}/files")
-async def upload_file_to_case(device_id: str, case_id: str, file: UploadFile = File(...)):
+async def upload_file_to_case(device_id: str, case_id: str, background_tasks: BackgroundTasks,
+                              file: UploadFile = File(...)):
     """
     Upload a single DICOM file to an existing case folder
     
+    If the case was created with expected_file_count, the upload that completes the
+    count queues the analysis.
+    
     Args:
         device_id: Device identifier
         case_id: Case identifier
         file: Single DICOM file
         
     Returns:
-        Upload status
+        Upload status (with the job id if the analysis was queued)
     """
     cases_dir = get_cases_dir(device_id)
     case_dir = cases_dir / case_id
@@ -424,35 +466,345 @@ async def upload_file_to_case(device_id: str, case_id: str, file: UploadFile = F
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
     
+    # Parse the slice now (off the event loop), before the count that may queue the analysis
+    if CTQA_INGEST_SLICES:
+        await ingest_case_inputs(inputs_dir, [file.filename])
+    
     # Update file count in MongoDB
-    if jobs_collection is not None:
+    case_doc = count_uploaded_files(device_id, case_id, [file.filename])
+    
+    response = {"filename": file.filename, "status": "uploaded"}
+    job_id = auto_analyze_case(device_id, case_id, case_doc, background_tasks)
+    if job_id:
+        response["job_id"] = job_id
+    return response
+
+
+@app.post("/api/devices/{device_id}/cases/{case_id}/files/batch")
+async def upload_files_to_case(device_id: str, case_id: str, background_tasks: BackgroundTasks,
+                               files: List[UploadFile] = File(...)):
+    """
+    Upload many DICOM files to an existing case folder in one request
+    
+    Each part is a DICOM file or a .zip/.tar/.tar.gz/.tgz archive of DICOM files, which is
+    extracted into 0.inputs (folders inside the archive are dropped). The file count is
+    updated once for the whole request. A request over CTQA_MAX_UPLOAD_FILES files or
+    CTQA_MAX_UPLOAD_MB (after extraction) is rejected with 413; a rejected or failed
+    request leaves no files in 0.inputs.
+    
+    Args:
+        device_id: Device identifier
+        case_id: Case identifier
+        files: DICOM files and/or archives
+        
+    Returns:
+        Upload status: number of files saved (with the job id if this upload queued the analysis)
+    """
+    inputs_dir = get_cases_dir(device_id) / case_id / "0.inputs"
+    if not inputs_dir.exists():
+        raise HTTPException(status_code=404, detail=f"Case {case_id} not found for device {device_id}")
+    
+    # Writing and extracting hundreds of files blocks, so it runs off the event loop
+    try:
+        saved = await run_in_threadpool(save_case_inputs, inputs_dir, files)
+    except HTTPException:
+        raise
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid archive: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to save files: {str(e)}")
+    
+    if CTQA_INGEST_SLICES:
+        await ingest_case_inputs(inputs_dir, saved)
+    
+    case_doc = count_uploaded_files(device_id, case_id, saved) if saved else None
+    
+    response = {"file_count": len(saved), "status": "uploaded"}
+    job_id = auto_analyze_case(device_id, case_id, case_doc, background_tasks)
+    if job_id:
+        response["job_id"] = job_id
+    return response
+
+
+async def ingest_case_inputs(inputs_dir: Path, names: List[str]):
+    """
+    Parse uploaded DICOM files into the slice store of 0.inputs, in a worker thread
+    
+    A failure only means the conversion reads those files itself, so it does not fail the upload.
+    """
+    try:
+        if len(names) == 1:
+            await run_in_threadpool(ingest_dicom_file, str(inputs_dir), names[0])
+        else:
+            await run_in_threadpool(ingest_dicom_files, str(inputs_dir), names)
+    except Exception as e:
+        print(f"Warning: Could not ingest slices into {inputs_dir}: {e}")
+
+
+def count_uploaded_files(device_id: str, case_id: str, names: List[str]) -> Optional[dict]:
+    """
+    Add uploaded files to the files of a case (one MongoDB update)
+    
+    The names go to the case's uploaded_files set and file_count is its size, so a retried
+    upload or a file uploaded again under the same name is counted once.
+    
+    Args:
+        names: Names of the files saved in 0.inputs
+    
+    Returns:
+        Case document after the update (None without MongoDB)
+    """
+    if jobs_collection is None:
+        return None
+    return jobs_collection.find_one_and_update(
+        {"case_id": case_id, "device_id": device_id},
+        [
+            {"$set": {
+                "uploaded_files": {"$setUnion": [{"$ifNull": ["$uploaded_files", []]}, list(names)]},
+                "updated_at": datetime.utcnow().isoformat()
+            }},
+            {"$set": {"file_count": {"$size": "$uploaded_files"}}}
+        ],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def save_case_inputs(inputs_dir: Path, uploads: List[UploadFile]) -> List[str]:
+    """
+    Save uploaded files into a case's 0.inputs folder, extracting zip and tar archives
+    
+    Tar archives are read as a stream (one pass, no seeking). Files are saved under their
+    base name; hidden files and folders are skipped, and a name already saved by this
+    upload gets a numbered prefix instead of overwriting the earlier file.
+    
+    The files are written to a staging folder and moved into 0.inputs once all parts are
+    saved, so a request that fails (or goes over the upload limits) leaves no files behind.
+    The limits are checked on the bytes written, not on the sizes an archive declares.
+    
+    Returns:
+        Names of the saved files
+    """
+    max_bytes = CTQA_MAX_UPLOAD_MB * 1024 * 1024
+    saved = []
+    names = set()
+    total_bytes = 0
+    staging_dir = inputs_dir / f".upload_{uuid.uuid4().hex}"
+    
+    def save(name: str, fileobj):
+        nonlocal total_bytes
+        base = Path(name.replace("\\", "/")).name
+        if not base or base.startswith(".") or "__MACOSX" in name:
+            return
+        if len(saved) >= CTQA_MAX_UPLOAD_FILES:
+            raise HTTPException(status_code=413, detail=f"Upload has more than {CTQA_MAX_UPLOAD_FILES} files")
+        if base in names:
+            index = 1
+            while f"{index}_{base}" in names:
+                index += 1
+            base = f"{index}_{base}"
+        with open(staging_dir / base, "wb") as f:
+            while True:
+                chunk = fileobj.read(1024 * 1024)
+                if not chunk:
+                    break
+                total_bytes += len(chunk)
+                if total_bytes > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"Upload is larger than {CTQA_MAX_UPLOAD_MB} MB")
+                f.write(chunk)
+        names.add(base)
+        saved.append(base)
+    
+    staging_dir.mkdir()
+    try:
+        for upload in uploads:
+            filename = (upload.filename or "").lower()
+            if filename.endswith(".zip"):
+                with zipfile.ZipFile(upload.file) as archive:
+                    members = [info for info in archive.infolist() if not info.is_dir()]
+                    if len(saved) + len(members) > CTQA_MAX_UPLOAD_FILES:
+                        raise HTTPException(status_code=413,
+                                            detail=f"Upload has more than {CTQA_MAX_UPLOAD_FILES} files")
+                    for info in members:
+                        with archive.open(info) as member:
+                            save(info.filename, member)
+            elif filename.endswith((".tar", ".tar.gz", ".tgz")):
+                with tarfile.open(fileobj=upload.file, mode="r|*") as archive:
+                    for member in archive:
+                        if member.isfile():
+                            save(member.name, archive.extractfile(member))
+            else:
+                save(upload.filename or "", upload.file)
+        
+        for name in saved:
+            os.replace(staging_dir / name, inputs_dir / name)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    
+    return saved
+
+
+def auto_analyze_case(device_id: str, case_id: str, case_doc: Optional[dict], background_tasks: BackgroundTasks):
+    """
+    Queue the analysis of a case created with expected_file_count once all its files have arrived
+    
+    The status change uploading -> queued is a single conditional update, so with concurrent
+    uploads only one request queues the job. If the job cannot be enqueued, the case goes
+    back to uploading, so a retried upload (or the analyze call) queues it.
+    
+    Args:
+        case_doc: Case document after the file count update (None without MongoDB)
+        
+    Returns:
+        Job id if the analysis was queued by this call, otherwise None
+    """
+    if not case_doc or not case_doc.get("expected_file_count"):
+        return None
+    if case_doc.get("file_count", 0) < case_doc["expected_file_count"]:
+        return None
+    
+    kwargs = case_analysis_kwargs(device_id, case_id, series_uid=case_doc.get("series_uid"))
+    claimed = jobs_collection.find_one_and_update(
+        {"case_id": case_id, "device_id": device_id, "status": "uploading"},
+        {"$set": {
+            "job_id": case_id,
+            "status": "queued",
+            "auto_analyzed": True,
+            "updated_at": datetime.utcnow().isoformat(),
+            "extract_dir": kwargs["extract_dir"],
+            "result_dir": kwargs["result_dir"],
+            "param_file": kwargs["param_file"]
+        }}
+    )
+    if claimed is None:
+        return None
+    
+    try:
+        queue_case_analysis(device_id, case_id, kwargs, case_doc.get("priority", "urgent"), background_tasks)
+    except Exception as e:
         jobs_collection.update_one(
-            {"case_id": case_id, "device_id": device_id},
-            {
-                "$inc": {"file_count": 1},
-                "$set": {"updated_at": datetime.utcnow().isoformat()}
-            }
+            {"case_id": case_id, "device_id": device_id, "status": "queued"},
+            {"$set": {"status": "uploading", "auto_analyzed": False, "updated_at": datetime.utcnow().isoformat()}}
         )
+        raise HTTPException(status_code=500, detail=f"Failed to queue the analysis: {str(e)}")
+    return case_id
+
+
+def case_analysis_kwargs(device_id: str, case_id: str, force_registration: bool = False,
+                         series_uid: Optional[str] = None, profile: bool = False) -> dict:
+    """Arguments of process_ctqa_analysis for a case (results go to the case root folder)"""
+    case_dir = get_cases_dir(device_id) / case_id
+    return dict(
+        ctqa_job_id=case_id,  # Use case_id as job_id
+        extract_dir=str(case_dir / "0.inputs"),
+        result_dir=str(case_dir),
+        param_file=str(get_param_file(device_id)),
+        force_registration=force_registration,
+        series_uid=series_uid,
+        profile=profile
+    )
+
+
+def run_case_analysis(device_id: str, case_id: str, kwargs: dict):
+    """Run the analysis of a case in this process (no job queue) and set the case status"""
+    try:
+        process_ctqa_analysis(**kwargs)
+        if jobs_collection is not None:
+            jobs_collection.update_one(
+                {"case_id": case_id, "device_id": device_id},
+                {"$set": {"status": "completed", "updated_at": datetime.utcnow().isoformat()}}
+            )
+    except Exception as e:
+        if jobs_collection is not None:
+            jobs_collection.update_one(
+                {"case_id": case_id, "device_id": device_id},
+                {"$set": {"status": "failed", "error": str(e), "updated_at": datetime.utcnow().isoformat()}}
+            )
+        raise
+
+
+def queue_case_analysis(device_id: str, case_id: str, kwargs: dict, priority: str,
+                        background_tasks: Optional[BackgroundTasks] = None):
+    """
+    Enqueue the analysis of a case; without Redis it runs in background_tasks if given,
+    otherwise synchronously
+    """
+    if job_queue:
+        enqueue_device_job(redis_conn, process_ctqa_analysis, device_id, kwargs,
+                           priority=priority, job_timeout=JOB_TIMEOUT)
+    elif background_tasks is not None:
+        background_tasks.add_task(run_case_analysis, device_id, case_id, kwargs)
+    else:
+        run_case_analysis(device_id, case_id, kwargs)
+
+
+@app.get("/api/devices/{device_id}/cases/{case_id}/series")
+async def list_case_series(device_id: str, case_id: str):
+    """
+    List the DICOM series uploaded to a case (from the series index of 0.inputs)
+    
+    Read-only: files not in the index yet are parsed, but the index is not updated
+    (see index_case_series).
+    
+    Args:
+        device_id: Device identifier
+        case_id: Case identifier
+        
+    Returns:
+        Series (UID, modality, number of slices, ...), largest first
+    """
+    inputs_dir = get_cases_dir(device_id) / case_id / "0.inputs"
+    if not inputs_dir.exists():
+        raise HTTPException(status_code=404, detail=f"Case {case_id} not found for device {device_id}")
     
-    return {"filename": file.filename, "status": "uploaded"}
+    index = await run_in_threadpool(index_dicom_directory, str(inputs_dir), write=False)
+    return {"case_id": case_id, "series": summarize_dicom_series(index)}
+
+
+@app.post("/api/devices/{device_id}/cases/{case_id}/series")
+async def index_case_series(device_id: str, case_id: str):
+    """
+    Update the series index of a case's 0.inputs (new and changed files are parsed) and list its series
+    
+    The analysis updates the index too; indexing once the upload is complete makes the
+    series listing and the analysis skip the header parsing.
+    
+    Args:
+        device_id: Device identifier
+        case_id: Case identifier
+        
+    Returns:
+        Series (UID, modality, number of slices, ...), largest first
+    """
+    inputs_dir = get_cases_dir(device_id) / case_id / "0.inputs"
+    if not inputs_dir.exists():
+        raise HTTPException(status_code=404, detail=f"Case {case_id} not found for device {device_id}")
+    
+    index = await run_in_threadpool(index_dicom_directory, str(inputs_dir))
+    return {"case_id": case_id, "series": summarize_dicom_series(index)}
 
 
 @app.post("/api/devices/{device_id}/cases/{case_id}/analyze", response_model=JobCreateResponse)
-async def start_case_analysis(device_id: str, case_id: str):
+async def start_case_analysis(device_id: str, case_id: str, force_registration: bool = False,
+                              series_uid: Optional[str] = None, profile: bool = False,
+                              priority: str = "urgent"):
     """
     Start analysis on an uploaded case
     
     Args:
         device_id: Device identifier
         case_id: Case identifier
+        force_registration: Re-run the registration even if a cached transform matches the inputs
+        series_uid: SeriesInstanceUID to analyze (optional, default: the largest CT series)
+        profile: Profile this job with cProfile (written to 3.analysis/profile.prof and profile.txt)
+        priority: Job queue: urgent (default, a new QA case), normal or batch
         
     Returns:
         Job information
     """
+    check_priority(priority)
     cases_dir = get_cases_dir(device_id)
     case_dir = cases_dir / case_id
     inputs_dir = case_dir / "0.inputs"
-    param_file = get_param_file(device_id)
     
     if not inputs_dir.exists():
         raise HTTPException(status_code=404, detail=f"Case {case_id} not found for device {device_id}")
@@ -460,15 +812,14 @@ async def start_case_analysis(device_id: str, case_id: str):
     # Count DICOM files in 0.inputs folder (case-insensitive)
     dicom_files = list(inputs_dir.glob("*.dcm")) + list(inputs_dir.glob("*.DCM"))
     # Also include files without extension (common for DICOM)
-    all_files = [f for f in inputs_dir.iterdir() if f.is_file()]
+    all_files = [f for f in inputs_dir.iterdir() if f.is_file() and f.name != SERIES_INDEX_FILE]
     
     if len(all_files) == 0:
         raise HTTPException(status_code=400, detail="No files found in case 0.inputs folder")
     
-    # Use case_id as job_id
+    # Use case_id as job_id; results go to the case root folder
     job_id = case_id
-    # Results go to the case root folder
-    result_dir = str(case_dir)
+    kwargs = case_analysis_kwargs(device_id, case_id, force_registration, series_uid, profile)
     
     # Update status in MongoDB
     if jobs_collection is not None:
@@ -479,39 +830,18 @@ async def start_case_analysis(device_id: str, case_id: str):
                     "job_id": job_id,
                     "status": "queued",
                     "updated_at": datetime.utcnow().isoformat(),
-                    "extract_dir": str(inputs_dir),
-                    "result_dir": result_dir,
-                    "param_file": str(param_file)
+                    "extract_dir": kwargs["extract_dir"],
+                    "result_dir": kwargs["result_dir"],
+                    "param_file": kwargs["param_file"]
                 }
             }
         )
     
-    # Enqueue job with device-specific config
-    if job_queue:
-        job_queue.enqueue(
-            process_ctqa_analysis,
-            ctqa_job_id=job_id,
-            extract_dir=str(inputs_dir),
-            result_dir=result_dir,
-            param_file=str(param_file),
-            job_timeout=JOB_TIMEOUT
-        )
-    else:
-        # Fallback: process synchronously
-        try:
-            process_ctqa_analysis(job_id, str(inputs_dir), result_dir, str(param_file))
-            if jobs_collection is not None:
-                jobs_collection.update_one(
-                    {"case_id": case_id, "device_id": device_id},
-                    {"$set": {"status": "completed", "updated_at": datetime.utcnow().isoformat()}}
-                )
-        except Exception as e:
-            if jobs_collection is not None:
-                jobs_collection.update_one(
-                    {"case_id": case_id, "device_id": device_id},
-                    {"$set": {"status": "failed", "error": str(e), "updated_at": datetime.utcnow().isoformat()}}
-                )
-            raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+    # Enqueue job with device-specific config (fallback: process synchronously)
+    try:
+        queue_case_analysis(device_id, case_id, kwargs, priority)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
     
     return JobCreateResponse(
         job_id=job_id,
@@ -520,6 +850,109 @@ async def start_case_analysis(device_id: str, case_id: str):
     )
 
 
+@app.post("/api/devices/{device_id}/cases/{case_id}/review-images")
+async def create_case_review_images(device_id: str, case_id: str, background_tasks: BackgroundTasks):
+    """
+    Write the registration review images (1.reg/result.mhd, 1.reg/resampled.mha) of an analyzed case
+    
+    These are not written by the analysis itself.
+    
+    Args:
+        device_id: Device identifier
+        case_id: Case identifier
+        
+    Returns:
+        Status message
+    """
+    case_dir = get_cases_dir(device_id) / case_id
+    if not (case_dir / "1.reg" / "TransformParameters.0.tfm").exists():
+        raise HTTPException(status_code=404, detail=f"No registration found for case {case_id} of device {device_id}")
+    
+    param_file = str(get_param_file(device_id))
+    if job_queue:
+        enqueue_device_job(redis_conn, process_review_images, device_id,
+                           dict(ctqa_job_id=case_id, result_dir=str(case_dir), param_file=param_file),
+                           priority="batch", job_timeout=JOB_TIMEOUT)
+    else:
+        background_tasks.add_task(process_review_images, case_id, str(case_dir), param_file)
+    
+    return {"case_id": case_id, "status": "queued", "message": "Review images will be written to 1.reg"}
+
+
+@app.post("/api/devices/{device_id}/baseline/compile")
+async def compile_device_baseline(device_id: str, background_tasks: BackgroundTasks):
+    """
+    Compile the baseline of a device: per-key label maps, ROI bounding boxes and mask labels
+    are written to the device's baseline_compiled folder and used by all later analyses
+    
+    Run again after the baseline is re-commissioned.
+    
+    Args:
+        device_id: Device identifier
+        
+    Returns:
+        Status message
+    """
+    if not get_baseline_dir(device_id).exists():
+        raise HTTPException(status_code=404, detail=f"No baseline found for device {device_id}")
+    
+    param_file = str(get_param_file(device_id))
+    if job_queue:
+        enqueue_device_job(redis_conn, process_compile_baseline, device_id,
+                           dict(device_id=device_id, param_file=param_file), job_timeout=JOB_TIMEOUT)
+    else:
+        background_tasks.add_task(process_compile_baseline, device_id, param_file)
+    
+    return {"device_id": device_id, "status": "queued",
+            "message": f"Baseline will be compiled to {get_compiled_baseline_dir(device_id)}"}
+
+
+@app.post("/api/devices/{device_id}/reports/regenerate")
+async def regenerate_device_reports(device_id: str, background_tasks: BackgroundTasks,
+                                    case_id: Optional[str] = None, priority: str = "batch"):
+    """
+    Regenerate report.html and analysis_results.json from the existing analysis results
+    (no registration or measurements), e.g. after a tolerance or report template change
+    
+    Args:
+        device_id: Device identifier
+        case_id: Case to regenerate (optional, default: all processed cases of the device)
+        priority: Job queue: urgent, normal or batch (default)
+        
+    Returns:
+        Status message
+    """
+    check_priority(priority)
+    if not get_device_dir(device_id).exists():
+        raise HTTPException(status_code=404, detail=f"Device {device_id} not found")
+    if case_id and not (get_cases_dir(device_id) / case_id / "3.analysis").exists():
+        raise HTTPException(status_code=404, detail=f"No analysis results for case {case_id} of device {device_id}")
+    
+    param_file = str(get_param_file(device_id))
+    case_ids = [case_id] if case_id else None
+    if job_queue:
+        enqueue_device_job(redis_conn, process_regenerate_reports, device_id,
+                           dict(device_id=device_id, param_file=param_file, case_ids=case_ids),
+                           priority=priority, job_timeout=JOB_TIMEOUT)
+    else:
+        background_tasks.add_task(process_regenerate_reports, device_id, param_file, case_ids)
+    
+    return {"device_id": device_id, "case_id": case_id, "status": "queued",
+            "message": f"Reports of {case_id or 'all cases'} will be regenerated"}
+
+
+@app.get("/api/queues")
+async def get_queue_status():
+    """
+    Job queue depths (queued, running, failed per priority), worker utilization (share of
+    the worker's uptime spent on jobs) and the running jobs of each device
+    """
+    if redis_conn is None or job_queue is None:
+        raise HTTPException(status_code=503, detail="Job queue not available")
+    device_ids = [d.name for d in sorted(DATA_DIR.iterdir()) if d.is_dir()] if DATA_DIR.exists() else []
+    return queue_status(redis_conn, device_ids)
+
+
 @app.get("/api/cases/{case_id}")
 async def get_case_status(case_id: str):
     """Get case upload status"""
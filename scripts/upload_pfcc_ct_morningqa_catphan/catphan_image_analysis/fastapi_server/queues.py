@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+CTQA job queues - priority queues and a per-device cap on in-flight jobs, shared by the API and the workers
+"""
+
+import os
+import time
+import logging
+from datetime import datetime, timezone, timedelta
+from rq import Queue, Worker, get_current_job
+from rq.registry import StartedJobRegistry, FailedJobRegistry
+
+# Queue of each priority; workers take jobs from the queues in this order, so an urgent
+# job starts before any queued normal or batch job. "normal" keeps the original queue
+# name, so jobs enqueued before the priority queues existed are still processed.
+QUEUE_NAME = "ctqa_analysis"
+PRIORITIES = ["urgent", "normal", "batch"]
+DEFAULT_PRIORITY = "normal"
+
+# Jobs of one device running at the same time (0: no limit). A job that finds its device
+# at the cap is scheduled again CTQA_DEVICE_RETRY_SECONDS later, at the front of its queue
+# (the RQ scheduler of the workers moves it back, see run_worker.py).
+CTQA_MAX_JOBS_PER_DEVICE = int(os.getenv("CTQA_MAX_JOBS_PER_DEVICE", "1"))
+CTQA_DEVICE_RETRY_SECONDS = float(os.getenv("CTQA_DEVICE_RETRY_SECONDS", "5"))
+# Slots of jobs that did not release them (killed work horse) expire after this many seconds
+CTQA_DEVICE_SLOT_TIMEOUT = int(os.getenv("CTQA_DEVICE_SLOT_TIMEOUT", os.getenv("JOB_TIMEOUT", "600")))
+
+DEVICE_SLOTS_KEY = "ctqa:device_jobs:{device_id}"
+
+# Sorted set of the running job ids of a device (score: start time); expired slots are
+# dropped, then a slot is taken if the device is below the cap
+_ACQUIRE_SLOT_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1] - ARGV[3])
+if redis.call('ZSCORE', KEYS[1], ARGV[4]) then
+    return 1
+end
+if tonumber(ARGV[2]) > 0 and redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[1], ARGV[4])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+
+def queue_name(priority=DEFAULT_PRIORITY):
+    """
+    Redis queue name of a priority
+
+    Args:
+        priority: "urgent", "normal" or "batch"
+
+    Returns:
+        Queue name ("ctqa_analysis:urgent", "ctqa_analysis", "ctqa_analysis:batch")
+    """
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority: {priority} (expected one of {PRIORITIES})")
+    return QUEUE_NAME if priority == "normal" else f"{QUEUE_NAME}:{priority}"
+
+
+def get_queues(redis_conn, priorities=None):
+    """
+    Queues of the priorities, highest priority first
+
+    Args:
+        redis_conn: Redis connection
+        priorities: List of priorities (default: all)
+
+    Returns:
+        List of rq.Queue
+    """
+    priorities = priorities or PRIORITIES
+    return [Queue(queue_name(p), connection=redis_conn) for p in PRIORITIES if p in priorities]
+
+
+def enqueue_device_job(redis_conn, func, device_id, kwargs, priority=DEFAULT_PRIORITY, job_timeout=None):
+    """
+    Enqueue a job of a device on the queue of a priority
+
+    The job runs through run_device_job, so at most CTQA_MAX_JOBS_PER_DEVICE jobs of the
+    device run at the same time, whichever workers pick them up.
+
+    Args:
+        redis_conn: Redis connection
+        func: Job function (importable by the worker, e.g. worker.process_ctqa_analysis)
+        device_id: Device identifier
+        kwargs: Keyword arguments of func
+        priority: "urgent", "normal" or "batch"
+        job_timeout: RQ job timeout in seconds
+
+    Returns:
+        rq.job.Job
+    """
+    queue = Queue(queue_name(priority), connection=redis_conn)
+    return queue.enqueue(run_device_job, func, device_id, kwargs, job_timeout=job_timeout,
+                         description=f"{func.__name__} ({device_id}, {priority})")
+
+
+def acquire_device_slot(redis_conn, device_id, job_id, max_jobs=None):
+    """
+    Take an in-flight slot of a device
+
+    Returns:
+        True if the slot was taken (or the job already holds it), False if the device is at the cap
+    """
+    max_jobs = CTQA_MAX_JOBS_PER_DEVICE if max_jobs is None else max_jobs
+    key = DEVICE_SLOTS_KEY.format(device_id=device_id)
+    acquired = redis_conn.eval(_ACQUIRE_SLOT_SCRIPT, 1, key, time.time(), max_jobs, CTQA_DEVICE_SLOT_TIMEOUT, job_id)
+    return bool(acquired)
+
+
+def release_device_slot(redis_conn, device_id, job_id):
+    """Release the in-flight slot of a device held by a job"""
+    redis_conn.zrem(DEVICE_SLOTS_KEY.format(device_id=device_id), job_id)
+
+
+def device_jobs(redis_conn, device_id):
+    """Ids of the running jobs of a device"""
+    key = DEVICE_SLOTS_KEY.format(device_id=device_id)
+    redis_conn.zremrangebyscore(key, "-inf", time.time() - CTQA_DEVICE_SLOT_TIMEOUT)
+    return [job_id.decode() if isinstance(job_id, bytes) else job_id for job_id in redis_conn.zrange(key, 0, -1)]
+
+
+def run_device_job(func, device_id, kwargs):
+    """
+    Run a job of a device within the per-device cap (the function RQ executes, see enqueue_device_job)
+
+    If the device is at the cap, the job is scheduled again CTQA_DEVICE_RETRY_SECONDS later at
+    the front of the queue it came from, and the worker moves on to jobs of other devices.
+    The deferred run is not kept in the finished job registry.
+    """
+    job = get_current_job()
+    if not acquire_device_slot(job.connection, device_id, job.id):
+        retry = Queue(job.origin, connection=job.connection).enqueue_in(
+            timedelta(seconds=CTQA_DEVICE_RETRY_SECONDS), run_device_job, func, device_id, kwargs,
+            job_timeout=job.timeout, description=job.description, at_front=True)
+        logging.info(f"Device {device_id} at {CTQA_MAX_JOBS_PER_DEVICE} running jobs, "
+                     f"job {job.id} deferred as {retry.id}")
+        job.result_ttl = 0
+        return {"status": "deferred", "device_id": device_id, "retry_job_id": retry.id}
+
+    try:
+        return func(**kwargs)
+    finally:
+        release_device_slot(job.connection, device_id, job.id)
+
+
+def _seconds_since(timestamp):
+    if timestamp is None:
+        return None
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - timestamp).total_seconds()
+
+
+def queue_status(redis_conn, device_ids=()):
+    """
+    Queue depths, worker utilization and in-flight jobs per device
+
+    Args:
+        redis_conn: Redis connection
+        device_ids: Devices to report the running jobs of
+
+    Returns:
+        Dictionary with "queues", "workers" and "devices"
+    """
+    queues = []
+    for priority, queue in zip(PRIORITIES, get_queues(redis_conn)):
+        queues.append({
+            "name": queue.name,
+            "priority": priority,
+            "queued": queue.count,
+            "started": StartedJobRegistry(queue=queue).count,
+            "failed": FailedJobRegistry(queue=queue).count,
+        })
+
+    workers = []
+    for worker in Worker.all(connection=redis_conn):
+        uptime = _seconds_since(worker.birth_date)
+        working = worker.total_working_time or 0
+        job = worker.get_current_job()
+        workers.append({
+            "name": worker.name,
+            "state": worker.get_state(),
+            "queues": worker.queue_names(),
+            "current_job": job.description if job else None,
+            "successful_jobs": worker.successful_job_count,
+            "failed_jobs": worker.failed_job_count,
+            "working_seconds": round(working, 1),
+            "uptime_seconds": round(uptime, 1) if uptime is not None else None,
+            "utilization": round(working / uptime, 3) if uptime else None,
+        })
+
+    devices = {device_id: device_jobs(redis_conn, device_id) for device_id in device_ids}
+    return {
+        "queues": queues,
+        "workers": workers,
+        "devices": devices,
+        "max_jobs_per_device": CTQA_MAX_JOBS_PER_DEVICE,
+    }
@@ -5,15 +5,23 @@ Script to run RQ worker for processing CTQA analysis jobs
 
 import os
 import sys
+import argparse
 from pathlib import Path
 from dotenv import load_dotenv
-from rq import Worker, Queue, Connection
+from rq import Worker, SimpleWorker, Connection
 import redis
 
 load_dotenv()
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6381/0")
 PARAM_FILE = os.getenv("PARAM_FILE", "./_data/devices/pfcc_gect_catphan604/param.txt")
+# Priorities the worker takes jobs of, highest first (see queues.py)
+CTQA_WORKER_QUEUES = os.getenv("CTQA_WORKER_QUEUES", "urgent,normal,batch")
+# "fork": RQ forks a work horse per job (default); "simple": jobs run in the worker process,
+# so imports, MongoDB connection and caches stay warm from job to job
+CTQA_WORKER_MODE = os.getenv("CTQA_WORKER_MODE", "fork")
+# Jobs after which the worker exits (0: no limit); supervisor.py starts a fresh worker
+CTQA_WORKER_MAX_JOBS = int(os.getenv("CTQA_WORKER_MAX_JOBS", "0"))
 
 
 def check_config_files():
@@ -65,6 +73,16 @@ def check_config_files():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CTQA RQ worker")
+    parser.add_argument("--queues", default=CTQA_WORKER_QUEUES,
+                        help="Comma-separated priorities to take jobs of, highest first (default: urgent,normal,batch)")
+    parser.add_argument("--name", default=None, help="Worker name (default: generated by RQ)")
+    parser.add_argument("--mode", choices=["fork", "simple"], default=CTQA_WORKER_MODE,
+                        help="fork: a work horse process per job; simple: jobs run in the worker process (default: fork)")
+    parser.add_argument("--max-jobs", type=int, default=CTQA_WORKER_MAX_JOBS,
+                        help="Exit after this many jobs, 0 for no limit (default: 0)")
+    args = parser.parse_args()
+    
     # Check config files before starting
     config_ok = check_config_files()
     
@@ -72,11 +90,24 @@ if __name__ == "__main__":
         print("WARNING: Starting worker despite missing config files.")
         print("Jobs will fail until config files are provided.\n")
     
+    # Import the job modules and load the device baselines once; jobs run in this process
+    # (simple mode) or in work horses forked from it, so they start warm
+    from worker import warm_imports, preload_baselines, CTQA_PRELOAD_BASELINES
+    warm_imports()
+    if CTQA_PRELOAD_BASELINES:
+        print(f"Preloading baselines: {CTQA_PRELOAD_BASELINES}")
+        print(f"Preloaded: {preload_baselines()}")
+    
+    from queues import get_queues
+    
     print(f"Connecting to Redis: {REDIS_URL}")
     redis_conn = redis.from_url(REDIS_URL)
-    queue = Queue("ctqa_analysis", connection=redis_conn)
+    queues = get_queues(redis_conn, [p.strip() for p in args.queues.split(",") if p.strip()])
     
-    print(f"Starting worker for queue: ctqa_analysis")
+    worker_class = SimpleWorker if args.mode == "simple" else Worker
+    print(f"Starting {args.mode} worker for queues: {', '.join(q.name for q in queues)}"
+          + (f" (exits after {args.max_jobs} jobs)" if args.max_jobs else ""))
     with Connection(redis_conn):
-        worker = Worker([queue])
-        worker.work()
+        worker = worker_class(queues, name=args.name)
+        # The scheduler puts the jobs deferred by the per-device cap back in their queues
+        worker.work(max_jobs=args.max_jobs or None, with_scheduler=True)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Worker supervisor - runs several CTQA RQ workers (run_worker.py) and restarts them when they exit
+
+Workers take jobs from the priority queues (see queues.py). Dedicated urgent workers only take
+urgent jobs, so a morning QA case starts even while all other workers run a batch re-analysis.
+"""
+
+import os
+import sys
+import time
+import uuid
+import signal
+import argparse
+import subprocess
+from pathlib import Path
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Workers taking jobs of all priorities, and workers taking only urgent jobs
+CTQA_WORKERS = int(os.getenv("CTQA_WORKERS", "2"))
+CTQA_URGENT_WORKERS = int(os.getenv("CTQA_URGENT_WORKERS", "1"))
+
+RUN_WORKER = str(Path(__file__).parent / "run_worker.py")
+
+# Restart delay of a worker that exited, doubled while it keeps exiting within MIN_UPTIME seconds
+RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 60.0
+MIN_UPTIME = 30.0
+
+
+class WorkerProcess:
+    """A run_worker.py child process and its restart state"""
+
+    def __init__(self, role, index, queues):
+        self.role = role
+        self.index = index
+        self.queues = queues
+        self.process = None
+        self.started_at = None
+        self.restart_delay = RESTART_DELAY
+        self.restart_at = 0.0
+
+    def start(self):
+        name = f"ctqa-{self.role}{self.index}-{uuid.uuid4().hex[:8]}"
+        # In a session of its own the worker does not get the terminal's Ctrl+C, only the
+        # one SIGTERM of stop(); RQ takes a second signal as a cold shutdown of the running job
+        self.process = subprocess.Popen([sys.executable, RUN_WORKER, "--queues", self.queues, "--name", name],
+                                        start_new_session=True)
+        self.started_at = time.time()
+        print(f"Started worker {name} (pid {self.process.pid}, queues: {self.queues})")
+
+    def check(self):
+        """Restart the worker if it exited (after the restart delay)"""
+        now = time.time()
+        if self.process is not None:
+            code = self.process.poll()
+            if code is None:
+                return
+            uptime = now - self.started_at
+            if code == 0 or uptime >= MIN_UPTIME:
+                self.restart_delay = RESTART_DELAY
+            else:
+                self.restart_delay = min(self.restart_delay * 2, MAX_RESTART_DELAY)
+            # A clean exit (e.g. after CTQA_WORKER_MAX_JOBS jobs) is replaced right away
+            delay = 0.0 if code == 0 else self.restart_delay
+            print(f"Worker {self.role}{self.index} (pid {self.process.pid}) exited with code {code} "
+                  f"after {uptime:.0f} s, restarting in {delay:.0f} s")
+            self.process = None
+            self.restart_at = now + delay
+        if now >= self.restart_at:
+            self.start()
+
+    def stop(self):
+        """Ask the worker to finish its current job and exit (RQ warm shutdown)"""
+        if self.process is not None and self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run and supervise CTQA RQ workers")
+    parser.add_argument("--workers", type=int, default=CTQA_WORKERS,
+                        help="Workers taking jobs of all priorities, urgent first (default: CTQA_WORKERS or 2)")
+    parser.add_argument("--urgent-workers", type=int, default=CTQA_URGENT_WORKERS,
+                        help="Workers taking only urgent jobs (default: CTQA_URGENT_WORKERS or 1)")
+    args = parser.parse_args()
+
+    workers = [WorkerProcess("urgent", i, "urgent") for i in range(args.urgent_workers)]
+    workers += [WorkerProcess("worker", i, "urgent,normal,batch") for i in range(args.workers)]
+    if not workers:
+        print("No workers configured")
+        return
+
+    stopping = []
+    def handle_signal(signum, frame):
+        stopping.append(signum)
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    for worker in workers:
+        worker.start()
+
+    while not stopping:
+        time.sleep(1)
+        for worker in workers:
+            if not stopping:
+                worker.check()
+
+    print("Stopping workers (current jobs are finished first)...")
+    for worker in workers:
+        worker.stop()
+    for worker in workers:
+        if worker.process is not None:
+            worker.process.wait()
+
+
+if __name__ == "__main__":
+    main()
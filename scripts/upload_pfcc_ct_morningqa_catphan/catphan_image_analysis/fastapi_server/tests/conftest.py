@@ -0,0 +1,28 @@
+import sys
+import pytest
+from pathlib import Path
+
+# The server modules import each other (and the CTQA modules) by name
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parents[3] / "python_app"))
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """
+    The API (main.py) on a device "dev1" in tmp_path, with an in-memory jobs collection and
+    a recorded job queue; server.enqueued lists the kwargs of the enqueued analyses
+    """
+    mongomock = pytest.importorskip("mongomock")
+    monkeypatch.setenv("DATA_DIR", str(tmp_path / "devices"))
+    (tmp_path / "devices" / "dev1").mkdir(parents=True)
+    import main
+
+    enqueued = []
+    monkeypatch.setattr(main, "DATA_DIR", tmp_path / "devices")
+    monkeypatch.setattr(main, "jobs_collection", mongomock.MongoClient().db.jobs)
+    monkeypatch.setattr(main, "job_queue", True)
+    monkeypatch.setattr(main, "enqueue_device_job", lambda redis_conn, func, device_id, kwargs, **options:
+                        enqueued.append(kwargs))
+    monkeypatch.setattr(main, "enqueued", enqueued, raising=False)
+    return main
@@ -0,0 +1,70 @@
+import pytest
+
+fastapi = pytest.importorskip("fastapi")
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client(server):
+    with TestClient(server.app) as client:
+        yield client
+
+
+def create_case(client, expected_file_count):
+    response = client.post("/api/devices/dev1/cases", params={"expected_file_count": expected_file_count})
+    response.raise_for_status()
+    return response.json()["case_id"]
+
+
+def upload(client, case_id, name):
+    return client.post(f"/api/devices/dev1/cases/{case_id}/files", files={"file": (name, b"dicom")})
+
+
+def case_doc(server, case_id):
+    return server.jobs_collection.find_one({"case_id": case_id})
+
+
+def test_analysis_is_queued_by_the_last_distinct_file(client, server):
+    case_id = create_case(client, 3)
+
+    for name in ["CT1.dcm", "CT2.dcm", "CT2.dcm"]:
+        assert "job_id" not in upload(client, case_id, name).json()
+    assert case_doc(server, case_id)["file_count"] == 2
+    assert server.enqueued == []
+
+    assert upload(client, case_id, "CT3.dcm").json()["job_id"] == case_id
+    assert upload(client, case_id, "CT3.dcm").json().get("job_id") is None
+    assert [kwargs["ctqa_job_id"] for kwargs in server.enqueued] == [case_id]
+    assert case_doc(server, case_id)["status"] == "queued"
+
+
+def test_retried_batch_upload_is_counted_once(client, server):
+    case_id = create_case(client, 3)
+    parts = [("files", ("CT1.dcm", b"1")), ("files", ("CT2.dcm", b"2"))]
+
+    for _ in range(2):
+        response = client.post(f"/api/devices/dev1/cases/{case_id}/files/batch", files=parts)
+        assert response.json()["file_count"] == 2
+        assert "job_id" not in response.json()
+    assert case_doc(server, case_id)["file_count"] == 2
+    assert server.enqueued == []
+
+
+def test_case_goes_back_to_uploading_if_the_job_cannot_be_enqueued(client, server, monkeypatch):
+    case_id = create_case(client, 1)
+
+    failures = [ConnectionError("Redis is down")]
+    def enqueue(redis_conn, func, device_id, kwargs, **options):
+        if failures:
+            raise failures.pop()
+        server.enqueued.append(kwargs)
+    monkeypatch.setattr(server, "enqueue_device_job", enqueue)
+
+    response = upload(client, case_id, "CT1.dcm")
+    assert response.status_code == 500
+    assert "Redis is down" in response.json()["detail"]
+    assert case_doc(server, case_id)["status"] == "uploading"
+
+    # The retried upload queues the analysis
+    assert upload(client, case_id, "CT1.dcm").json()["job_id"] == case_id
+    assert case_doc(server, case_id)["status"] == "queued"
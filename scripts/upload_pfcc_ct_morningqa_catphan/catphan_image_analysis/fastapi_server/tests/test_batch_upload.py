@@ -0,0 +1,96 @@
+import io
+import tarfile
+import zipfile
+import pytest
+
+fastapi = pytest.importorskip("fastapi")
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client(server):
+    with TestClient(server.app) as client:
+        yield client
+
+
+@pytest.fixture
+def case_dir(client, server):
+    response = client.post("/api/devices/dev1/cases")
+    response.raise_for_status()
+    return server.DATA_DIR / "dev1" / "cases" / response.json()["case_id"]
+
+
+def make_zip(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in files:
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def make_tar(files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for name, data in files:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def upload(client, case_dir, parts):
+    return client.post(f"/api/devices/dev1/cases/{case_dir.name}/files/batch",
+                       files=[("files", part) for part in parts])
+
+
+def input_files(case_dir):
+    return {p.name: p.read_bytes() for p in (case_dir / "0.inputs").iterdir()}
+
+
+def test_files_and_archives_are_saved(client, case_dir):
+    parts = [
+        ("CT1.dcm", b"1"),
+        ("series.zip", make_zip([("a/CT2.dcm", b"2"), ("__MACOSX/._CT2.dcm", b"x"), (".hidden", b"x")])),
+        ("series.tar.gz", make_tar([("b/CT3.dcm", b"3")])),
+    ]
+
+    response = upload(client, case_dir, parts)
+
+    assert response.status_code == 200
+    assert response.json()["file_count"] == 3
+    assert input_files(case_dir) == {"CT1.dcm": b"1", "CT2.dcm": b"2", "CT3.dcm": b"3"}
+
+
+def test_same_names_are_saved_without_overwriting(client, case_dir):
+    parts = [("2_CT.dcm", b"a"), ("CT.dcm", b"b"), ("CT.dcm", b"c"), ("1_CT.dcm", b"d"), ("CT.dcm", b"e")]
+
+    response = upload(client, case_dir, parts)
+
+    assert response.json()["file_count"] == 5
+    assert sorted(input_files(case_dir).values()) == [b"a", b"b", b"c", b"d", b"e"]
+
+
+def test_uploads_over_the_limits_are_rejected(client, case_dir, server, monkeypatch):
+    monkeypatch.setattr(server, "CTQA_MAX_UPLOAD_FILES", 2)
+    response = upload(client, case_dir, [("series.zip", make_zip([(f"CT{i}.dcm", b"1") for i in range(3)]))])
+    assert response.status_code == 413
+    response = upload(client, case_dir, [("series.tar", make_tar([(f"CT{i}.dcm", b"1") for i in range(3)]))])
+    assert response.status_code == 413
+
+    monkeypatch.setattr(server, "CTQA_MAX_UPLOAD_FILES", 100)
+    monkeypatch.setattr(server, "CTQA_MAX_UPLOAD_MB", 1)
+    bomb = make_zip([("CT1.dcm", bytes(600 * 1024)), ("CT2.dcm", bytes(600 * 1024))])
+    assert len(bomb) < 100 * 1024
+    response = upload(client, case_dir, [("series.zip", bomb)])
+    assert response.status_code == 413
+
+    assert input_files(case_dir) == {}
+
+
+def test_failed_upload_leaves_no_files(client, case_dir):
+    truncated = make_tar([(f"CT{i}.dcm", bytes(64 * 1024)) for i in range(4)])[:-2000]
+
+    response = upload(client, case_dir, [("CT0.dcm", b"0"), ("series.tar.gz", truncated)])
+
+    assert response.status_code == 400
+    assert input_files(case_dir) == {}
@@ -0,0 +1,65 @@
+import io
+import pytest
+
+fastapi = pytest.importorskip("fastapi")
+pydicom = pytest.importorskip("pydicom")
+from fastapi.testclient import TestClient
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+from dicomtools import SERIES_INDEX_FILE
+
+
+@pytest.fixture
+def client(server):
+    with TestClient(server.app) as client:
+        yield client
+
+
+def make_slice(series_uid, z):
+    """Header of a CT slice (no pixel data), as DICOM file bytes"""
+    ds = Dataset()
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.2"
+    ds.file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds.SOPClassUID = ds.file_meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = ds.file_meta.MediaStorageSOPInstanceUID
+    ds.StudyInstanceUID = "1.2.3"
+    ds.SeriesInstanceUID = series_uid
+    ds.Modality = "CT"
+    ds.ImagePositionPatient = [0, 0, z]
+    ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+    ds.PixelSpacing = [0.5, 0.5]
+    ds.Rows = 4
+    ds.Columns = 4
+    buffer = io.BytesIO()
+    pydicom.dcmwrite(buffer, ds, write_like_original=False)
+    return buffer.getvalue()
+
+
+def test_series_listing_does_not_write_the_index(client, server):
+    case_id = client.post("/api/devices/dev1/cases").json()["case_id"]
+    inputs_dir = server.DATA_DIR / "dev1" / "cases" / case_id / "0.inputs"
+    parts = [("files", (f"CT{z}.dcm", make_slice("1.2.3.4", z))) for z in range(3)]
+    parts.append(("files", ("scout.dcm", make_slice("1.2.3.5", 0))))
+    client.post(f"/api/devices/dev1/cases/{case_id}/files/batch", files=parts).raise_for_status()
+
+    listed = client.get(f"/api/devices/dev1/cases/{case_id}/series").json()["series"]
+    assert [(s["series_uid"], s["num_of_slices"]) for s in listed] == [("1.2.3.4", 3), ("1.2.3.5", 1)]
+    assert not (inputs_dir / SERIES_INDEX_FILE).exists()
+
+    indexed = client.post(f"/api/devices/dev1/cases/{case_id}/series").json()["series"]
+    assert indexed == listed
+    assert (inputs_dir / SERIES_INDEX_FILE).exists()
+
+    mtime = (inputs_dir / SERIES_INDEX_FILE).stat().st_mtime_ns
+    (inputs_dir / "CT9.dcm").write_bytes(make_slice("1.2.3.4", 9))
+    listed = client.get(f"/api/devices/dev1/cases/{case_id}/series").json()["series"]
+    assert listed[0]["num_of_slices"] == 4
+    assert (inputs_dir / SERIES_INDEX_FILE).stat().st_mtime_ns == mtime
+
+
+def test_series_of_a_missing_case(client):
+    assert client.get("/api/devices/dev1/cases/20000101_000000/series").status_code == 404
+    assert client.post("/api/devices/dev1/cases/20000101_000000/series").status_code == 404
@@ -0,0 +1,103 @@
+import time
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from rq import Queue, SimpleWorker
+from rq.registry import FinishedJobRegistry, ScheduledJobRegistry
+from rq.scheduler import RQScheduler
+
+import queues
+from queues import (DEVICE_SLOTS_KEY, acquire_device_slot, release_device_slot, device_jobs,
+                    enqueue_device_job, queue_name)
+
+runs = []
+
+
+def record(case_id):
+    runs.append(case_id)
+    return case_id
+
+
+@pytest.fixture
+def redis_conn():
+    runs.clear()
+    return fakeredis.FakeStrictRedis()
+
+
+def run_jobs(redis_conn, priorities=("urgent", "normal", "batch")):
+    worker = SimpleWorker(queues.get_queues(redis_conn, list(priorities)), connection=redis_conn)
+    worker.work(burst=True)
+
+
+def move_scheduled_jobs(redis_conn, priority):
+    queue = Queue(queue_name(priority), connection=redis_conn)
+    scheduler = RQScheduler([queue], connection=redis_conn)
+    scheduler.acquire_locks()
+    scheduler.enqueue_scheduled_jobs()
+    scheduler.release_locks()
+
+
+def test_device_slots_are_capped(redis_conn):
+    assert acquire_device_slot(redis_conn, "ct1", "a", max_jobs=1)
+    assert acquire_device_slot(redis_conn, "ct1", "a", max_jobs=1)
+    assert not acquire_device_slot(redis_conn, "ct1", "b", max_jobs=1)
+    assert acquire_device_slot(redis_conn, "ct2", "b", max_jobs=1)
+    assert acquire_device_slot(redis_conn, "ct1", "b", max_jobs=0)
+    assert device_jobs(redis_conn, "ct1") == ["a", "b"]
+
+    release_device_slot(redis_conn, "ct1", "a")
+    release_device_slot(redis_conn, "ct1", "b")
+    assert acquire_device_slot(redis_conn, "ct1", "c", max_jobs=1)
+
+
+def test_expired_slots_are_dropped(redis_conn):
+    key = DEVICE_SLOTS_KEY.format(device_id="ct1")
+    redis_conn.zadd(key, {"killed": time.time() - queues.CTQA_DEVICE_SLOT_TIMEOUT - 1})
+
+    assert acquire_device_slot(redis_conn, "ct1", "a", max_jobs=1)
+    assert device_jobs(redis_conn, "ct1") == ["a"]
+
+
+def test_job_runs_and_releases_its_slot(redis_conn):
+    enqueue_device_job(redis_conn, record, "ct1", {"case_id": "case1"})
+    run_jobs(redis_conn)
+
+    assert runs == ["case1"]
+    assert device_jobs(redis_conn, "ct1") == []
+
+
+def test_job_of_a_device_at_the_cap_is_deferred(redis_conn, monkeypatch):
+    monkeypatch.setattr(queues, "CTQA_MAX_JOBS_PER_DEVICE", 1)
+    acquire_device_slot(redis_conn, "ct1", "running")
+    deferred = enqueue_device_job(redis_conn, record, "ct1", {"case_id": "case1"}, priority="urgent")
+    enqueue_device_job(redis_conn, record, "ct2", {"case_id": "case2"}, priority="urgent")
+
+    start = time.perf_counter()
+    run_jobs(redis_conn)
+
+    # The worker does not wait for the device, and runs the job of the other device
+    assert time.perf_counter() - start < queues.CTQA_DEVICE_RETRY_SECONDS
+    assert runs == ["case2"]
+    urgent = Queue(queue_name("urgent"), connection=redis_conn)
+    scheduled = ScheduledJobRegistry(queue=urgent).get_job_ids()
+    assert len(scheduled) == 1
+    assert deferred.id not in FinishedJobRegistry(queue=urgent).get_job_ids()
+    assert not redis_conn.exists(deferred.key)
+
+
+def test_deferred_job_goes_back_to_the_front_of_its_queue(redis_conn, monkeypatch):
+    monkeypatch.setattr(queues, "CTQA_MAX_JOBS_PER_DEVICE", 1)
+    monkeypatch.setattr(queues, "CTQA_DEVICE_RETRY_SECONDS", 0)
+    acquire_device_slot(redis_conn, "ct1", "running")
+    enqueue_device_job(redis_conn, record, "ct1", {"case_id": "case1"}, priority="urgent")
+    run_jobs(redis_conn)
+
+    # A later job of another device, then the device becomes free
+    enqueue_device_job(redis_conn, record, "ct2", {"case_id": "case2"}, priority="urgent")
+    release_device_slot(redis_conn, "ct1", "running")
+    move_scheduled_jobs(redis_conn, "urgent")
+    run_jobs(redis_conn)
+
+    assert runs == ["case1", "case2"]
+    assert device_jobs(redis_conn, "ct1") == []
@@ -0,0 +1,46 @@
+import logging
+import pytest
+
+import worker
+
+
+@pytest.fixture
+def no_mongodb(monkeypatch):
+    monkeypatch.setattr(worker, "update_job_status", lambda *args, **kwargs: None)
+    monkeypatch.setattr(worker, "save_timings_to_db", lambda *args, **kwargs: None)
+
+
+def test_job_log_handlers_are_closed_after_each_job(tmp_path, no_mongodb):
+    root_handlers = logging.getLogger().handlers[:]
+    cases = [tmp_path / "case1", tmp_path / "case2"]
+
+    for case_dir in cases:
+        with pytest.raises(Exception, match="Parameter file not found"):
+            worker.process_ctqa_analysis(case_dir.name, str(case_dir / "0.inputs"), str(case_dir),
+                                         param_file=str(tmp_path / "missing.txt"))
+        assert logging.getLogger().handlers == root_handlers
+        assert logging.getLogger("ctqa.job").handlers == []
+
+    # A later job (e.g. a report regeneration) does not log into the last case's worker.log
+    logging.getLogger().warning("after the jobs")
+    for case_dir in cases:
+        log_text = (case_dir / "worker.log").read_text()
+        assert f"Starting CTQA analysis for job {case_dir.name}" in log_text
+        assert log_text.count("Parameter file not found") >= 1
+        assert "after the jobs" not in log_text
+    assert "case2" not in (cases[0] / "worker.log").read_text()
+
+
+def test_ctqa_uses_the_job_log_without_opening_a_log_file(tmp_path, monkeypatch):
+    from ctqa import CTQA
+
+    monkeypatch.chdir(tmp_path)
+    log_file = tmp_path / "worker.log"
+    root_handlers = logging.getLogger().handlers[:]
+    with worker.job_logger("case1", str(log_file)):
+        handlers = logging.getLogger().handlers[:]
+        ctqa = CTQA(device_id="dev")
+        assert logging.getLogger().handlers == handlers
+        assert ctqa.log_file == str(log_file)
+        assert not (tmp_path / "_logs").exists()
+    assert logging.getLogger().handlers == root_handlers
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Device baseline - compiled label maps and a per-process cache of the loaded baseline images
+"""
+
+import os
+import json
+import logging
+import threading
+from datetime import datetime
+import numpy as np
+import SimpleITK as sitk
+from param import Param
+from results import read_result_csv
+
+
+# Compiled baseline metadata (version, baseline signature, label maps and ROIs per key)
+COMPILED_INFO_FILE = "compiled.json"
+COMPILED_VERSION = 1
+
+
+def baseline_signature(baseline_dir):
+    """
+    Modification signature of a baseline directory
+
+    Changes when a file is added, removed or rewritten (directory and file mtimes).
+
+    Args:
+        baseline_dir: Baseline directory
+
+    Returns:
+        Tuple (number of files, latest mtime in ns)
+    """
+    latest = os.stat(baseline_dir).st_mtime_ns
+    count = 0
+    for entry in os.scandir(baseline_dir):
+        if entry.is_file():
+            count += 1
+            latest = max(latest, entry.stat().st_mtime_ns)
+    return count, latest
+
+
+def label_map_pixel_type(num_of_masks):
+    """Smallest unsigned pixel type holding labels 0..num_of_masks"""
+    return sitk.sitkUInt8 if num_of_masks < 256 else sitk.sitkUInt16
+
+
+def build_label_map(mask_files):
+    """
+    Combine masks into one label image (pixel value i for mask i) and measure their ROIs
+
+    Where masks overlap, the later mask wins (as the composite mask always did) and a
+    warning is logged; the ROIs are measured on the masks as drawn, before the overlap.
+
+    Args:
+        mask_files: Mask file paths, in label order
+
+    Returns:
+        (label map SimpleITK image with the geometry of the first mask,
+         list of ROI dictionaries: label, voxels, bbox_index (x, y, z), bbox_size (x, y, z))
+    """
+    masks = [sitk.ReadImage(mask_file) for mask_file in mask_files]
+
+    # Verify all masks have the same spacing, origin, and size
+    reference_mask = masks[0]
+    for mask_file, mask in zip(mask_files, masks):
+        if mask.GetSpacing() != reference_mask.GetSpacing() or mask.GetOrigin() != reference_mask.GetOrigin() or \
+                mask.GetSize() != reference_mask.GetSize():
+            raise Exception(
+                f"Mask {mask_file} has different geometry than reference mask!\n"
+                f"  Reference: spacing={reference_mask.GetSpacing()}, origin={reference_mask.GetOrigin()}, "
+                f"size={reference_mask.GetSize()}\n"
+                f"  Mask: spacing={mask.GetSpacing()}, origin={mask.GetOrigin()}, size={mask.GetSize()}"
+            )
+
+    pixel_type = label_map_pixel_type(len(masks))
+    dtype = np.uint8 if pixel_type == sitk.sitkUInt8 else np.uint16
+    label_array = np.zeros(sitk.GetArrayViewFromImage(reference_mask).shape, dtype=dtype)
+    rois = []
+    for i, mask in enumerate(masks, 1):
+        # Where mask is > 0.5, set label map to i
+        inside = sitk.GetArrayViewFromImage(mask) > 0.5
+        overlap = int(np.count_nonzero(label_array[inside]))
+        if overlap:
+            logging.warning(f"Mask {mask_files[i - 1]} overlaps earlier masks ({overlap} voxels), "
+                            f"they are labelled {i}")
+        label_array[inside] = i
+
+        # Bounding box in (x, y, z) index order (array axes are z, y, x)
+        roi = {"label": i, "voxels": int(np.count_nonzero(inside)), "bbox_index": None, "bbox_size": None}
+        if roi["voxels"]:
+            lower, upper = [], []
+            for axis in (2, 1, 0):
+                hits = np.flatnonzero(np.any(inside, axis=tuple(a for a in range(3) if a != axis)))
+                lower.append(int(hits[0]))
+                upper.append(int(hits[-1]))
+            roi["bbox_index"] = lower
+            roi["bbox_size"] = [u - l + 1 for l, u in zip(lower, upper)]
+        rois.append(roi)
+
+    label_map = sitk.GetImageFromArray(label_array)
+    label_map.CopyInformation(reference_mask)
+    return label_map, rois
+
+
+def label_map_file(compiled_dir, key):
+    """Compiled label map of a mask key"""
+    return os.path.join(compiled_dir, f"{key}_labels.mha")
+
+
+def read_compiled_info(compiled_dir):
+    """Read compiled.json of a compiled baseline folder (None if missing or of another version)"""
+    info_file = os.path.join(compiled_dir, COMPILED_INFO_FILE) if compiled_dir else None
+    if not info_file or not os.path.exists(info_file):
+        return None
+    with open(info_file, 'r') as f:
+        info = json.load(f)
+    if info.get("version") != COMPILED_VERSION:
+        return None
+    return info
+
+
+def compile_baseline(baseline_dir, compiled_dir, mask_counts):
+    """
+    Precompute the label map of each mask key, the ROI bounding boxes and the labels of a baseline
+
+    Writes {key}_labels.mha (compressed) per key and compiled.json (written last, so a
+    partly compiled folder is never used) to compiled_dir. compiled.json records the
+    baseline signature; the compiled files are ignored once the baseline changes.
+
+    Args:
+        baseline_dir: Baseline directory ({key}{i}.nrrd masks, id2label.txt)
+        compiled_dir: Output directory
+        mask_counts: Dictionary key -> number of masks
+
+    Returns:
+        compiled.json content (dictionary)
+    """
+    os.makedirs(compiled_dir, exist_ok=True)
+    signature = baseline_signature(baseline_dir)
+    id2label = Param(os.path.join(baseline_dir, "id2label.txt"))
+
+    keys = {}
+    for key, num_of_masks in mask_counts.items():
+        if num_of_masks <= 0:
+            continue
+        mask_files = [os.path.join(baseline_dir, f"{key}{i}.nrrd") for i in range(1, num_of_masks + 1)]
+        for mask_file in mask_files:
+            if not os.path.exists(mask_file):
+                raise Exception(f"Mask file not found: {mask_file}")
+
+        label_map, rois = build_label_map(mask_files)
+        output_file = label_map_file(compiled_dir, key)
+        sitk.WriteImage(label_map, output_file, True)
+        for roi in rois:
+            roi["mask_id"] = f"{key}{roi['label']}"
+            roi["name"] = id2label.get_value(roi["mask_id"]).strip()
+        keys[key] = {
+            "num_of_masks": num_of_masks,
+            "label_map": os.path.basename(output_file),
+            "rois": rois,
+        }
+        logging.info(f"Compiled {key}: {output_file} ({num_of_masks} labels)")
+
+    info = {
+        "version": COMPILED_VERSION,
+        "baseline_dir": os.path.abspath(baseline_dir),
+        "baseline_signature": list(signature),
+        "compiled_at": datetime.now().isoformat(),
+        "keys": keys,
+    }
+    info_file = os.path.join(compiled_dir, COMPILED_INFO_FILE)
+    tmp_file = f"{info_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(info, f, indent=2)
+    os.replace(tmp_file, info_file)
+    logging.info(f"Baseline compiled: {compiled_dir}")
+    return info
+
+
+class Baseline:
+    """
+    Loaded baseline of a device: CT, registration mask, label maps and id2label
+
+    Label maps come from the compiled baseline (see compile_baseline) when it matches the
+    baseline folder, otherwise they are built from the masks. Images are loaded on first
+    use and kept; all accessors are thread safe.
+    """
+
+    def __init__(self, baseline_dir, compiled_dir=None):
+        self.baseline_dir = baseline_dir
+        self.compiled_dir = compiled_dir
+        self.signature = baseline_signature(baseline_dir)
+        self._lock = threading.RLock()
+        self._ct = None
+        self._registration_mask = None
+        self._label_maps = {}
+        self._rois = {}
+        self._id2label = None
+        self._csv_values = {}
+
+        self.compiled = read_compiled_info(compiled_dir)
+        if self.compiled is not None and tuple(self.compiled.get("baseline_signature", [])) != self.signature:
+            logging.warning(f"Compiled baseline {compiled_dir} is out of date, building label maps from the masks "
+                            f"(re-run the baseline compile step)")
+            self.compiled = None
+
+    def _path(self, name):
+        return os.path.join(self.baseline_dir, name)
+
+    def ct(self):
+        """Baseline CT (CT.nrrd) as Float32, the moving image of the registration"""
+        with self._lock:
+            if self._ct is None:
+                self._ct = sitk.Cast(sitk.ReadImage(self._path("CT.nrrd")), sitk.sitkFloat32)
+            return self._ct
+
+    def registration_mask(self):
+        """Registration mask (fuz_mask.nrrd), None if the baseline has none"""
+        with self._lock:
+            if self._registration_mask is None and os.path.exists(self._path("fuz_mask.nrrd")):
+                self._registration_mask = sitk.ReadImage(self._path("fuz_mask.nrrd"))
+            return self._registration_mask
+
+    def _compiled_key(self, key, num_of_masks):
+        """compiled.json entry of a key, None if not compiled for this number of masks"""
+        if self.compiled is None:
+            return None
+        entry = self.compiled["keys"].get(key)
+        if entry is None or entry["num_of_masks"] != num_of_masks:
+            return None
+        return entry
+
+    def _load_label_map(self, key, num_of_masks):
+        """Read the compiled label map of a key, or build it from the masks"""
+        entry = self._compiled_key(key, num_of_masks)
+        if entry is not None:
+            label_map = sitk.ReadImage(os.path.join(self.compiled_dir, entry["label_map"]))
+            logging.info(f"Baseline label map loaded: {key} ({num_of_masks} masks, compiled)")
+            return label_map, entry["rois"]
+
+        mask_files = [self._path(f"{key}{i}.nrrd") for i in range(1, num_of_masks + 1)]
+        for mask_file in mask_files:
+            if not os.path.exists(mask_file):
+                raise Exception(f"Mask file not found: {mask_file}")
+        label_map, rois = build_label_map(mask_files)
+        logging.info(f"Baseline label map built: {key} ({num_of_masks} masks, baseline not compiled)")
+        return label_map, rois
+
+    def label_map(self, key, num_of_masks):
+        """
+        Label map of the masks {key}1..{key}N (pixel value i for mask i)
+
+        Args:
+            key: Mask key (HU, UF, ...)
+            num_of_masks: Number of masks of the key
+
+        Returns:
+            SimpleITK image
+        """
+        with self._lock:
+            label_map = self._label_maps.get((key, num_of_masks))
+        if label_map is not None:
+            return label_map
+
+        # Loaded outside the lock so the keys of a case (transferred in parallel) load concurrently
+        label_map, rois = self._load_label_map(key, num_of_masks)
+        with self._lock:
+            self._rois.setdefault((key, num_of_masks), rois)
+            return self._label_maps.setdefault((key, num_of_masks), label_map)
+
+    def rois(self, key, num_of_masks):
+        """
+        ROIs of the masks of a key in the baseline
+
+        Returns:
+            List of dictionaries (label, voxels, bbox_index, bbox_size), one per mask
+        """
+        self.label_map(key, num_of_masks)
+        with self._lock:
+            return self._rois[(key, num_of_masks)]
+
+    def id2label(self):
+        """Mask id to display label (id2label.txt)"""
+        with self._lock:
+            if self._id2label is None:
+                self._id2label = Param(self._path("id2label.txt"))
+            return self._id2label
+
+    def csv_values(self, filename):
+        """
+        Baseline results of a measurement ({filename} in the baseline folder, header and value line)
+
+        Returns:
+            (labels, values) lists of strings, or None if the file does not exist
+        """
+        with self._lock:
+            if filename not in self._csv_values:
+                self._csv_values[filename] = read_result_csv(self._path(filename))
+            return self._csv_values[filename]
+
+    def preload(self, mask_counts):
+        """
+        Load everything up front (e.g. at worker startup)
+
+        Args:
+            mask_counts: Dictionary key -> number of masks
+        """
+        self.ct()
+        self.registration_mask()
+        self.id2label()
+        for key, num_of_masks in mask_counts.items():
+            if num_of_masks > 0:
+                self.label_map(key, num_of_masks)
+
+
+class BaselineCache:
+    """Per-process cache of device baselines, invalidated when the baseline or its compiled files change"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._baselines = {}
+
+    def get(self, baseline_dir, compiled_dir=None):
+        """
+        Cached baseline of a directory (reloaded if the directory or compiled.json changed)
+
+        Args:
+            baseline_dir: Baseline directory
+            compiled_dir: Compiled baseline directory (optional)
+
+        Returns:
+            Baseline
+        """
+        key = os.path.abspath(baseline_dir)
+        info_file = os.path.join(compiled_dir, COMPILED_INFO_FILE) if compiled_dir else None
+        signature = (baseline_signature(baseline_dir),
+                     os.stat(info_file).st_mtime_ns if info_file and os.path.exists(info_file) else None)
+        with self._lock:
+            cached = self._baselines.get(key)
+            if cached is None or cached[0] != signature:
+                if cached is not None:
+                    logging.info(f"Baseline changed, reloading: {baseline_dir}")
+                cached = (signature, Baseline(baseline_dir, compiled_dir))
+                self._baselines[key] = cached
+            return cached[1]
+
+    def clear(self):
+        """Drop all cached baselines"""
+        with self._lock:
+            self._baselines.clear()
+
+
+# Cache shared by all CTQA instances of the process
+baseline_cache = BaselineCache()
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Batch re-analysis of stored cases
+
+Discovers the cases under ./_data/devices/*/cases, skips those whose inputs and
+parameters are unchanged since their last batch run, and processes the rest in a
+process pool. Each case logs to its own batch.log; a summary table and the
+throughput (cases/min) are printed at the end. Run from the directory containing
+_data/devices (CTQA resolves the device folders relative to it).
+
+Usage:
+    python batch.py [--devices id1,id2] [--cases "2025*"] [--processes 4] [--force]
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import fnmatch
+import hashlib
+import logging
+import argparse
+import contextlib
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import SimpleITK as sitk
+
+# Add script directory to path to import ctqa module
+script_dir = Path(__file__).parent
+sys.path.insert(0, str(script_dir))
+
+from ctqa import CTQA
+from dicomtools import SERIES_INDEX_FILE, dicom_series_to_mhd
+from registration import hash_image
+from volumeio import IMAGE_FORMATS, DEFAULT_INTERMEDIATE_FORMAT
+from timing import StageTimer
+
+
+DEVICES_DIR = "./_data/devices"
+
+# Batch record of a case (input hash of the last successful batch run), in 3.analysis
+BATCH_INFO_FILE = "batch.json"
+
+# Per-case log of the batch run, in the case folder
+BATCH_LOG_FILE = "batch.log"
+
+# Bump to re-run all cases when the hash inputs change
+BATCH_HASH_VERSION = 2
+
+
+def discover_cases(devices=None, case_pattern=None):
+    """
+    Cases of the devices under DEVICES_DIR
+
+    A case is a folder in {device}/cases holding CT.mhd, a 0.inputs folder or DICOM files.
+
+    Args:
+        devices: Device ids to include (default: all devices with a param.txt)
+        case_pattern: fnmatch pattern of the case ids to include (optional)
+
+    Returns:
+        List of (device_id, case_dir) tuples, sorted
+    """
+    devices_dir = Path(DEVICES_DIR)
+    if not devices_dir.exists():
+        return []
+
+    cases = []
+    for device_dir in sorted(devices_dir.iterdir()):
+        if not (device_dir / "param.txt").exists() or (devices and device_dir.name not in devices):
+            continue
+        cases_dir = device_dir / "cases"
+        if not cases_dir.exists():
+            continue
+        for case_dir in sorted(cases_dir.iterdir()):
+            if not case_dir.is_dir() or (case_pattern and not fnmatch.fnmatch(case_dir.name, case_pattern)):
+                continue
+            if (case_dir / "CT.mhd").exists() or (case_dir / "0.inputs").is_dir() or any(case_dir.glob("*.dcm")):
+                cases.append((device_dir.name, str(case_dir)))
+    return cases
+
+
+def _update_with_file_stats(sha, files):
+    """Add name, size and modification time of files to a hash"""
+    for f in sorted(files):
+        stat = f.stat()
+        sha.update(f"{f.name}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+
+
+def case_input_hash(param_file, baseline_dir, case_dir, compiled_dir=None):
+    """
+    Hash of everything a case's results depend on, apart from the code
+
+    Covers the device param.txt (content), the baseline and compiled baseline folders
+    (file names, sizes and modification times) and the source of the case CT: the files
+    in 0.inputs if present, otherwise the DICOM files in the case folder, otherwise the
+    pixel data and geometry of CT.mhd (unchanged by archiving). A CT.mhd converted from
+    DICOM files by a run is not hashed, so it does not make the next run look changed.
+
+    Args:
+        param_file: Device param.txt
+        baseline_dir: Device baseline directory
+        case_dir: Case directory
+        compiled_dir: Device compiled baseline directory (label maps, see baseline.compile_baseline)
+
+    Returns:
+        Hex digest
+    """
+    sha = hashlib.sha256(f"batch-v{BATCH_HASH_VERSION}\n".encode())
+    with open(param_file, 'rb') as f:
+        sha.update(f.read())
+
+    for directory in (baseline_dir, compiled_dir):
+        sha.update(f"{Path(directory).name if directory else ''}\n".encode())
+        if directory and Path(directory).exists():
+            _update_with_file_stats(sha, [f for f in Path(directory).iterdir() if f.is_file()])
+
+    case_path = Path(case_dir)
+    inputs_dir = case_path / "0.inputs"
+    dicom_files = list(case_path.glob("*.dcm"))
+    if inputs_dir.is_dir():
+        _update_with_file_stats(sha, [f for f in inputs_dir.iterdir() if f.is_file() and f.name != SERIES_INDEX_FILE])
+    elif dicom_files:
+        _update_with_file_stats(sha, dicom_files)
+    elif (case_path / "CT.mhd").exists():
+        sha.update(hash_image(str(case_path / "CT.mhd")).encode())
+    return sha.hexdigest()
+
+
+def read_batch_info(case_dir):
+    """Batch record of a case (empty dict if missing)"""
+    info_file = Path(case_dir) / "3.analysis" / BATCH_INFO_FILE
+    if not info_file.exists():
+        return {}
+    with open(info_file, 'r') as f:
+        return json.load(f)
+
+
+def is_case_up_to_date(case_dir, input_hash):
+    """Whether the last batch run of a case used the same inputs and produced results"""
+    return read_batch_info(case_dir).get("input_hash") == input_hash and \
+        (Path(case_dir) / "3.analysis" / "analysis_results.json").exists()
+
+
+def _init_process(itk_threads):
+    """Pool initializer: limit the ITK threads so the processes do not oversubscribe the CPUs"""
+    sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(itk_threads)
+
+
+@contextlib.contextmanager
+def _case_logging(log_file):
+    """Send the root logger and stdout of this process to a case log file"""
+    root_logger = logging.getLogger()
+    saved_handlers, saved_level = root_logger.handlers[:], root_logger.level
+    handler = logging.FileHandler(log_file, mode='w', encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    root_logger.handlers = [handler]
+    root_logger.setLevel(logging.INFO)
+    try:
+        with contextlib.redirect_stdout(handler.stream):
+            yield
+    finally:
+        root_logger.handlers = saved_handlers
+        root_logger.setLevel(saved_level)
+        handler.close()
+
+
+def process_case(task):
+    """
+    Process one case (runs in a pool process)
+
+    Args:
+        task: Dictionary with device_id, case_dir, param_file, input_hash, max_workers,
+            intermediate_format, force_registration
+
+    Returns:
+        Result dictionary (device_id, case_id, status, seconds, error)
+    """
+    case_dir = task["case_dir"]
+    result = {"device_id": task["device_id"], "case_id": Path(case_dir).name, "status": "ok", "seconds": 0.0,
+              "error": ""}
+    start = time.perf_counter()
+
+    with _case_logging(os.path.join(case_dir, BATCH_LOG_FILE)):
+        try:
+            logging.info(f"Batch run of {case_dir} (input hash {task['input_hash'][:12]})")
+            analysis_dir = Path(case_dir) / "3.analysis"
+            # Drop the record first so an interrupted run is never taken as up to date
+            if (analysis_dir / BATCH_INFO_FILE).exists():
+                (analysis_dir / BATCH_INFO_FILE).unlink()
+
+            timer = StageTimer()
+            inputs_dir = Path(case_dir) / "0.inputs"
+            if not (Path(case_dir) / "CT.mhd").exists() and inputs_dir.is_dir():
+                with timer.stage("dicom_conversion"):
+                    dicom_series_to_mhd(str(inputs_dir), case_dir, image_format=task["intermediate_format"])
+
+            ctqa = CTQA(machine_param_file=task["param_file"], device_id=task["device_id"],
+                        max_workers=task["max_workers"], intermediate_format=task["intermediate_format"])
+            ctqa.run(case_dir, force_registration=task["force_registration"], timer=timer)
+
+            result["seconds"] = time.perf_counter() - start
+            analysis_dir.mkdir(exist_ok=True)
+            with open(analysis_dir / BATCH_INFO_FILE, 'w') as f:
+                json.dump({
+                    "input_hash": task["input_hash"],
+                    "finished_at": datetime.now().isoformat(),
+                    "seconds": round(result["seconds"], 3),
+                }, f, indent=2)
+        except Exception as e:
+            logging.exception(f"Batch run of {case_dir} failed")
+            result["status"] = "failed"
+            result["error"] = str(e).splitlines()[0] if str(e) else type(e).__name__
+            result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def print_summary(results, elapsed_s):
+    """Print the per-case table and the throughput"""
+    print()
+    print("=" * 90)
+    print(f"{'device':<24} {'case':<20} {'status':<8} {'time[s]':>8}  error")
+    print("-" * 90)
+    for r in results:
+        print(f"{r['device_id']:<24} {r['case_id']:<20} {r['status']:<8} {r['seconds']:>8.1f}  {r['error']}")
+    print("=" * 90)
+
+    counts = {status: sum(1 for r in results if r["status"] == status) for status in ("ok", "skipped", "failed")}
+    processed = counts["ok"] + counts["failed"]
+    case_s = sum(r["seconds"] for r in results if r["status"] != "skipped")
+    print(f"{len(results)} cases: {counts['ok']} ok, {counts['skipped']} skipped (unchanged), "
+          f"{counts['failed']} failed")
+    if processed:
+        print(f"Wall time {elapsed_s:.1f} s, {processed / (elapsed_s / 60):.1f} cases/min "
+              f"(mean {case_s / processed:.1f} s per case)")
+
+
+def write_summary_csv(results, out_file):
+    """Write the per-case results as CSV"""
+    with open(out_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=["device_id", "case_id", "status", "seconds", "error"])
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-analyze stored CTQA cases in a process pool")
+    parser.add_argument("--devices", help="Comma-separated device ids (default: all devices)")
+    parser.add_argument("--cases", help="Case id pattern, e.g. '2025*' (default: all cases)")
+    parser.add_argument("--processes", type=int, default=max(1, (os.cpu_count() or 1) // 2),
+                        help="Cases processed in parallel (default: half the CPUs)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Threads per case for the mask transfer and measurements (default: 1)")
+    parser.add_argument("--itk-threads", type=int, default=None,
+                        help="ITK threads per process (default: CPUs / processes)")
+    parser.add_argument("--intermediate-format", choices=IMAGE_FORMATS, default=DEFAULT_INTERMEDIATE_FORMAT,
+                        help="MetaImage variant of the intermediate images (compressed at the end of each case)")
+    parser.add_argument("--force", action="store_true", help="Re-run cases even if their inputs are unchanged")
+    parser.add_argument("--force-registration", action="store_true",
+                        help="Re-run the registration even if a cached transform matches the inputs")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the cases that would run")
+    parser.add_argument("--summary", help="Also write the per-case results to this CSV file")
+    args = parser.parse_args()
+
+    devices = [d.strip() for d in args.devices.split(",") if d.strip()] if args.devices else None
+    cases = discover_cases(devices, args.cases)
+    if not cases:
+        print(f"No cases found under {DEVICES_DIR}")
+        return 1
+
+    # Hash the inputs and keep the cases that changed since their last batch run
+    results = []
+    tasks = []
+    for device_id, case_dir in cases:
+        param_file = os.path.join(DEVICES_DIR, device_id, "param.txt")
+        baseline_dir = os.path.join(DEVICES_DIR, device_id, "baseline")
+        compiled_dir = os.path.join(DEVICES_DIR, device_id, "baseline_compiled")
+        input_hash = case_input_hash(param_file, baseline_dir, case_dir, compiled_dir)
+        if not args.force and is_case_up_to_date(case_dir, input_hash):
+            results.append({"device_id": device_id, "case_id": Path(case_dir).name, "status": "skipped",
+                            "seconds": 0.0, "error": ""})
+            continue
+        tasks.append({
+            "device_id": device_id,
+            "case_dir": case_dir,
+            "param_file": param_file,
+            "input_hash": input_hash,
+            "max_workers": args.workers,
+            "intermediate_format": args.intermediate_format,
+            "force_registration": args.force_registration,
+        })
+
+    print(f"{len(cases)} cases found, {len(tasks)} to run, {len(results)} unchanged")
+    if args.dry_run:
+        for task in tasks:
+            print(f"  {task['device_id']}/{Path(task['case_dir']).name}")
+        return 0
+
+    processes = max(1, min(args.processes, len(tasks))) if tasks else 1
+    itk_threads = args.itk_threads or max(1, (os.cpu_count() or 1) // processes)
+    print(f"Running {len(tasks)} cases in {processes} processes ({itk_threads} ITK threads each)...")
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_process, initargs=(itk_threads,)) as pool:
+        futures = [pool.submit(process_case, task) for task in tasks]
+        for done, future in enumerate(as_completed(futures), 1):
+            r = future.result()
+            results.append(r)
+            print(f"[{done}/{len(tasks)}] {r['device_id']}/{r['case_id']}: {r['status']} ({r['seconds']:.1f} s)"
+                  + (f" - {r['error']}" if r["error"] else ""), flush=True)
+    elapsed_s = time.perf_counter() - start
+
+    results.sort(key=lambda r: (r["device_id"], r["case_id"]))
+    print_summary(results, elapsed_s)
+    if args.summary:
+        write_summary_csv(results, args.summary)
+        print(f"Summary written to {args.summary}")
+    return 1 if any(r["status"] == "failed" for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
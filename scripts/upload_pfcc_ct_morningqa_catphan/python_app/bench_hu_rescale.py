@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the HU rescale of a DICOM series
+
+Compares the former whole-volume conversion (stack, cast to int16, multiply
+and add in float64, cast back) with the per-slice rescale written into a
+preallocated int16 volume (dicomtools.rescale_to_hu). Uses synthetic uint16
+slices, so no DICOM files are needed. Reports time and peak memory (tracemalloc).
+
+Usage:
+    python bench_hu_rescale.py [--slices 400] [--size 512]
+"""
+
+import sys
+import time
+import argparse
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+# Add script directory to path to import dicomtools module
+script_dir = Path(__file__).parent
+sys.path.insert(0, str(script_dir))
+
+from dicomtools import rescale_to_hu
+
+
+def rescale_whole_volume(slices, slope, intercept):
+    """Former conversion: one slope/intercept, three full-volume temporaries"""
+    volume = np.stack(slices).astype(np.int16)
+    volume = volume * slope + intercept
+    return volume.astype(np.int16)
+
+
+def rescale_per_slice(slices, slope, intercept):
+    """Per-slice rescale into the preallocated output volume"""
+    volume = np.empty((len(slices),) + slices[0].shape, dtype=np.int16)
+    for i, pixels in enumerate(slices):
+        rescale_to_hu(pixels, slope, intercept, volume[i])
+    return volume
+
+
+def measure(func, slices, slope, intercept, repeat):
+    """Best time (s) and peak traced memory (bytes) of func, plus its result"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(slices, slope, intercept)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    result = func(slices, slope, intercept)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the HU rescale of a DICOM series")
+    parser.add_argument("--slices", type=int, default=400, help="Number of slices")
+    parser.add_argument("--size", type=int, default=512, help="Rows/columns per slice")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per method (best time is reported)")
+    args = parser.parse_args()
+
+    # Stored values as written by a CT scanner (RescaleIntercept -1024)
+    rng = np.random.default_rng(0)
+    slices = [rng.integers(0, 4096, size=(args.size, args.size), dtype=np.uint16) for _ in range(args.slices)]
+    slope, intercept = 1.0, -1024.0
+    volume_mb = args.slices * args.size * args.size * 2 / 2**20
+
+    old_s, old_peak, old_volume = measure(rescale_whole_volume, slices, slope, intercept, args.repeat)
+    new_s, new_peak, new_volume = measure(rescale_per_slice, slices, slope, intercept, args.repeat)
+
+    print("=" * 70)
+    print(f"HU rescale benchmark: {args.slices} slices of {args.size}x{args.size} "
+          f"(int16 volume {volume_mb:.0f} MB, best of {args.repeat})")
+    print("=" * 70)
+    print(f"{'method':>12} {'time[s]':>10} {'peak[MB]':>10}")
+    print(f"{'whole volume':>12} {old_s:>10.3f} {old_peak / 2**20:>10.0f}")
+    print(f"{'per slice':>12} {new_s:>10.3f} {new_peak / 2**20:>10.0f}")
+    print(f"speedup {old_s / new_s:.2f}x, peak memory {old_peak / new_peak:.1f}x lower, "
+          f"identical: {np.array_equal(old_volume, new_volume)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the parallel per-key stages of CTQA.run
+
+Times mask transfer and analysis of an already registered case at 1, 2, 4
+and 8 worker threads. Run from the directory containing _data/devices.
+
+Usage:
+    python bench_parallel.py <case_dir> --machine-param ./_data/devices/<device_id>/param.txt
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+from pathlib import Path
+
+# Add script directory to path to import ctqa module
+script_dir = Path(__file__).parent
+sys.path.insert(0, str(script_dir))
+
+from ctqa import CTQA
+
+
+def time_stages(ctqa, case_dir):
+    """Run mask transfer and analysis once, returning (transfer_s, analyze_s)"""
+    baseline_dir = ctqa.get_baseline_dir()
+
+    start = time.perf_counter()
+    ctqa.transfer_all_masks(baseline_dir, case_dir)
+    transfer_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ctqa.analyze(case_dir, "mhd", os.path.join(case_dir, "2.seg"), "mhd", os.path.join(case_dir, "3.analysis"))
+    analyze_s = time.perf_counter() - start
+
+    return transfer_s, analyze_s
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parallel mask transfer and analysis")
+    parser.add_argument("case_dir", help="Case directory with CT.mhd (registered if 1.reg exists)")
+    parser.add_argument("--machine-param", help="Path to device param.txt", required=True)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="Worker counts to compare")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per worker count (best time is reported)")
+    args = parser.parse_args()
+
+    case_dir = Path(args.case_dir)
+    if not (case_dir / "CT.mhd").exists():
+        print(f"ERROR: CT.mhd not found in {case_dir}")
+        return 1
+
+    # Work on a copy of the CT and registration so the case is not modified
+    work_dir = Path(tempfile.mkdtemp(prefix="bench_parallel_"))
+    try:
+        for f in case_dir.glob("CT.*"):
+            shutil.copy2(f, work_dir / f.name)
+        if (case_dir / "1.reg").exists():
+            shutil.copytree(case_dir / "1.reg", work_dir / "1.reg")
+
+        if not (work_dir / "1.reg" / "TransformParameters.0.tfm").exists():
+            print("No registration found, running the full pipeline once...")
+            CTQA(machine_param_file=args.machine_param).run(str(work_dir))
+
+        results = []
+        for workers in args.workers:
+            ctqa = CTQA(machine_param_file=args.machine_param, max_workers=workers)
+            runs = [time_stages(ctqa, str(work_dir)) for _ in range(args.repeat)]
+            transfer_s = min(r[0] for r in runs)
+            analyze_s = min(r[1] for r in runs)
+            results.append((workers, transfer_s, analyze_s))
+
+        serial_total = results[0][1] + results[0][2]
+        print()
+        print("=" * 70)
+        print(f"Parallel stage benchmark: {case_dir} (best of {args.repeat})")
+        print("=" * 70)
+        print(f"{'workers':>8} {'transfer[s]':>12} {'analyze[s]':>12} {'total[s]':>10} {'speedup':>8}")
+        for workers, transfer_s, analyze_s in results:
+            total = transfer_s + analyze_s
+            print(f"{workers:>8} {transfer_s:>12.2f} {analyze_s:>12.2f} {total:>10.2f} {serial_total / total:>7.2f}x")
+        return 0
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
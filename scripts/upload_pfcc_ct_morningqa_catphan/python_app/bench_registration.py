@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Benchmark for registration metric sampling
+
+Registers a case CT to the device baseline with full sampling (reference) and
+with each sampling configuration, and reports runtime and the transform
+difference against the reference. Run from the directory containing
+_data/devices.
+
+A configuration is a comma-separated list of registration_* overrides, e.g.
+
+    python bench_registration.py <case_dir> --machine-param ./_data/devices/<device_id>/param.txt \\
+        --config "samplingStrategy=random,samplingPercentage=0.02;0.05;0.1" \\
+        --config "samplingStrategy=regular,samplingPercentage=0.1,bodyMaskThreshold=-500"
+
+(per-level percentages are separated by ';', so quote the configuration in the shell)
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+from pathlib import Path
+
+import numpy as np
+import SimpleITK as sitk
+
+# Add script directory to path to import registration module
+script_dir = Path(__file__).parent
+sys.path.insert(0, str(script_dir))
+
+from registration import rigid_body_registration, read_registration_info
+
+
+# Keys set to full sampling for the reference registration
+FULL_SAMPLING = {"samplingStrategy": "none", "bodyMaskThreshold": "", "warmStart": "0"}
+
+
+def parse_config(text):
+    """Parse 'key=value,key=value' into a dictionary of registration_* overrides"""
+    overrides = {}
+    for item in text.split(","):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            overrides[key.strip()] = value.strip().replace(";", ",")
+    return overrides
+
+
+def write_param_file(machine_param, overrides, out_file):
+    """Copy the device param file and append registration_* overrides (later keys win)"""
+    with open(machine_param, 'r') as f:
+        text = f.read()
+    with open(out_file, 'w') as f:
+        f.write(text.rstrip("\n") + "\n")
+        for key, value in overrides.items():
+            f.write(f"registration_{key}={value}\n")
+    return out_file
+
+
+def read_transform(reg_dir):
+    """Read the transform written by rigid_body_registration"""
+    return sitk.ReadTransform(os.path.join(reg_dir, "TransformParameters.0.tfm"))
+
+
+def transform_difference(reference, transform, image):
+    """
+    Max and mean displacement (mm) between two transforms over the corners and center of an image
+
+    Args:
+        reference: Reference transform
+        transform: Transform to compare
+        image: Image whose physical extent is sampled
+
+    Returns:
+        (max_mm, mean_mm)
+    """
+    size = image.GetSize()
+    indexes = [(i, j, k) for i in (0, size[0] - 1) for j in (0, size[1] - 1) for k in (0, size[2] - 1)]
+    indexes.append(tuple(s // 2 for s in size))
+    distances = []
+    for index in indexes:
+        point = image.TransformIndexToPhysicalPoint(index)
+        a = np.array(reference.TransformPoint(point))
+        b = np.array(transform.TransformPoint(point))
+        distances.append(float(np.linalg.norm(a - b)))
+    return max(distances), sum(distances) / len(distances)
+
+
+def run_registration(case_dir, baseline_dir, param_file, out_dir):
+    """Run one registration (never cached), returning the runtime in seconds"""
+    start = time.perf_counter()
+    rigid_body_registration(os.path.abspath(os.path.join(case_dir, "CT.mhd")), "",
+                            os.path.join(baseline_dir, "CT.nrrd"), os.path.join(baseline_dir, "fuz_mask.nrrd"),
+                            out_dir, [], param=param_file, force=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark registration metric sampling")
+    parser.add_argument("case_dir", help="Case directory with CT.mhd")
+    parser.add_argument("--machine-param", help="Path to device param.txt", required=True)
+    parser.add_argument("--config", action="append", default=[],
+                        help="registration_* overrides, e.g. samplingStrategy=random,samplingPercentage=0.05")
+    args = parser.parse_args()
+
+    case_dir = Path(args.case_dir)
+    if not (case_dir / "CT.mhd").exists():
+        print(f"ERROR: CT.mhd not found in {case_dir}")
+        return 1
+    baseline_dir = str(Path(args.machine_param).parent / "baseline")
+
+    configs = [("full", FULL_SAMPLING)] + [(c, {**FULL_SAMPLING, **parse_config(c)}) for c in args.config]
+
+    work_dir = Path(tempfile.mkdtemp(prefix="bench_registration_"))
+    try:
+        fixed = sitk.ReadImage(str(case_dir / "CT.mhd"))
+        results = []
+        for n, (name, overrides) in enumerate(configs):
+            param_file = write_param_file(args.machine_param, overrides, str(work_dir / f"param{n}.txt"))
+            out_dir = str(work_dir / f"reg{n}")
+            seconds = run_registration(str(case_dir), baseline_dir, param_file, out_dir)
+            metric = read_registration_info(out_dir).get("final_metric_value")
+            results.append((name, seconds, metric, read_transform(out_dir)))
+
+        reference = results[0][3]
+        print()
+        print("=" * 90)
+        print(f"Registration sampling benchmark: {case_dir}")
+        print("=" * 90)
+        print(f"{'time[s]':>8} {'speedup':>8} {'metric':>10} {'max[mm]':>8} {'mean[mm]':>9}  config")
+        for name, seconds, metric, transform in results:
+            max_mm, mean_mm = transform_difference(reference, transform, fixed)
+            print(f"{seconds:>8.2f} {results[0][1] / seconds:>7.2f}x {metric:>10.4f} {max_mm:>8.3f} {mean_mm:>9.3f}  {name}")
+        return 0
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
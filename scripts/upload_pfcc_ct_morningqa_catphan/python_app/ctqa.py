@@ -8,25 +8,72 @@ import os
 import sys
 from pathlib import Path
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import logging
 
-from param import Param
-from dicomtools import dicom_series_to_mhd, write_mhd_compressed as write_mhd_compressed_dicom
-from registration import rigid_body_registration, apply_transform, write_mhd_compressed
+from param import Param, load_param
+from baseline import baseline_cache, compile_baseline
+from timing import StageTimer, TIMINGS_FILE, profiled
+from report_template import get_report_template
+from results import read_result_csv, write_result_csv, SectionResults, AnalysisResults
+from results_store import ResultsStore, RESULTS_STORE_FILE
+from dicomtools import dicom_series_to_mhd
+from volumeio import (
+    IMAGE_FORMATS,
+    DEFAULT_INTERMEDIATE_FORMAT,
+    write_image,
+    archive_images,
+    open_mapped_volume,
+    remove_mapped_volume
+)
+from registration import (
+    rigid_body_registration,
+    apply_transform,
+    read_registration_params,
+    read_registration_info,
+    write_registration_review_images,
+    hash_image
+)
 from imagetools import (
-    calc_image_min_max_mean_std_3d_f,
-    calc_bounding_box_3d,
-    crop_3d_boundingbox_f,
-    threshold_3d_f,
+    calc_masked_stats,
+    write_stats,
     cast_to_uchar_3d_f,
-    calc_image_moments_3d_f
+    calc_centers_of_gravity_3d
 )
 
+# Mask/measurement keys processed per case
+MASK_KEYS = ["HU", "UF", "HC", "LC", "geo", "DT"]
+
+# Report sections: (analysis_results.json key, report placeholder, results CSV,
+# number of values (count or num_of_* param key), tolerance param key, number format)
+REPORT_SECTIONS = [
+    ("hu_consistency", "HU", "HU.csv", "num_of_HU_masks", "HU_tol", "0.0"),
+    ("geometric_accuracy_inplane", "geo", "geo.dist.csv", "num_of_geo_masks", "geo_tol", "0.0"),
+    ("geometric_accuracy_outofplane", "DT", "DT.dist.csv", "num_of_DT_masks", "DT_tol", "0.0"),
+    ("uniformity_hu", "UF", "UF.csv", "num_of_UF_masks", "UF_tol", "0.0"),
+    ("uniformity_integral", "UF.uniformity", "UF.uniformity.csv", 1, "UF.uniformity_tol", "0.00"),
+    ("low_contrast", "LC", "LC.csv", "num_of_LC_masks", "LC_tol", "0.0"),
+    ("high_contrast_rmtf", "HC.RMTF", "HC.RMTF.csv", "num_of_HC_masks", "HC_RMTF_tol", "0.00"),
+    ("high_contrast_rmtf50", "HC.RMTF.50", "HC.RMTF.calc.csv", 1, "HC_RMTF50_tol", "0.0"),
+]
+
+# Tolerances shown in the report ({{{HU_tol}}}, ...)
+REPORT_TOLERANCE_KEYS = ["HU_tol", "geo_tol", "DT_tol", "UF_tol", "LC_tol", "UF.uniformity_tol", "HC_RMTF_tol",
+                         "HC_RMTF50_tol"]
+
+# Measurement results in 3.analysis the report is generated from
+REPORT_CSV_FILES = [section[2] for section in REPORT_SECTIONS]
+
+# Typed machine parameters (param.txt), validated when the file is loaded
+MACHINE_PARAM_SCHEMA = {f"num_of_{key}_masks": int for key in MASK_KEYS}
+MACHINE_PARAM_SCHEMA.update({tol_key: float for tol_key in REPORT_TOLERANCE_KEYS})
+
 
 class CTQA:
     """CT Quality Assurance processing class"""
     
-    def __init__(self, machine_param_file=None, device_id=None, service_param_file=None):
+    def __init__(self, machine_param_file=None, device_id=None, service_param_file=None, audit_trail=False,
+                 max_workers=1, intermediate_format=DEFAULT_INTERMEDIATE_FORMAT):
         """
         Initialize CTQA with parameter files
         
@@ -34,8 +81,26 @@ class CTQA:
             machine_param_file: Path to machine parameter file (e.g., ./_data/devices/{device_id}/param.txt)
             device_id: Device identifier (derived from param file path if not provided)
             service_param_file: Deprecated, kept for backwards compatibility (ignored)
+            audit_trail: Also write the legacy per-mask measurement files (.stat.txt, .roi.txt, .mnt.txt,
+                .crop.mha, ...) for inspection; the measurements are always in 3.analysis/measurements.json
+            max_workers: Number of threads used to run the per-key mask transfer and measurements
+                (1 runs them sequentially)
+            intermediate_format: MetaImage variant of CT.mhd and the 2.seg images while the case is
+                processed ("raw", "fast" or "zlib", see volumeio); run() archives them compressed at the end
         """
-        self.machine_param = Param(machine_param_file) if machine_param_file else None
+        self.machine_param = load_param(machine_param_file, MACHINE_PARAM_SCHEMA) if machine_param_file else None
+        self.audit_trail = audit_trail
+        self.max_workers = max(1, int(max_workers))
+        if intermediate_format not in IMAGE_FORMATS:
+            raise Exception(f"Unknown intermediate format: {intermediate_format} (expected one of {IMAGE_FORMATS})")
+        self.intermediate_format = intermediate_format
+        
+        # Stage durations and I/O of the current run (see timing.py)
+        self.timer = StageTimer()
+        
+        # Measurements of the case being analyzed (see results_store.py), so the derived values
+        # and the report do not read the CSVs back
+        self.results_store = None
         
         # Derive device_id from param file path if not provided
         if device_id:
@@ -51,7 +116,23 @@ class CTQA:
         self.log_file = self._setup_logging()
         
     def _setup_logging(self):
-        """Setup logging to file and console"""
+        """
+        Setup logging to file and console
+        
+        Returns:
+            Path of the log file (the file of an existing root file handler, e.g. the worker's job log)
+        """
+        # Configure root logger
+        # Only add handlers if root logger doesn't already have file handlers (to avoid duplicates when called from worker)
+        root_logger = logging.getLogger()
+        root_logger.setLevel(logging.INFO)
+        
+        # Check if root logger already has file handlers (e.g., from worker setup)
+        existing_file_handlers = [h for h in root_logger.handlers if isinstance(h, logging.FileHandler)]
+        if existing_file_handlers:
+            # CTQA will use the existing logging setup, no log file is opened
+            return existing_file_handlers[0].baseFilename
+        
         # Hardcoded log directory
         log_dir = "./_logs"
         
@@ -70,22 +151,8 @@ class CTQA:
         file_handler.setFormatter(formatter)
         console_handler.setFormatter(formatter)
         
-        # Configure root logger
-        # Only add handlers if root logger doesn't already have file handlers (to avoid duplicates when called from worker)
-        root_logger = logging.getLogger()
-        root_logger.setLevel(logging.INFO)
-        
-        # Check if root logger already has file handlers (e.g., from worker setup)
-        existing_file_handlers = [h for h in root_logger.handlers if isinstance(h, logging.FileHandler)]
-        
-        if not existing_file_handlers:
-            # No file handlers exist, add ours
-            root_logger.addHandler(file_handler)
-            root_logger.addHandler(console_handler)
-        else:
-            # File handlers already exist (likely from worker), don't add duplicate handlers
-            # CTQA will use the existing logging setup
-            pass
+        root_logger.addHandler(file_handler)
+        root_logger.addHandler(console_handler)
         
         # Ensure output is flushed
         sys.stdout.flush()
@@ -106,14 +173,135 @@ class CTQA:
         """Combine two paths"""
         return os.path.join(path1, path2)
     
-    def run(self, case_dir, progress_callback=None):
+    def get_baseline_dir(self):
+        """Baseline directory of the device"""
+        return f"./_data/devices/{self.device_id}/baseline"
+    
+    def get_baseline(self, baseline_dir=None):
+        """
+        Loaded baseline of the device from the per-process cache (see baseline.py)
+        
+        Args:
+            baseline_dir: Baseline directory (defaults to get_baseline_dir())
+            
+        Returns:
+            Baseline
+        """
+        return baseline_cache.get(baseline_dir or self.get_baseline_dir(), self.get_compiled_baseline_dir())
+    
+    def get_compiled_baseline_dir(self):
+        """Compiled baseline directory of the device (label maps, ROIs, labels; see compile_baseline)"""
+        return f"./_data/devices/{self.device_id}/baseline_compiled"
+    
+    def compile_baseline(self):
+        """
+        Precompute the label map of each mask key, the ROI bounding boxes and the labels of the
+        device baseline into get_compiled_baseline_dir()
+        
+        Re-run after the baseline is re-commissioned; until then the label maps are built
+        from the baseline masks when a process first needs them.
+        
+        Returns:
+            compiled.json content (dictionary)
+        """
+        baseline_dir = self.get_baseline_dir()
+        if not os.path.exists(baseline_dir):
+            self.log_error(f"Baseline directory not found: {baseline_dir}")
+        compiled_dir = self.get_compiled_baseline_dir()
+        self.log_line(f"compiling baseline {baseline_dir} to {compiled_dir}...")
+        return compile_baseline(baseline_dir, compiled_dir, self.get_mask_counts())
+    
+    def get_mask_counts(self):
+        """Number of masks per key (num_of_{key}_masks)"""
+        return {key: self.machine_param.get_int(f"num_of_{key}_masks", 0) for key in MASK_KEYS}
+    
+    def preload_baseline(self):
+        """
+        Load the baseline of the device into the per-process cache
+        
+        Loads the CT, registration mask, id2label and the label map of every key, and
+        hashes the baseline images for the registration cache key. Called at worker
+        startup so the jobs (forked from the worker) start with a warm cache.
+        """
+        baseline_dir = self.get_baseline_dir()
+        self.log_line(f"preloading baseline: {baseline_dir}")
+        self.get_baseline(baseline_dir).preload(self.get_mask_counts())
+        hash_image(self.combine(baseline_dir, "CT.nrrd"))
+        hash_image(self.combine(baseline_dir, "fuz_mask.nrrd"))
+    
+    def get_cases_dir(self):
+        """Cases directory of the device"""
+        return f"./_data/devices/{self.device_id}/cases"
+    
+    def find_warm_start_dir(self, case_dir):
+        """
+        Registration directory of the most recent successful case of the device before case_dir
+        
+        A case qualifies if it has a registration transform, the final metric of that
+        registration (to check the warm start against) and analysis results. Case folders
+        are named YYYYMMDD_HHMMSS, so the newest sorts last; only cases sorting before
+        case_dir are used, so re-processing an old case is not seeded from a later one.
+        
+        Args:
+            case_dir: Current case directory (excluded)
+            
+        Returns:
+            Path to the 1.reg directory of that case, or None
+        """
+        cases_dir = Path(self.get_cases_dir())
+        if not cases_dir.exists():
+            return None
+        
+        current = Path(case_dir).resolve()
+        for other in sorted(cases_dir.iterdir(), reverse=True):
+            if not other.is_dir() or other.name >= current.name:
+                continue
+            reg_dir = other / "1.reg"
+            if (reg_dir / "TransformParameters.0.tfm").exists() and \
+                    (other / "3.analysis" / "analysis_results.json").exists() and \
+                    read_registration_info(str(reg_dir)).get("final_metric_value") is not None:
+                return str(reg_dir)
+        return None
+    
+    def run_stage(self, name, func):
+        """Run func() as a timed stage of the current run"""
+        with self.timer.stage(name):
+            return func()
+    
+    def run_tasks(self, tasks):
+        """
+        Run independent tasks, in a thread pool when max_workers > 1
+        
+        SimpleITK and NumPy release the GIL for most of their work, so the
+        per-key stages overlap well in threads. Exceptions are re-raised.
+        
+        Args:
+            tasks: List of callables taking no arguments
+        """
+        if self.max_workers == 1 or len(tasks) <= 1:
+            for task in tasks:
+                task()
+            return
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(task) for task in tasks]
+            for future in futures:
+                future.result()
+    
+    def run(self, case_dir, progress_callback=None, force_registration=False, archive=True, timer=None):
         """
         Main processing function - processes CT DICOM files and generates report
         
         Args:
             case_dir: Directory containing CT DICOM files (CT.xxx.dcm) or CT.mhd
             progress_callback: Optional callback function(progress: int) to report progress (0-100)
+            force_registration: Re-run the registration even if 1.reg holds a transform for the same inputs
+            archive: Re-write the intermediate images compressed at the end (see archive_case_images);
+                callers may pass False and archive after reporting the results
+            timer: StageTimer to record the stages in (optional, e.g. holding the DICOM conversion
+                done by the caller); the stage timings are written to 3.analysis/timings.json
         """
+        self.timer = timer if timer is not None else StageTimer()
         print("Starting CTQA.run()...", flush=True)
         self.log_line("ctqa.run()")
         self.log_line(f"case_dir={case_dir}")
@@ -123,7 +311,7 @@ class CTQA:
             self.log_error(f"Case directory not found: {case_dir}")
         
         # Construct baseline_dir from device_id
-        baseline_dir = f"./_data/devices/{self.device_id}/baseline"
+        baseline_dir = self.get_baseline_dir()
         if not os.path.exists(baseline_dir):
             self.log_error(f"Baseline directory not found: {baseline_dir}")
         
@@ -155,7 +343,8 @@ class CTQA:
                 raise Exception(f"No DICOM files found in {case_dir}. Cannot create CT.mhd.")
             
             try:
-                dicom_series_to_mhd(case_dir, case_dir)
+                with self.timer.stage("dicom_conversion"):
+                    dicom_series_to_mhd(case_dir, case_dir, image_format=self.intermediate_format)
                 self.log_line("DICOM to MHD conversion completed")
             except Exception as e:
                 self.log_error(f"Failed to convert DICOM to MHD: {e}")
@@ -208,24 +397,27 @@ class CTQA:
         self.log_line(f"reg_out={reg_out}")
         self.log_line("Using SimpleITK rigid body registration (no parameter files needed)")
         
+        # Seed from the previous case of the device if warm start is enabled (registration_warmStart=1)
+        warm_start_dir = None
+        if read_registration_params(self.machine_param)["warmStart"]:
+            warm_start_dir = self.find_warm_start_dir(case_dir)
+            self.log_line(f"warm_start_dir={warm_start_dir}")
+        
         # param_files parameter kept for compatibility but not used with SimpleITK rigid registration
         param_files = []  # Empty list since SimpleITK doesn't need parameter files
         # Pass machine_param to registration function to read registration parameters
-        rigid_body_registration(f_abs, fMask, m, mMask, reg_out, param_files, param=self.machine_param)
+        with self.timer.stage("registration"):
+            baseline = self.get_baseline(baseline_dir)
+            rigid_body_registration(f_abs, fMask, m, mMask, reg_out, param_files, param=self.machine_param,
+                                    force=force_registration, warm_start_dir=warm_start_dir,
+                                    moving_image_data=baseline.ct(), moving_mask_data=baseline.registration_mask(),
+                                    timer=self.timer)
         if progress_callback:
             progress_callback(40)  # Registration complete
         
         # Transfer masks
         self.log_line("transferring masks...")
-        baseline_ext = "nrrd"
-        # For SimpleITK, we use TransformParameters.0.txt (single transform)
-        num_transforms = 1  # SimpleITK rigid registration produces a single transform
-        self.transfer_masks(baseline_dir, baseline_ext, case_dir, num_transforms, "HU")
-        self.transfer_masks(baseline_dir, baseline_ext, case_dir, num_transforms, "UF")
-        self.transfer_masks(baseline_dir, baseline_ext, case_dir, num_transforms, "HC")
-        self.transfer_masks(baseline_dir, baseline_ext, case_dir, num_transforms, "LC")
-        self.transfer_masks(baseline_dir, baseline_ext, case_dir, num_transforms, "geo")
-        self.transfer_masks(baseline_dir, baseline_ext, case_dir, num_transforms, "DT")
+        self.transfer_all_masks(baseline_dir, case_dir)
         if progress_callback:
             progress_callback(60)  # Mask transfer complete
         
@@ -239,21 +431,127 @@ class CTQA:
         
         # Make a report
         self.log_line("making a report...")
-        self.report(case_dir, baseline_dir, result_dir)
+        self.run_stage("report", lambda: self.report(case_dir, baseline_dir, result_dir))
         if progress_callback:
             progress_callback(100)  # Report generation complete
         
+        # Keep compressed MHD as the archival format
+        if archive:
+            self.archive_case_images(case_dir)
+        self.timer.write(self.combine(result_dir, TIMINGS_FILE))
+        
         # Email the report (optional)
         self.log_line("emailing report...")
         # self.email_report(case_dir)
         
         self.log_line("exiting ctqa.run()...")
     
+    def regenerate_report(self, case_dir):
+        """
+        Regenerate report.html and analysis_results.json from the existing 3.analysis results
+        
+        Skips registration, mask transfer and measurements, so a changed tolerance in param.txt
+        or a changed report template takes effect without re-processing the images.
+        
+        Args:
+            case_dir: Processed case directory
+            
+        Returns:
+            Path to report.html
+        """
+        result_dir = self.combine(case_dir, "3.analysis")
+        missing = [f for f in REPORT_CSV_FILES if not os.path.exists(self.combine(result_dir, f))]
+        if missing:
+            raise Exception(f"Cannot regenerate the report of {case_dir}, results missing: {', '.join(missing)}")
+        
+        self.log_line(f"regenerating report: {case_dir}")
+        self.results_store = ResultsStore.load(self.combine(result_dir, RESULTS_STORE_FILE))
+        self.run_stage("report", lambda: self.report(case_dir, self.get_baseline_dir(), result_dir))
+        return self.combine(result_dir, "report.html")
+    
+    def regenerate_reports(self, case_ids=None):
+        """
+        Regenerate the reports of all processed cases of the device (see regenerate_report)
+        
+        Cases without measurement results are skipped.
+        
+        Args:
+            case_ids: Case ids to include (default: all cases of the device)
+            
+        Returns:
+            List of (case_dir, error) tuples, error is None for regenerated reports
+        """
+        cases_dir = Path(self.get_cases_dir())
+        if not cases_dir.exists():
+            return []
+        
+        results = []
+        for case_path in sorted(cases_dir.iterdir()):
+            if not case_path.is_dir() or (case_ids and case_path.name not in case_ids):
+                continue
+            if not (case_path / "3.analysis" / REPORT_CSV_FILES[0]).exists():
+                continue
+            try:
+                self.regenerate_report(str(case_path))
+                results.append((str(case_path), None))
+            except Exception as e:
+                logging.warning(f"Report of {case_path} not regenerated: {e}")
+                results.append((str(case_path), str(e)))
+        self.log_line(f"regenerated {sum(1 for _, error in results if error is None)} of {len(results)} reports")
+        return results
+    
+    def archive_case_images(self, case_dir):
+        """
+        Re-write the uncompressed intermediate images of a case (CT.mhd, 2.seg/*.mhd) compressed
+        and remove the memory-mapped CT (CT.npy)
+        
+        Args:
+            case_dir: Case directory
+        """
+        mhd_files = [self.combine(case_dir, "CT.mhd")] + \
+            sorted(str(f) for f in Path(self.combine(case_dir, "2.seg")).glob("*.mhd"))
+        self.log_line("archiving case images...")
+        with self.timer.stage("archive"):
+            archive_images(mhd_files)
+            remove_mapped_volume(self.combine(case_dir, "CT.npy"))
+    
+    def write_review_images(self, case_dir):
+        """
+        Write the registration review images (result.mhd, resampled.mha) of a registered case
+        
+        Not part of run(): nothing in the analysis reads them, so they are generated on demand.
+        
+        Args:
+            case_dir: Case directory containing 1.reg
+        """
+        reg_out = self.combine(case_dir, "1.reg")
+        f_abs = os.path.abspath(self.combine(case_dir, "CT.mhd"))
+        m = self.combine(self.get_baseline_dir(), "CT.nrrd")
+        self.log_line(f"writing registration review images to {reg_out}...")
+        write_registration_review_images(reg_out, f_abs, m)
+    
+    def transfer_all_masks(self, baseline_dir, case_dir):
+        """Transfer the masks of all keys (independent once the registration transform exists)"""
+        baseline_ext = "nrrd"
+        # For SimpleITK, we use TransformParameters.0.txt (single transform)
+        num_transforms = 1  # SimpleITK rigid registration produces a single transform
+        
+        # Create the output folder up front so parallel tasks don't race on it
+        os.makedirs(self.combine(case_dir, "2.seg"), exist_ok=True)
+        
+        self.run_tasks([
+            lambda key=key: self.run_stage(
+                f"transfer.{key}",
+                lambda: self.transfer_masks(baseline_dir, baseline_ext, case_dir, num_transforms, key))
+            for key in MASK_KEYS
+        ])
+    
     def transfer_masks(self, baseline_dir, ext, case_dir, num_of_etx_input_param_files, key):
         """Transfer masks from baseline to case using registration transform
         
-        Uses composite mask approach: combines all masks into one image with different
-        pixel values, applies transform, then splits back into individual masks.
+        Uses composite mask approach: the baseline label map of the key (all masks in one
+        image with different pixel values, see baseline.py) is transformed, then split
+        back into individual masks.
         """
         import numpy as np
         import SimpleITK as sitk
@@ -268,86 +566,30 @@ class CTQA:
         if not os.path.exists(seg_dir):
             os.makedirs(seg_dir)
         
-        num_of_masks = int(self.machine_param.get_value(f"num_of_{key}_masks"))
+        num_of_masks = self.machine_param.get_int(f"num_of_{key}_masks")
         
         if num_of_masks == 0:
             return
         
-        # Step 1: Load all masks and create composite image
-        self.log_line(f"Creating composite mask for {key} ({num_of_masks} masks)...")
-        masks = []
-        mask_files = []
-        
-        for i in range(1, num_of_masks + 1):
-            mask_file = self.combine(baseline_dir, f"{key}{i}.nrrd")
-            if os.path.exists(mask_file):
-                mask = sitk.ReadImage(mask_file)
-                masks.append(mask)
-                mask_files.append(mask_file)
-            else:
-                self.log_error(f"Mask file not found: {mask_file}")
-        
-        if not masks:
-            self.log_error(f"No masks found for {key}")
-            return
-        
-        # Get reference image (first mask) for spacing/origin/size
-        reference_mask = masks[0]
-        ref_spacing = reference_mask.GetSpacing()
-        ref_origin = reference_mask.GetOrigin()
-        ref_size = reference_mask.GetSize()
-        
-        # Verify all masks have the same spacing, origin, and size
-        for i, mask in enumerate(masks, 1):
-            mask_spacing = mask.GetSpacing()
-            mask_origin = mask.GetOrigin()
-            mask_size = mask.GetSize()
-            
-            if mask_spacing != ref_spacing or mask_origin != ref_origin or mask_size != ref_size:
-                self.log_error(
-                    f"Mask {key}{i} has different geometry than reference mask!\n"
-                    f"  Reference: spacing={ref_spacing}, origin={ref_origin}, size={ref_size}\n"
-                    f"  Mask {i}: spacing={mask_spacing}, origin={mask_origin}, size={mask_size}"
-                )
-                raise Exception(f"Mask geometry mismatch for {key}{i}")
-        
-        self.log_line(f"All {len(masks)} masks have consistent geometry")
-        
-        # Create composite mask with different pixel values for each mask
-        # Convert masks to numpy arrays
-        mask_arrays = []
-        for mask in masks:
-            mask_array = sitk.GetArrayFromImage(mask)
-            mask_arrays.append(mask_array)
+        # Step 1: Label map of all masks (pixel value i for mask i), compiled or loaded once per process
+        baseline = self.get_baseline(baseline_dir)
+        label_map = baseline.label_map(key, num_of_masks)
+        rois = baseline.rois(key, num_of_masks)
         
-        # Create composite: assign pixel value i+1 to mask i (1, 2, 3, ...)
-        composite_array = np.zeros_like(mask_arrays[0], dtype=np.float32)
-        for i, mask_array in enumerate(mask_arrays, 1):
-            # Where mask is > 0.5, set composite to i
-            composite_array[mask_array > 0.5] = float(i)
-        
-        # Convert back to SimpleITK image
-        composite_image = sitk.GetImageFromArray(composite_array)
-        composite_image.CopyInformation(reference_mask)
-        
-        # Save composite mask as MHD (keep it for inspection) with compression
-        composite_file = self.combine(seg_dir, f"{key}_composite.mhd")
-        write_mhd_compressed(composite_image, composite_file)
-        self.log_line(f"Saved composite mask: {composite_file} (compressed)")
-        
-        # Step 2: Apply transform to composite mask
-        self.log_line(f"Applying transform to composite mask...")
-        transformed_composite_file = apply_transform(composite_file, seg_dir, reg_transform_param_file, fixed_image_path)
+        # Step 2: Apply transform to the label map
+        self.log_line(f"Applying transform to the {key} label map...")
+        transformed_composite_file = apply_transform(label_map, seg_dir, reg_transform_param_file, fixed_image_path,
+                                                     result_name=f"{key}_result.mha")
         
         # Step 3: Split composite back into individual masks
         self.log_line(f"Splitting composite into individual masks...")
         transformed_composite = sitk.ReadImage(transformed_composite_file)
         transformed_array = sitk.GetArrayFromImage(transformed_composite)
         
-        # Save transformed composite mask as MHD (keep it for inspection) with compression
+        # Save transformed composite mask as MHD (keep it for inspection)
         transformed_composite_mhd = self.combine(seg_dir, f"{key}_composite_transformed.mhd")
-        write_mhd_compressed(transformed_composite, transformed_composite_mhd)
-        self.log_line(f"Saved transformed composite mask: {transformed_composite_mhd} (compressed)")
+        write_image(transformed_composite, transformed_composite_mhd, self.intermediate_format)
+        self.log_line(f"Saved transformed composite mask: {transformed_composite_mhd} ({self.intermediate_format})")
         
         # Read fixed image for reference
         fixed_image = sitk.ReadImage(fixed_image_path)
@@ -409,31 +651,59 @@ class CTQA:
                 )
                 raise Exception(f"Output mask {key}{i} geometry mismatch")
             
-            # Save individual mask as MHD (not NRRD) with compression
+            # Save individual mask as MHD (not NRRD)
             seg_out = self.combine(seg_dir, f"{key}{i}.mhd")
-            write_mhd_compressed(mask_image, seg_out)
-            self.log_line(f"Saved mask: {seg_out} (compressed, pixels: {num_pixels}, spacing={mask_spacing}, origin={mask_origin}, size={mask_size})")
+            write_image(mask_image, seg_out, self.intermediate_format)
+            self.log_line(f"Saved mask: {seg_out} ({self.intermediate_format}, pixels: {num_pixels} (baseline: {rois[i - 1]['voxels']}), spacing={mask_spacing}, origin={mask_origin}, size={mask_size})")
     
     def analyze(self, case_dir, CT_ext, mask_dir, mask_ext, out_dir):
         """Perform analysis on the CT images"""
         if not os.path.exists(out_dir):
             os.makedirs(out_dir)
+        self.results_store = ResultsStore(self.combine(out_dir, RESULTS_STORE_FILE))
+        
+        # The CT is shared by the measurements as one memory-mapped volume
+        ct = self.run_stage("open_ct_volume", lambda: self.open_ct_volume(case_dir, CT_ext))
+        
+        # The six measurements are independent; the derived values below need their CSVs
+        measurements = {
+            "HU": lambda: self.measure_mean(case_dir, CT_ext, mask_dir, mask_ext, "HU", out_dir, ct),
+            "UF": lambda: self.measure_mean(case_dir, CT_ext, mask_dir, mask_ext, "UF", out_dir, ct),
+            "HC": lambda: self.measure_std(case_dir, CT_ext, mask_dir, mask_ext, "HC", out_dir, ct),
+            "LC": lambda: self.measure_std(case_dir, CT_ext, mask_dir, mask_ext, "LC", out_dir, ct),
+            "geo": lambda: self.measure_dist(case_dir, CT_ext, mask_dir, mask_ext, "geo", 1.0, -500, 0.0, out_dir, ct),
+            "DT": lambda: self.measure_dist(case_dir, CT_ext, mask_dir, mask_ext, "DT", 0.0, 200, 1.0, out_dir, ct),
+        }
+        self.run_tasks([
+            lambda key=key, measure=measure: self.run_stage(f"measure.{key}", measure)
+            for key, measure in measurements.items()
+        ])
         
-        self.measure_mean(case_dir, CT_ext, mask_dir, mask_ext, "HU", out_dir)
-        self.measure_mean(case_dir, CT_ext, mask_dir, mask_ext, "UF", out_dir)
-        self.measure_std(case_dir, CT_ext, mask_dir, mask_ext, "HC", out_dir)
-        self.measure_std(case_dir, CT_ext, mask_dir, mask_ext, "LC", out_dir)
-        self.measure_dist(case_dir, CT_ext, mask_dir, mask_ext, "geo", 1.0, -500, 0.0, out_dir)
-        self.measure_dist(case_dir, CT_ext, mask_dir, mask_ext, "DT", 0.0, 200, 1.0, out_dir)
+        with self.timer.stage("measure.derived"):
+            self.calc_integral_non_uniformity(out_dir)
+            self.calc_relative_mtf(out_dir)
         
-        self.calc_integral_non_uniformity(out_dir)
-        self.calc_relative_mtf(out_dir)
+        self.results_store.save()
     
-    def measure_mean(self, case_dir, CT_ext, mask_dir, mask_ext, key, out_dir):
-        """Measure mean pixel values for masks"""
+    def open_ct_volume(self, case_dir, CT_ext):
+        """
+        Case CT as a memory-mapped volume (CT.npy with geometry in CT.npy.json, written once)
+        
+        Args:
+            case_dir: Case directory
+            CT_ext: Extension of the case CT (e.g. "mhd")
+            
+        Returns:
+            volumeio.MappedVolume
+        """
         CT = self.combine(case_dir, f"CT.{CT_ext}")
         self.log_line(f"CT={CT}")
-        num_of_masks = int(self.machine_param.get_value(f"num_of_{key}_masks"))
+        return open_mapped_volume(CT, self.combine(case_dir, "CT.npy"))
+    
+    def measure_mean(self, case_dir, CT_ext, mask_dir, mask_ext, key, out_dir, ct=None):
+        """Measure mean pixel values for masks (ct: shared MappedVolume, opened if None)"""
+        ct = ct or self.open_ct_volume(case_dir, CT_ext)
+        num_of_masks = self.machine_param.get_int(f"num_of_{key}_masks")
         
         values = []
         col_names = []
@@ -442,25 +712,20 @@ class CTQA:
             self.log_line(f"mask={mask}")
             
             # Get image stat
-            mean = self.mean_pixel_value(CT, mask)
+            mean = self.mean_pixel_value(ct, mask)
             self.log_line(f"mean pixel value = {mean}")
-            values.append(str(mean))
+            values.append(mean)
             
             # Col name
             col_name = f"{key}{i}"
             col_names.append(col_name)
         
-        outfile = self.combine(out_dir, f"{key}.csv")
-        self.log_line(f"saving to {outfile}")
-        with open(outfile, 'w') as f:
-            f.write(",".join(col_names) + "\n")
-            f.write(",".join(values) + "\n")
+        self.save_results(out_dir, f"{key}.csv", col_names, values)
     
-    def measure_std(self, case_dir, CT_ext, mask_dir, mask_ext, key, out_dir):
-        """Measure standard deviation of pixel values for masks"""
-        CT = self.combine(case_dir, f"CT.{CT_ext}")
-        self.log_line(f"CT={CT}")
-        num_of_masks = int(self.machine_param.get_value(f"num_of_{key}_masks"))
+    def measure_std(self, case_dir, CT_ext, mask_dir, mask_ext, key, out_dir, ct=None):
+        """Measure standard deviation of pixel values for masks (ct: shared MappedVolume, opened if None)"""
+        ct = ct or self.open_ct_volume(case_dir, CT_ext)
+        num_of_masks = self.machine_param.get_int(f"num_of_{key}_masks")
         
         values = []
         col_names = []
@@ -469,56 +734,61 @@ class CTQA:
             self.log_line(f"mask={mask}")
             
             # Get image stat
-            std = self.std_pixel_value(CT, mask)
+            std = self.std_pixel_value(ct, mask)
             self.log_line(f"std pixel value = {std}")
-            values.append(str(std))
+            values.append(std)
             
             # Col name
             col_name = f"{key}{i}"
             col_names.append(col_name)
         
-        outfile = self.combine(out_dir, f"{key}.csv")
-        self.log_line(f"saving to {outfile}")
-        with open(outfile, 'w') as f:
-            f.write(",".join(col_names) + "\n")
-            f.write(",".join(values) + "\n")
+        self.save_results(out_dir, f"{key}.csv", col_names, values)
     
-    def mean_pixel_value(self, img, mask):
-        """Calculate mean pixel value within mask"""
-        stat = mask + ".stat.txt"
-        calc_image_min_max_mean_std_3d_f(img, mask, stat)
-        
-        # Get mean value from the output file
-        p = Param(stat)
-        mean = float(p.get_value("mean"))
+    def pixel_stats(self, ct, mask):
+        """
+        Min/max/mean/std of the CT (MappedVolume) within a mask file, recorded in the results store
+        (and saved to {mask}.stat.txt with audit_trail)
+        """
+        import SimpleITK as sitk
         
-        return mean
+        stats = calc_masked_stats(ct.array, sitk.GetArrayFromImage(sitk.ReadImage(mask)))
+        if self.results_store is not None:
+            self.results_store.put("stats", os.path.basename(mask).split('.')[0], stats)
+        if self.audit_trail:
+            write_stats(mask + ".stat.txt", stats)
+        return stats
+    
+    def mean_pixel_value(self, ct, mask):
+        """Calculate mean pixel value within mask"""
+        return self.pixel_stats(ct, mask)["mean"]
     
-    def std_pixel_value(self, img, mask):
+    def std_pixel_value(self, ct, mask):
         """Calculate standard deviation of pixel values within mask"""
-        stat = mask + ".stat.txt"
-        calc_image_min_max_mean_std_3d_f(img, mask, stat)
-        
-        # Get std value from the output file
-        p = Param(stat)
-        std = float(p.get_value("std"))
-        
-        return std
+        return self.pixel_stats(ct, mask)["std"]
     
-    def measure_dist(self, case_dir, CT_ext, mask_dir, mask_ext, key, level0, th, level1, out_dir):
-        """Measure distances between geometric features"""
-        CT = self.combine(case_dir, f"CT.{CT_ext}")
-        self.log_line(f"CT={CT}")
-        num_of_masks = int(self.machine_param.get_value(f"num_of_{key}_masks"))
+    def measure_dist(self, case_dir, CT_ext, mask_dir, mask_ext, key, level0, th, level1, out_dir, ct=None):
+        """Measure distances between geometric features (ct: shared MappedVolume, opened if None)"""
+        ct = ct or self.open_ct_volume(case_dir, CT_ext)
+        num_of_masks = self.machine_param.get_int(f"num_of_{key}_masks")
+        
+        # Centers of mass of all masks in one pass over the CT
+        labels = list(range(1, num_of_masks + 1))
+        label_array = self.read_label_map(mask_dir, mask_ext, key, num_of_masks)
+        audit_files = None
+        if self.audit_trail:
+            audit_files = [
+                (self.combine(mask_dir, f"{key}{i}.{mask_ext}.roi.txt"), self.combine(out_dir, f"{key}{i}.crop.mha"))
+                for i in labels
+            ]
+        rois = []
+        coms = calc_centers_of_gravity_3d(ct, label_array, labels, level0, th, level1, audit_files, rois)
         
         points = []
-        for i in range(1, num_of_masks + 1):
+        for i, cog, roi in zip(labels, coms, rois):
             mask_name = f"{key}{i}"
-            mask = self.combine(mask_dir, f"{mask_name}.{mask_ext}")
-            self.log_line(f"mask={mask}")
-            
-            # Get image stat
-            com = self.center_of_mass(CT, mask, mask_name, level0, th, level1, out_dir)
+            if self.results_store is not None:
+                self.results_store.put("rois", mask_name, roi)
+            com = f"{cog[0]}, {cog[1]}, {cog[2]}"
             self.log_line(f"com = {com}")
             points.append(f"{mask_name},{com}")
         
@@ -537,34 +807,68 @@ class CTQA:
             labels.append(parts[0])
             values.append(parts[1])
         
-        outfile2 = self.combine(out_dir, f"{key}.dist.csv")
-        self.log_line(f"saving to {outfile2}")
-        with open(outfile2, 'w') as f:
-            f.write(",".join(labels) + "\n")
-            f.write(",".join(values) + "\n")
+        self.save_results(out_dir, f"{key}.dist.csv", labels, values)
     
-    def center_of_mass(self, img, mask, key, level0, th, level1, out_dir):
-        """Calculate center of mass for a masked region"""
-        # Get ROI from the mask
-        roi_txt = mask + ".roi.txt"
-        calc_bounding_box_3d(mask, roi_txt)
-        
-        # Crop around the hole
-        crop_img = self.combine(out_dir, f"{key}.crop.mha")
-        crop_3d_boundingbox_f(img, roi_txt, crop_img)
+    def save_results(self, out_dir, filename, ids, values):
+        """
+        Save measurement results to {out_dir}/{filename} (header line with the ids, value line)
+        and record them in the results store for the derived values and the report
         
-        # Threshold & invert the image (the hole is air [-1000])
-        th_img = crop_img + ".th.mha"
-        threshold_3d_f(crop_img, level0, th, level1, th_img)
+        Args:
+            out_dir: Analysis directory (3.analysis)
+            filename: Results CSV (e.g. "HU.csv")
+            ids: Column ids
+            values: Values (numbers or number strings, written with str())
+        """
+        outfile = self.combine(out_dir, filename)
+        self.log_line(f"saving to {outfile}")
+        write_result_csv(outfile, ids, values)
+        if self.results_store is not None and os.path.abspath(out_dir) == self.results_store.result_dir:
+            self.results_store.put_results(filename, ids, values)
+    
+    def load_results(self, result_dir, filename):
+        """
+        Measurement results of {result_dir}/{filename}, from the results store of the case if it
+        has them, otherwise read from the CSV
         
-        # Measure the moment
-        moment_file = th_img + ".mnt.txt"
-        calc_image_moments_3d_f(th_img, moment_file)
+        Returns:
+            (ids, values) with the values as floats, or None if the CSV does not exist
+        """
+        if self.results_store is not None and os.path.abspath(result_dir) == self.results_store.result_dir:
+            results = self.results_store.get_results(filename)
+            if results is not None:
+                return results
+        results = read_result_csv(self.combine(result_dir, filename))
+        if results is None:
+            return None
+        ids, values = results
+        return ids, [float(v) for v in values]
+    
+    def read_label_map(self, mask_dir, mask_ext, key, num_of_masks):
+        """
+        Read the masks {key}1..{key}N into one label map (pixel value i for mask i)
         
-        p = Param(moment_file)
-        com_string = p.get_value("Center of gravity").replace("[", "").replace("]", "").strip()
+        The transferred masks are split from one label map (see transfer_masks), so they
+        never overlap. Overlapping masks raise an Exception: one label map cannot hold
+        both, and relabelling the shared voxels would change the ROI of the earlier mask.
+        """
+        import numpy as np
+        import SimpleITK as sitk
         
-        return com_string
+        label_array = None
+        for i in range(1, num_of_masks + 1):
+            mask = self.combine(mask_dir, f"{key}{i}.{mask_ext}")
+            self.log_line(f"mask={mask}")
+            inside = sitk.GetArrayFromImage(sitk.ReadImage(mask)) > 0
+            if label_array is None:
+                label_array = np.zeros(inside.shape, dtype=np.uint16)
+            overlap = label_array[inside]
+            overlap = overlap[overlap > 0]
+            if overlap.size:
+                self.log_error(f"Mask {key}{i} overlaps mask {key}{int(overlap[0])} ({overlap.size} voxels)")
+            label_array[inside] = i
+        
+        return label_array
     
     def calculate_distances(self, points):
         """Calculate distances between consecutive points"""
@@ -606,31 +910,17 @@ class CTQA:
     
     def calc_integral_non_uniformity(self, result_dir):
         """Calculate integral non-uniformity"""
-        hu_file = self.combine(result_dir, "UF.csv")
-        
-        with open(hu_file, 'r') as f:
-            lines = f.readlines()
-            values_str = lines[1].strip().split(',')
-            values = [float(v) for v in values_str]
+        _, values = self.load_results(result_dir, "UF.csv")
         
         max_val = max(values)
         min_val = min(values)
         inu = (max_val - min_val) / (max_val + min_val)
         
-        result_file = self.combine(result_dir, "UF.uniformity.csv")
-        with open(result_file, 'w') as f:
-            f.write("Uniformity\n")
-            f.write(f"{inu}\n")
+        self.save_results(result_dir, "UF.uniformity.csv", ["Uniformity"], [inu])
     
     def calc_relative_mtf(self, result_dir):
         """Calculate relative MTF"""
-        file = self.combine(result_dir, "HC.csv")
-        
-        with open(file, 'r') as f:
-            lines = f.readlines()
-            label_line = lines[0].strip()
-            values_str = lines[1].strip().split(',')
-            v1 = [float(v) for v in values_str]
+        ids, v1 = self.load_results(result_dir, "HC.csv")
         
         # Normalize
         v2 = [v / v1[0] for v in v1]
@@ -654,48 +944,94 @@ class CTQA:
         x = (0.5 - b) / a if a != 0 else 0
         
         # Save RMTF
-        result_file = self.combine(result_dir, "HC.RMTF.csv")
-        with open(result_file, 'w') as f:
-            f.write(label_line + "\n")
-            f.write(",".join([str(v) for v in v2]) + "\n")
+        self.save_results(result_dir, "HC.RMTF.csv", ids, v2)
         
         # Save LP/cm for 0.5 RMTF
-        result_file = self.combine(result_dir, "HC.RMTF.calc.csv")
-        with open(result_file, 'w') as f:
-            f.write("RMTF=0.5\n")
-            f.write(f"{x}\n")
+        self.save_results(result_dir, "HC.RMTF.calc.csv", ["RMTF=0.5"], [x])
     
-    def gen_html_table_rows_from_csv(self, case_result_dir, baseline_dir, num_of_masks, tol, filename, num_format="0.0"):
-        """Generate HTML table rows from CSV comparison"""
-        id2label_file = self.combine(baseline_dir, "id2label.txt")
-        id2label = Param(id2label_file)
-        
-        # Read values from baseline
-        file0 = self.combine(baseline_dir, filename)
-        with open(file0, 'r') as f:
-            lines0 = f.readlines()
-            labels0 = lines0[0].strip().split(',')
-            values0 = lines0[1].strip().split(',')
-        
-        # Read values from this case
-        file1 = self.combine(case_result_dir, filename)
-        with open(file1, 'r') as f:
-            lines1 = f.readlines()
-            labels1 = lines1[0].strip().split(',')
-            values1 = lines1[1].strip().split(',')
-        
-        # Add rows
+    def compare_section_results(self, case_result_dir, baseline_dir, num_of_masks, tol, filename,
+                                name=None, placeholder=None, num_format="0.0", strict=True):
+        """
+        Compare the results of a measurement with the baseline
+        
+        The baseline values and id2label come from the baseline cache and the case values from
+        the last analyze() where available (see load_results), so nothing is read twice.
+        
+        Args:
+            case_result_dir: Case analysis directory (3.analysis)
+            baseline_dir: Baseline directory
+            num_of_masks: Number of values to compare
+            tol: Tolerance of the absolute difference
+            filename: Results CSV (header line, value line) in both directories
+            name, placeholder, num_format: Report section (see REPORT_SECTIONS)
+            strict: Raise an exception if either CSV is missing or has fewer than num_of_masks
+                values (the report must not pass with missing measurements); otherwise a
+                warning is logged and the section has the values found
+            
+        Returns:
+            SectionResults (not strict: without values if either CSV is missing)
+        """
+        baseline = self.get_baseline(baseline_dir)
+        id2label = baseline.id2label()
+        
+        ids, labels, values, reference = [], [], [], []
+        baseline_values = baseline.csv_values(filename)
+        case_values = self.load_results(case_result_dir, filename)
+        report_problem = self.log_error if strict else logging.warning
+        if baseline_values is None:
+            report_problem(f"Baseline results not found: {self.combine(baseline_dir, filename)}")
+        elif case_values is None:
+            report_problem(f"Case results not found: {self.combine(case_result_dir, filename)}")
+        else:
+            labels0, values0 = baseline_values
+            values1 = case_values[1]
+            for results_dir, results in [(baseline_dir, values0), (case_result_dir, values1)]:
+                if len(results) < num_of_masks:
+                    report_problem(f"{len(results)} values in {self.combine(results_dir, filename)}, "
+                                   f"{num_of_masks} expected")
+            n = min(num_of_masks, len(values0), len(values1))
+            for mask_id in labels0[:n]:
+                mask_id = mask_id.strip()
+                label = id2label.get_value(mask_id).strip()
+                ids.append(mask_id)
+                labels.append(label if label != "" else mask_id)
+            values = values1[:n]
+            reference = [float(v) for v in values0[:n]]
+        
+        return SectionResults(name or filename, placeholder, num_format, tol, ids, labels, values, reference)
+    
+    def compare_csv_results(self, case_result_dir, baseline_dir, num_of_masks, tol, filename):
+        """Compared results of a measurement as dictionaries (see SectionResults.rows())"""
+        return self.compare_section_results(case_result_dir, baseline_dir, num_of_masks, tol, filename).rows()
+    
+    def collect_results(self, case_result_dir, baseline_dir, study_date, study_time, operator):
+        """
+        Results of a case compared with the baseline for all report sections (see REPORT_SECTIONS),
+        built once and shared by the HTML report and analysis_results.json
+        
+        Returns:
+            AnalysisResults
+        """
+        metadata = {
+            "study_date": study_date,
+            "study_time": study_time,
+            "operator": operator,
+            "device_name": self.machine_param.get_value("device_name") or "Unknown"
+        }
+        sections = []
+        for name, placeholder, filename, num_of_masks, tol_key, num_format in REPORT_SECTIONS:
+            if isinstance(num_of_masks, str):
+                num_of_masks = self.machine_param.get_int(num_of_masks)
+            tol = self.machine_param.get_float(tol_key)
+            sections.append(self.compare_section_results(
+                case_result_dir, baseline_dir, num_of_masks, tol, filename, name, placeholder, num_format))
+        return AnalysisResults(metadata, sections)
+    
+    def gen_html_table_rows(self, results, num_format="0.0"):
+        """Generate HTML table rows from compared results (SectionResults.rows())"""
         rows = []
-        for i in range(num_of_masks):
-            mask_id = labels0[i].strip()
-            label = id2label.get_value(mask_id).strip()
-            if label == "":
-                label = mask_id
-            value0 = float(values0[i])
-            value1 = float(values1[i])
-            diff = value1 - value0
-            err = abs(diff)
-            pass_fail = "Pass" if err < tol else "Fail"
+        for r in results:
+            value1, value0, diff = r["value"], r["reference"], r["difference"]
             
             # Format numbers
             if num_format == "0.0":
@@ -711,13 +1047,13 @@ class CTQA:
                 value0_str = str(value0)
                 diff_str = str(diff)
             
-            if pass_fail == "Pass":
+            if r["passed"]:
                 pass_cell = '<td class="pass">Pass<span class="glyphicon glyphicon-ok" aria-hidden="true"></span></td>'
             else:
                 pass_cell = '<td class="fail">Fail<span class="glyphicon glyphicon-remove" aria-hidden="true"></span></td>'
             
             row = f"""<tr>
-    <td>{label}</td>
+    <td>{r["label"]}</td>
     <td>{value1_str}</td>
     <td>{value0_str}</td>
     <td>{diff_str}</td>
@@ -727,157 +1063,31 @@ class CTQA:
         
         return "\n".join(rows)
     
+    def gen_html_table_rows_from_csv(self, case_result_dir, baseline_dir, num_of_masks, tol, filename, num_format="0.0"):
+        """Generate HTML table rows from CSV comparison"""
+        return self.gen_html_table_rows(
+            self.compare_csv_results(case_result_dir, baseline_dir, num_of_masks, tol, filename), num_format)
+    
     def gen_html_table_rows_from_csv_key(self, case_result_dir, baseline_dir, key, filename, num_format="0.0"):
         """Generate HTML table rows from CSV using key for configuration"""
-        num_of_masks = int(self.machine_param.get_value(f"num_of_{key}_masks"))
-        tol = float(self.machine_param.get_value(f"{key}_tol"))
+        num_of_masks = self.machine_param.get_int(f"num_of_{key}_masks")
+        tol = self.machine_param.get_float(f"{key}_tol")
         return self.gen_html_table_rows_from_csv(case_result_dir, baseline_dir, num_of_masks, tol, filename, num_format)
     
     def collect_csv_results(self, case_result_dir, baseline_dir, num_of_masks, tol, filename):
-        """Collect analysis results from CSV for JSON output"""
-        id2label_file = self.combine(baseline_dir, "id2label.txt")
-        id2label = Param(id2label_file)
-        
-        results = []
-        
-        # Read baseline values
-        file0 = self.combine(baseline_dir, filename)
-        if not os.path.exists(file0):
-            return results
-        with open(file0, 'r') as f:
-            lines0 = f.readlines()
-            labels0 = lines0[0].strip().split(',')
-            values0 = lines0[1].strip().split(',')
-        
-        # Read case values
-        file1 = self.combine(case_result_dir, filename)
-        if not os.path.exists(file1):
-            return results
-        with open(file1, 'r') as f:
-            lines1 = f.readlines()
-            labels1 = lines1[0].strip().split(',')
-            values1 = lines1[1].strip().split(',')
-        
-        for i in range(min(num_of_masks, len(values0), len(values1))):
-            mask_id = labels0[i].strip()
-            label = id2label.get_value(mask_id).strip()
-            if label == "":
-                label = mask_id
-            value = float(values1[i])
-            reference = float(values0[i])
-            diff = value - reference
-            passed = abs(diff) < tol
-            
-            results.append({
-                "id": mask_id,
-                "label": label,
-                "value": round(value, 4),
-                "reference": round(reference, 4),
-                "difference": round(diff, 4),
-                "tolerance": tol,
-                "passed": passed
-            })
-        
-        return results
+        """Collect analysis results from CSV for JSON output (the values found, see compare_section_results)"""
+        return self.compare_section_results(case_result_dir, baseline_dir, num_of_masks, tol, filename,
+                                            strict=False).to_json()
     
     def collect_analysis_results(self, case_result_dir, baseline_dir, study_date, study_time, operator):
         """Collect all analysis results into a JSON-serializable dictionary"""
-        results = {
-            "metadata": {
-                "study_date": study_date,
-                "study_time": study_time,
-                "operator": operator,
-                "device_name": self.machine_param.get_value("device_name") or "Unknown"
-            },
-            "hu_consistency": {
-                "tolerance": float(self.machine_param.get_value("HU_tol")),
-                "results": self.collect_csv_results(
-                    case_result_dir, baseline_dir,
-                    int(self.machine_param.get_value("num_of_HU_masks")),
-                    float(self.machine_param.get_value("HU_tol")),
-                    "HU.csv"
-                )
-            },
-            "geometric_accuracy_inplane": {
-                "tolerance": float(self.machine_param.get_value("geo_tol")),
-                "results": self.collect_csv_results(
-                    case_result_dir, baseline_dir,
-                    int(self.machine_param.get_value("num_of_geo_masks")),
-                    float(self.machine_param.get_value("geo_tol")),
-                    "geo.dist.csv"
-                )
-            },
-            "geometric_accuracy_outofplane": {
-                "tolerance": float(self.machine_param.get_value("DT_tol")),
-                "results": self.collect_csv_results(
-                    case_result_dir, baseline_dir,
-                    int(self.machine_param.get_value("num_of_DT_masks")),
-                    float(self.machine_param.get_value("DT_tol")),
-                    "DT.dist.csv"
-                )
-            },
-            "uniformity_hu": {
-                "tolerance": float(self.machine_param.get_value("UF_tol")),
-                "results": self.collect_csv_results(
-                    case_result_dir, baseline_dir,
-                    int(self.machine_param.get_value("num_of_UF_masks")),
-                    float(self.machine_param.get_value("UF_tol")),
-                    "UF.csv"
-                )
-            },
-            "uniformity_integral": {
-                "tolerance": float(self.machine_param.get_value("UF.uniformity_tol")),
-                "results": self.collect_csv_results(
-                    case_result_dir, baseline_dir,
-                    1,
-                    float(self.machine_param.get_value("UF.uniformity_tol")),
-                    "UF.uniformity.csv"
-                )
-            },
-            "low_contrast": {
-                "tolerance": float(self.machine_param.get_value("LC_tol")),
-                "results": self.collect_csv_results(
-                    case_result_dir, baseline_dir,
-                    int(self.machine_param.get_value("num_of_LC_masks")),
-                    float(self.machine_param.get_value("LC_tol")),
-                    "LC.csv"
-                )
-            },
-            "high_contrast_rmtf": {
-                "tolerance": float(self.machine_param.get_value("HC_RMTF_tol")),
-                "results": self.collect_csv_results(
-                    case_result_dir, baseline_dir,
-                    int(self.machine_param.get_value("num_of_HC_masks")),
-                    float(self.machine_param.get_value("HC_RMTF_tol")),
-                    "HC.RMTF.csv"
-                )
-            },
-            "high_contrast_rmtf50": {
-                "tolerance": float(self.machine_param.get_value("HC_RMTF50_tol")),
-                "results": self.collect_csv_results(
-                    case_result_dir, baseline_dir,
-                    1,
-                    float(self.machine_param.get_value("HC_RMTF50_tol")),
-                    "HC.RMTF.calc.csv"
-                )
-            }
-        }
-        
-        # Calculate overall pass/fail
-        all_passed = True
-        for section_key, section_data in results.items():
-            if section_key == "metadata":
-                continue
-            for item in section_data.get("results", []):
-                if not item.get("passed", True):
-                    all_passed = False
-                    break
-            if not all_passed:
-                break
-        
-        results["overall_passed"] = all_passed
-        
-        return results
+        return self.collect_results(case_result_dir, baseline_dir, study_date, study_time, operator).to_json()
+    
+    def get_replace_words(self):
+        """Words replaced in the report (replace_words_for_report) with their replacements"""
+        replace_words = self.machine_param.get_value("replace_words_for_report")
+        return [(word.strip(), self.machine_param.get_value(word.strip()))
+                for word in replace_words.split(',') if word.strip()]
     
     def report(self, case_dir, baseline_dir, out_dir):
         """Generate HTML report"""
@@ -909,49 +1119,30 @@ class CTQA:
             StudyTime = now.strftime("%H%M%S")
             SeriesNumber = ""
         
-        # Read template - construct path from device_id
+        # Compiled template of the device (parsed once per process, see report_template.py)
         html_template_file = f"./_data/devices/{self.device_id}/report_templates/full/report.html"
         if not os.path.exists(html_template_file):
             self.log_error(f"report template not found: {html_template_file}")
             return
+        replace_words = self.get_replace_words()
+        for word, word_new in replace_words:
+            self.log_line(f"{word}->{word_new}...")
+        template = get_report_template(html_template_file, replace_words)
+        
+        # Compare the results with the baseline once for the HTML tables and the JSON
+        results = self.collect_results(case_result_dir, baseline_dir, StudyDate, StudyTime, user)
+        
+        values = {
+            "date": StudyDate,
+            "time": StudyTime,
+            "user": user,
+        }
+        for tol_key in REPORT_TOLERANCE_KEYS:
+            values[tol_key] = self.machine_param.get_value(tol_key)
+        for section in results.sections.values():
+            values[section.placeholder] = self.gen_html_table_rows(section.rows(), section.num_format)
         
-        with open(html_template_file, 'r') as f:
-            html = f.read()
-        
-        html = html.replace("{{{date}}}", StudyDate) \
-                   .replace("{{{time}}}", StudyTime) \
-                   .replace("{{{user}}}", user)
-        
-        UF_uniformity_tol = float(self.machine_param.get_value("UF.uniformity_tol"))
-        HC_RMTF_tol = float(self.machine_param.get_value("HC_RMTF_tol"))
-        HC_RMTF50_tol = float(self.machine_param.get_value("HC_RMTF50_tol"))
-        
-        html = html.replace("{{{HU_tol}}}", self.machine_param.get_value("HU_tol")) \
-                   .replace("{{{geo_tol}}}", self.machine_param.get_value("geo_tol")) \
-                   .replace("{{{DT_tol}}}", self.machine_param.get_value("DT_tol")) \
-                   .replace("{{{UF_tol}}}", self.machine_param.get_value("UF_tol")) \
-                   .replace("{{{LC_tol}}}", self.machine_param.get_value("LC_tol")) \
-                   .replace("{{{UF.uniformity_tol}}}", self.machine_param.get_value("UF.uniformity_tol")) \
-                   .replace("{{{HC_RMTF_tol}}}", self.machine_param.get_value("HC_RMTF_tol")) \
-                   .replace("{{{HC_RMTF50_tol}}}", self.machine_param.get_value("HC_RMTF50_tol"))
-        
-        html = html.replace("{{{HU}}}", self.gen_html_table_rows_from_csv_key(case_result_dir, baseline_dir, "HU", "HU.csv")) \
-                   .replace("{{{DT}}}", self.gen_html_table_rows_from_csv_key(case_result_dir, baseline_dir, "DT", "DT.dist.csv")) \
-                   .replace("{{{geo}}}", self.gen_html_table_rows_from_csv_key(case_result_dir, baseline_dir, "geo", "geo.dist.csv")) \
-                   .replace("{{{UF}}}", self.gen_html_table_rows_from_csv_key(case_result_dir, baseline_dir, "UF", "UF.csv")) \
-                   .replace("{{{UF.uniformity}}}", self.gen_html_table_rows_from_csv(case_result_dir, baseline_dir, 1, UF_uniformity_tol, "UF.uniformity.csv", "0.00")) \
-                   .replace("{{{LC}}}", self.gen_html_table_rows_from_csv_key(case_result_dir, baseline_dir, "LC", "LC.csv")) \
-                   .replace("{{{HC.RMTF}}}", self.gen_html_table_rows_from_csv(case_result_dir, baseline_dir, 15, HC_RMTF_tol, "HC.RMTF.csv", "0.00")) \
-                   .replace("{{{HC.RMTF.50}}}", self.gen_html_table_rows_from_csv(case_result_dir, baseline_dir, 1, HC_RMTF50_tol, "HC.RMTF.calc.csv", "0.0"))
-        
-        # Replace words
-        self.log_line("replacing words for report...")
-        replace_words = self.machine_param.get_value("replace_words_for_report")
-        if replace_words.strip() != "":
-            for word in replace_words.split(','):
-                word_new = self.machine_param.get_value(word.strip())
-                self.log_line(f"{word}->{word_new}...")
-                html = html.replace(word.strip(), word_new)
+        html = template.render(values)
         
         # Save the report
         html_file = self.combine(case_result_dir, "report.html")
@@ -961,7 +1152,7 @@ class CTQA:
         self.log_line(f"Report saved to: {html_file}")
         
         # Save analysis results to JSON
-        result_json = self.collect_analysis_results(case_result_dir, baseline_dir, StudyDate, StudyTime, user)
+        result_json = results.to_json()
         json_file = self.combine(case_result_dir, "analysis_results.json")
         import json
         with open(json_file, 'w') as f:
@@ -974,11 +1165,50 @@ if __name__ == "__main__":
     import argparse
     
     parser = argparse.ArgumentParser(description="CTQA - CT Quality Assurance Processing")
-    parser.add_argument("case_dir", help="Directory containing CT DICOM files or CT.mhd")
+    parser.add_argument("case_dir", nargs="?", help="Directory containing CT DICOM files or CT.mhd")
     parser.add_argument("--machine-param", help="Path to machine parameter file", required=True)
     parser.add_argument("--service-param", help="Path to service parameter file", required=True)
+    parser.add_argument("--audit-trail", action="store_true",
+                        help="Also write the legacy per-mask measurement files "
+                             "(.stat.txt, .roi.txt, .crop.mha, .th.mha, .mnt.txt)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of threads for the per-key mask transfer and measurements (default: 1)")
+    parser.add_argument("--force-registration", action="store_true",
+                        help="Re-run the registration even if a cached transform matches the inputs")
+    parser.add_argument("--intermediate-format", choices=IMAGE_FORMATS, default=DEFAULT_INTERMEDIATE_FORMAT,
+                        help="MetaImage variant of the intermediate images (compressed at the end of the run)")
+    parser.add_argument("--review-images", action="store_true",
+                        help="Only write the registration review images (result.mhd, resampled.mha) of a processed case")
+    parser.add_argument("--profile", action="store_true",
+                        help="Profile the run with cProfile (3.analysis/profile.prof, profile.txt)")
+    parser.add_argument("--report-only", action="store_true",
+                        help="Only regenerate report.html and analysis_results.json from the existing 3.analysis "
+                             "results; without case_dir, for all cases of the device")
+    parser.add_argument("--compile-baseline", action="store_true",
+                        help="Only compile the device baseline (label maps, ROIs, labels) into the device folder; "
+                             "case_dir is not needed")
     
     args = parser.parse_args()
+    if not args.case_dir and not (args.compile_baseline or args.report_only):
+        parser.error("case_dir is required")
     
-    ctqa = CTQA(machine_param_file=args.machine_param, service_param_file=args.service_param)
-    ctqa.run(args.case_dir)
+    ctqa = CTQA(machine_param_file=args.machine_param, service_param_file=args.service_param,
+                audit_trail=args.audit_trail, max_workers=args.workers,
+                intermediate_format=args.intermediate_format)
+    if args.compile_baseline:
+        ctqa.compile_baseline()
+    elif args.report_only and args.case_dir:
+        ctqa.regenerate_report(args.case_dir)
+    elif args.report_only:
+        start = datetime.now()
+        results = ctqa.regenerate_reports()
+        for case_dir, error in results:
+            if error:
+                print(f"FAILED {case_dir}: {error}")
+        print(f"{sum(1 for _, error in results if error is None)} of {len(results)} reports regenerated "
+              f"in {(datetime.now() - start).total_seconds():.1f} s")
+    elif args.review_images:
+        ctqa.write_review_images(args.case_dir)
+    else:
+        with profiled(os.path.join(args.case_dir, "3.analysis"), enabled=args.profile):
+            ctqa.run(args.case_dir, force_registration=args.force_registration)
@@ -4,91 +4,454 @@ DICOM tools - handles DICOM to MHD conversion
 """
 
 import os
+import json
+import shutil
 import logging
+import threading
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import SimpleITK as sitk
+from volumeio import ARCHIVE_FORMAT, write_image
 
 
-def write_mhd_compressed(image, output_file):
+# Threads for reading DICOM headers and decoding pixel data
+DICOM_READ_WORKERS = min(8, os.cpu_count() or 1)
+
+
+# Series index written into scanned DICOM directories (see index_dicom_directory)
+SERIES_INDEX_FILE = ".series_index.json"
+SERIES_INDEX_VERSION = 1
+
+# Slice store of a DICOM directory (see ingest_dicom_file): per file, its index entry
+# ({name}.json) and, for an image slice, its pixels rescaled to HU (int16, {name}.hu)
+SLICE_STORE_DIR = ".slices"
+
+
+def _float_list(value):
+    """DICOM multi-value as a list of floats (None if missing)"""
+    return [float(v) for v in value] if value else None
+
+
+def _read_dicom_header(file_path):
     """
-    Write image as MHD file with compression enabled
+    Index entry of a DICOM file from its header (no pixel data)
+    
+    Returns:
+        Dictionary with the UIDs of a DICOM file, plus position, geometry and rescale
+        if it is an image slice ({"dicom": False, "slice": False} if not DICOM)
+    """
+    import pydicom
+    
+    try:
+        ds = pydicom.dcmread(file_path, stop_before_pixels=True)
+    except Exception as e:
+        logging.debug(f"Skipping file {file_path}: {e}")
+        return {"dicom": False, "slice": False}
+    return _header_entry(ds)
+
+
+def _header_entry(ds):
+    """Index entry of a DICOM dataset (see _read_dicom_header)"""
+    entry = {
+        "dicom": True,
+        "slice": False,
+        "study_uid": str(getattr(ds, "StudyInstanceUID", "")),
+        "series_uid": str(getattr(ds, "SeriesInstanceUID", "")),
+        "patient_id": str(getattr(ds, "PatientID", "")),
+        "modality": str(getattr(ds, "Modality", "")),
+    }
+    if not hasattr(ds, "ImagePositionPatient") or not hasattr(ds, "Rows"):
+        return entry
+    
+    slope, intercept = get_rescale(ds)
+    instance_number = getattr(ds, "InstanceNumber", None)
+    entry.update({
+        "slice": True,
+        "series_number": str(getattr(ds, "SeriesNumber", "")),
+        "series_description": str(getattr(ds, "SeriesDescription", "")),
+        "instance_number": int(instance_number) if instance_number not in (None, "") else None,
+        "position": _float_list(ds.ImagePositionPatient),
+        "orientation": _float_list(getattr(ds, "ImageOrientationPatient", None)),
+        "pixel_spacing": _float_list(getattr(ds, "PixelSpacing", None)),
+        "rows": int(ds.Rows),
+        "columns": int(ds.Columns),
+        "slope": slope,
+        "intercept": intercept,
+    })
+    return entry
+
+
+def read_series_index(dir_in):
+    """Read the series index of a directory (empty if missing, unreadable or of another version)"""
+    index_file = os.path.join(dir_in, SERIES_INDEX_FILE)
+    if not os.path.exists(index_file):
+        return {}
+    try:
+        with open(index_file, 'r') as f:
+            index = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Could not read {index_file}: {e}")
+        return {}
+    if index.get("version") != SERIES_INDEX_VERSION:
+        return {}
+    return index.get("files", {})
+
+
+def write_series_index(dir_in, files):
+    """Write the series index of a directory (atomically, so concurrent readers never see a partial file)"""
+    index_file = os.path.join(dir_in, SERIES_INDEX_FILE)
+    tmp_file = f"{index_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump({"version": SERIES_INDEX_VERSION, "files": files}, f, separators=(",", ":"))
+    os.replace(tmp_file, index_file)
+
+
+def index_dicom_directory(dir_in, max_workers=DICOM_READ_WORKERS, write=True):
+    """
+    Index the DICOM files of a directory: file name -> UIDs, position, geometry and rescale
+    
+    The index is stored in the directory (SERIES_INDEX_FILE). Entries are keyed by
+    file mtime and size, so only new or changed files are parsed (headers only,
+    in parallel) and removed files are dropped.
     
     Args:
-        image: SimpleITK image to write
-        output_file: Output file path (.mhd)
+        dir_in: Directory containing DICOM files
+        max_workers: Number of threads reading headers
+        write: Store the updated index (False: new or changed files are parsed, but the
+            directory is not modified)
+        
+    Returns:
+        Dictionary file name -> index entry (see _read_dicom_header, plus mtime and size)
     """
-    writer = sitk.ImageFileWriter()
-    writer.SetFileName(output_file)
-    writer.SetUseCompression(True)
-    writer.Execute(image)
+    index = read_series_index(dir_in)
+    
+    files = {}
+    to_parse = []
+    for entry in os.scandir(dir_in):
+        if not entry.is_file() or entry.name == SERIES_INDEX_FILE or entry.name.startswith(SERIES_INDEX_FILE):
+            continue
+        stat = entry.stat()
+        cached = index.get(entry.name)
+        if not (cached and cached.get("mtime") == stat.st_mtime_ns and cached.get("size") == stat.st_size):
+            # Files ingested on upload were parsed then (see ingest_dicom_file)
+            cached = _read_stored_entry(dir_in, entry.name, stat.st_mtime_ns, stat.st_size)
+        if cached:
+            files[entry.name] = cached
+        else:
+            to_parse.append((entry.name, stat))
+    
+    if to_parse:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            headers = executor.map(_read_dicom_header, [os.path.join(dir_in, name) for name, _ in to_parse])
+            for (name, stat), header in zip(to_parse, headers):
+                files[name] = {"mtime": stat.st_mtime_ns, "size": stat.st_size, **header}
 
+    if write and (to_parse or files != index):
+        logging.info(f"Series index of {dir_in}: {len(to_parse)} of {len(files)} files parsed")
+        write_series_index(dir_in, files)
+    return files
 
-def dicom_series_to_mhd(dir_in, dir_out):
+
+def list_dicom_series(index):
+    """
+    Group the slices of a series index by SeriesInstanceUID
+    
+    Args:
+        index: Series index (see index_dicom_directory)
+        
+    Returns:
+        Dictionary series UID -> list of (file name, entry) sorted by z-position
+    """
+    series = {}
+    for name, entry in index.items():
+        if entry.get("slice"):
+            series.setdefault(entry["series_uid"], []).append((name, entry))
+    for slices in series.values():
+        slices.sort(key=lambda s: s[1]["position"][2])
+    return series
+
+
+def summarize_dicom_series(index):
+    """
+    One summary per series of a series index (for listing/choosing a series)
+    
+    Returns:
+        List of dictionaries (series_uid, study_uid, modality, series_number,
+        series_description, num_of_slices), largest series first
+    """
+    summaries = []
+    for series_uid, slices in list_dicom_series(index).items():
+        first = slices[0][1]
+        summaries.append({
+            "series_uid": series_uid,
+            "study_uid": first["study_uid"],
+            "modality": first["modality"],
+            "series_number": first["series_number"],
+            "series_description": first["series_description"],
+            "num_of_slices": len(slices),
+        })
+    summaries.sort(key=lambda s: s["num_of_slices"], reverse=True)
+    return summaries
+
+
+def select_ct_series(index, series_uid=None):
+    """
+    Pick the CT series to convert from a series index
+    
+    Args:
+        index: Series index (see index_dicom_directory)
+        series_uid: SeriesInstanceUID to use (optional); by default the CT series
+            with the most slices (any modality if there is no CT series)
+        
+    Returns:
+        List of (file name, entry) sorted by z-position (empty if no slices)
+    """
+    series = list_dicom_series(index)
+    if series_uid:
+        if series_uid not in series:
+            raise Exception(f"Series {series_uid} not found")
+        return series[series_uid]
+    if not series:
+        return []
+    
+    ct_series = {uid: slices for uid, slices in series.items() if slices[0][1]["modality"] == "CT"} or series
+    slices = max(ct_series.values(), key=len)
+    if len(series) > 1:
+        logging.warning(f"Found {len(series)} series, using {slices[0][1]['series_uid']} with {len(slices)} slices")
+    return slices
+
+
+def get_rescale(ds):
+    """RescaleSlope and RescaleIntercept of a DICOM dataset (1.0 and 0.0 if missing)"""
+    slope = float(ds.RescaleSlope) if hasattr(ds, 'RescaleSlope') else 1.0
+    intercept = float(ds.RescaleIntercept) if hasattr(ds, 'RescaleIntercept') else 0.0
+    return slope, intercept
+
+
+def rescale_to_hu(pixels, slope, intercept, out):
+    """
+    Rescale stored pixel values of one slice to HU, written into an int16 output slice
+    
+    Computed in float32 on the raw pixels (no int16 wrap-around of unsigned data),
+    rounded and clipped to the int16 range. Only one slice-sized temporary is used.
+    
+    Args:
+        pixels: Stored pixel values of the slice (any integer dtype)
+        slope: RescaleSlope
+        intercept: RescaleIntercept
+        out: Output slice (int16), e.g. volume[i]
+    """
+    hu = pixels.astype(np.float32)
+    if slope != 1.0:
+        hu *= slope
+    if intercept != 0.0:
+        hu += intercept
+    np.rint(hu, out=hu)
+    np.clip(hu, -32768, 32767, out=hu)
+    out[...] = hu
+
+
+def read_dicom_pixels_into(volume, file_paths, rescales, max_workers=DICOM_READ_WORKERS, indices=None):
+    """
+    Decode the pixel data of DICOM files into a preallocated HU volume
+    
+    Each slice is decoded by a worker thread, rescaled with its own slope/intercept
+    and written into volume[i]; the dataset is released right after, so only a few
+    slices are held besides the volume.
+    
+    Args:
+        volume: Preallocated int16 array (Z, Y, X)
+        file_paths: One file per slice, in z order
+        rescales: (slope, intercept) per slice
+        max_workers: Number of threads decoding pixel data
+        indices: Slices to decode (default: all)
+    """
+    import pydicom
+    
+    def read_slice(i):
+        slope, intercept = rescales[i]
+        rescale_to_hu(pydicom.dcmread(file_paths[i]).pixel_array, slope, intercept, volume[i])
+    
+    if indices is None:
+        indices = range(len(file_paths))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for _ in executor.map(read_slice, indices):
+            pass
+
+
+def _slice_store_files(dir_in, name):
+    """(index entry file, HU pixels file) of a file in the slice store of dir_in"""
+    store_dir = os.path.join(dir_in, SLICE_STORE_DIR)
+    return os.path.join(store_dir, f"{name}.json"), os.path.join(store_dir, f"{name}.hu")
+
+
+def _write_file_atomic(file_path, data):
+    """Write a file atomically (concurrent readers never see a partial file)"""
+    tmp_file = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_file, file_path)
+
+
+def _read_stored_entry(dir_in, name, mtime, size):
+    """Index entry of a file from the slice store, None if not stored or stored for another version of the file"""
+    entry_file, _ = _slice_store_files(dir_in, name)
+    try:
+        with open(entry_file, 'r') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if entry.get("mtime") != mtime or entry.get("size") != size:
+        return None
+    return entry
+
+
+def ingest_dicom_file(dir_in, name):
+    """
+    Parse a DICOM file once, as it arrives (e.g. on upload), into the slice store of its directory
+    
+    The index entry of the file is stored, and for an image slice its pixel data,
+    rescaled to HU. index_dicom_directory then takes the entry from the store, and
+    dicom_series_to_mhd copies the stored slice into the volume instead of reading
+    and decoding the file again. A file that is not DICOM, or whose pixel data
+    cannot be decoded, is only indexed (its conversion decodes it as usual).
+    
+    Args:
+        dir_in: DICOM directory (e.g. 0.inputs of a case)
+        name: File name in dir_in
+    
+    Returns:
+        Index entry (see index_dicom_directory)
+    """
+    import pydicom
+    
+    file_path = os.path.join(dir_in, name)
+    stat = os.stat(file_path)
+    entry_file, pixels_file = _slice_store_files(dir_in, name)
+    os.makedirs(os.path.dirname(entry_file), exist_ok=True)
+    
+    try:
+        ds = pydicom.dcmread(file_path)
+        entry = _header_entry(ds)
+    except Exception as e:
+        logging.debug(f"Not ingesting file {file_path}: {e}")
+        ds = None
+        entry = {"dicom": False, "slice": False}
+    
+    if entry["slice"]:
+        try:
+            pixels = ds.pixel_array
+            if pixels.shape != (entry["rows"], entry["columns"]):
+                raise Exception(f"pixel data of shape {pixels.shape}")
+            hu = np.empty(pixels.shape, dtype=np.int16)
+            rescale_to_hu(pixels, entry["slope"], entry["intercept"], hu)
+            _write_file_atomic(pixels_file, hu.tobytes())
+        except Exception as e:
+            logging.warning(f"Pixel data of {file_path} not stored: {e}")
+    
+    # The entry is written last: a stored entry means its pixels (if any) are complete
+    entry = {"mtime": stat.st_mtime_ns, "size": stat.st_size, **entry}
+    _write_file_atomic(entry_file, json.dumps(entry, separators=(",", ":")).encode())
+    return entry
+
+
+def ingest_dicom_files(dir_in, names, max_workers=DICOM_READ_WORKERS):
+    """Ingest DICOM files of a directory into its slice store in parallel (see ingest_dicom_file)"""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for _ in executor.map(lambda name: ingest_dicom_file(dir_in, name), names):
+            pass
+
+
+def read_stored_slices_into(volume, dir_in, series):
+    """
+    Copy the slices of a series that are in the slice store of dir_in into a preallocated HU volume
+    
+    Args:
+        volume: Preallocated int16 array (Z, Y, X)
+        dir_in: DICOM directory
+        series: List of (file name, index entry) in z order (see select_ct_series)
+    
+    Returns:
+        Indices of the slices not in the store (to be decoded from their files)
+    """
+    missing = []
+    for i, (name, entry) in enumerate(series):
+        _, pixels_file = _slice_store_files(dir_in, name)
+        stored = _read_stored_entry(dir_in, name, entry.get("mtime"), entry.get("size"))
+        try:
+            if stored is None or os.path.getsize(pixels_file) != volume[i].nbytes:
+                raise OSError("not stored")
+            with open(pixels_file, 'rb') as f:
+                f.readinto(volume[i])
+        except OSError:
+            missing.append(i)
+    return missing
+
+
+def remove_slice_store(dir_in):
+    """Delete the slice store of a DICOM directory (e.g. once CT.mhd is written)"""
+    store_dir = os.path.join(dir_in, SLICE_STORE_DIR)
+    if os.path.isdir(store_dir):
+        shutil.rmtree(store_dir, ignore_errors=True)
+
+
+def dicom_series_to_mhd(dir_in, dir_out, series_uid=None, image_format=ARCHIVE_FORMAT):
     """
     Convert DICOM series to MHD format using pydicom and SimpleITK
     
-    Loads DICOM files, sorts by z-position, applies HU scaling, and creates MHD file.
+    Selects and sorts the slices by z-position from the series index of dir_in
+    (headers are parsed only for new files), then decodes the pixel data into a
+    preallocated volume, applies HU scaling, and creates MHD file. Slices ingested
+    on arrival (see ingest_dicom_file) are copied from the slice store instead.
     
     Args:
         dir_in: Input directory containing DICOM files
         dir_out: Output directory for CT.mhd
+        series_uid: SeriesInstanceUID to convert (optional, default: the largest CT series)
+        image_format: MetaImage variant of CT.mhd (see volumeio.IMAGE_FORMATS)
     """
-    import pydicom
-    
     logging.info(f"Converting DICOM series to MHD: {dir_in} -> {dir_out}")
     
     try:
-        # Load DICOM series (robust sorting)
-        slices = []
-        dir_in_path = Path(dir_in)
-        
-        for f in os.listdir(dir_in):
-            file_path = os.path.join(dir_in, f)
-            if os.path.isfile(file_path):
-                try:
-                    ds = pydicom.dcmread(file_path)
-                    if hasattr(ds, "ImagePositionPatient"):
-                        slices.append(ds)
-                except Exception as e:
-                    logging.debug(f"Skipping file {f}: {e}")
-                    continue
-        
-        if not slices:
-            raise Exception(f"No valid DICOM slices found in {dir_in}")
+        # Phase 1: headers only (series index), to filter, group and sort the slices
+        series = select_ct_series(index_dicom_directory(dir_in), series_uid)
         
-        logging.info(f"Found {len(slices)} DICOM slices")
+        if not series:
+            raise Exception(f"No valid DICOM slices found in {dir_in}")
         
-        # Sort by z position
-        slices.sort(key=lambda s: float(s.ImagePositionPatient[2]))
+        logging.info(f"Found {len(series)} DICOM slices")
+        file_paths = [os.path.join(dir_in, name) for name, _ in series]
+        slices = [entry for _, entry in series]
         logging.info(f"Sorted {len(slices)} slices by z-position")
         
-        # Build HU volume
-        volume = np.stack([s.pixel_array for s in slices]).astype(np.int16)
-        
-        # Apply rescale slope and intercept for HU values
-        slope = slices[0].RescaleSlope if hasattr(slices[0], 'RescaleSlope') else 1.0
-        intercept = slices[0].RescaleIntercept if hasattr(slices[0], 'RescaleIntercept') else 0.0
-        volume = volume * slope + intercept
-        volume = volume.astype(np.int16)
+        # Phase 2: copy the slices ingested on upload (already in HU) from the slice
+        # store, decode the others and apply the per-slice rescale slope and
+        # intercept for HU values directly into the volume
+        rescales = [(entry["slope"], entry["intercept"]) for entry in slices]
+        volume = np.empty((len(slices), slices[0]["rows"], slices[0]["columns"]), dtype=np.int16)
+        to_decode = read_stored_slices_into(volume, dir_in, series)
+        if len(to_decode) < len(slices):
+            logging.info(f"{len(slices) - len(to_decode)} slices copied from the slice store, {len(to_decode)} decoded")
+        read_dicom_pixels_into(volume, file_paths, rescales, indices=to_decode)
         
         logging.info(f"Volume shape: {volume.shape} (Z, Y, X)")
-        logging.info(f"HU scaling: slope={slope}, intercept={intercept}")
+        if len(set(rescales)) == 1:
+            logging.info(f"HU scaling: slope={rescales[0][0]}, intercept={rescales[0][1]}")
+        else:
+            logging.info(f"HU scaling: per-slice slope/intercept ({len(set(rescales))} distinct)")
         
         # Extract spacing, origin, direction
         # Spacing
         if len(slices) > 1:
-            dz = abs(
-                float(slices[1].ImagePositionPatient[2]) -
-                float(slices[0].ImagePositionPatient[2])
-            )
+            dz = abs(slices[1]["position"][2] - slices[0]["position"][2])
         else:
             # Single slice, use default spacing
             dz = 1.0
             logging.warning("Only one slice found, using default z-spacing=1.0")
         
-        if hasattr(slices[0], 'PixelSpacing') and slices[0].PixelSpacing:
-            dy, dx = map(float, slices[0].PixelSpacing)
+        if slices[0]["pixel_spacing"]:
+            dy, dx = slices[0]["pixel_spacing"]
         else:
             # Default pixel spacing if not available
             dx = dy = 1.0
@@ -98,12 +461,12 @@ def dicom_series_to_mhd(dir_in, dir_out):
         logging.info(f"Spacing: {spacing} (x, y, z)")
         
         # Origin
-        origin = list(map(float, slices[0].ImagePositionPatient))
+        origin = slices[0]["position"]
         logging.info(f"Origin: {origin}")
         
         # Direction (from ImageOrientationPatient)
-        if hasattr(slices[0], 'ImageOrientationPatient') and slices[0].ImageOrientationPatient:
-            iop = slices[0].ImageOrientationPatient
+        if slices[0]["orientation"]:
+            iop = slices[0]["orientation"]
             row = np.array(iop[:3])
             col = np.array(iop[3:])
             slice_dir = np.cross(row, col)
@@ -129,15 +492,11 @@ def dicom_series_to_mhd(dir_in, dir_out):
     
     # Write as MHD with compression
     output_file = os.path.join(dir_out, "CT.mhd")
-    logging.info(f"Writing CT.mhd to: {output_file} (with compression)")
+    logging.info(f"Writing CT.mhd to: {output_file} ({image_format})")
     
     try:
-        # Use ImageFileWriter with compression enabled
-        writer = sitk.ImageFileWriter()
-        writer.SetFileName(output_file)
-        writer.SetUseCompression(True)
-        writer.Execute(volume_itk)
-        logging.info(f"Successfully converted DICOM to {output_file} (compressed)")
+        write_image(volume_itk, output_file, image_format)
+        logging.info(f"Successfully converted DICOM to {output_file} ({image_format})")
         
         # Verify file was created
         if not os.path.exists(output_file):
@@ -149,34 +508,40 @@ def dicom_series_to_mhd(dir_in, dir_out):
 
 def sort_files_by_patient_study_series(dir_in, dir_out, delete_source_files):
     """
-    Sort DICOM files by patient, study, and series using pydicom
+    Sort DICOM files by patient, study, and series using the series index of dir_in
     
     Args:
         dir_in: Input directory
         dir_out: Output directory
         delete_source_files: Whether to delete source files
     """
-    import pydicom
     import shutil
     
     logging.info(f"Sorting DICOM files: {dir_in} -> {dir_out}")
     
     os.makedirs(dir_out, exist_ok=True)
+    index = index_dicom_directory(dir_in)
     
-    for dicom_file in Path(dir_in).glob("*.dcm"):
+    def copy_file(name):
+        dicom_file = Path(dir_in) / name
+        entry = index[name]
         try:
-            ds = pydicom.dcmread(str(dicom_file))
-            patient_id = getattr(ds, 'PatientID', 'Unknown')
-            study_uid = getattr(ds, 'StudyInstanceUID', 'Unknown')
-            series_uid = getattr(ds, 'SeriesInstanceUID', 'Unknown')
+            if not entry.get("dicom"):
+                raise Exception("not a DICOM file")
+            patient_id = entry["patient_id"] or 'Unknown'
+            study_uid = entry["study_uid"] or 'Unknown'
+            series_uid = entry["series_uid"] or 'Unknown'
             
             target_dir = os.path.join(dir_out, patient_id, study_uid, series_uid)
             os.makedirs(target_dir, exist_ok=True)
             
-            target_file = os.path.join(target_dir, dicom_file.name)
+            target_file = os.path.join(target_dir, name)
             shutil.copy2(dicom_file, target_file)
             
             if delete_source_files:
                 dicom_file.unlink()
         except Exception as e:
             logging.warning(f"Failed to process {dicom_file}: {e}")
+    
+    with ThreadPoolExecutor(max_workers=DICOM_READ_WORKERS) as executor:
+        list(executor.map(copy_file, [name for name in index if name.endswith(".dcm")]))
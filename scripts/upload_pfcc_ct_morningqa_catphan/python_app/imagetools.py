@@ -8,6 +8,7 @@ import re
 import logging
 import numpy as np
 import SimpleITK as sitk
+from volumeio import volume_array
 
 
 def calc_image_min_max_mean_std_3d_f(img_in, mask, out_txt):
@@ -34,26 +35,48 @@ def calc_image_min_max_mean_std_3d_f(img_in, mask, out_txt):
         mask_img_resampled = sitk.Resample(mask_img, image)
         mask_array = sitk.GetArrayFromImage(mask_img_resampled)
     
+    # Write output file
+    write_stats(out_txt, calc_masked_stats(image_array, mask_array))
+    
+    logging.info(f"Statistics saved to {out_txt}")
+
+
+def calc_masked_stats(image_array, mask_array):
+    """
+    Min, max, mean and std of an image array within a mask array
+    
+    Args:
+        image_array: numpy array (z, y, x), e.g. a memory-mapped CT
+        mask_array: numpy array with the same shape (pixels > 0.5 are inside)
+        
+    Returns:
+        Dictionary with min, max, mean and std (all 0.0 for an empty mask)
+    """
+    if image_array.shape != mask_array.shape:
+        raise Exception(f"Mask shape {mask_array.shape} does not match image shape {image_array.shape}")
+    
     # Apply mask
     masked_values = image_array[mask_array > 0.5]
     
     if len(masked_values) == 0:
         logging.warning("No pixels in mask!")
-        min_val = max_val = mean_val = std_val = 0.0
-    else:
-        min_val = float(np.min(masked_values))
-        max_val = float(np.max(masked_values))
-        mean_val = float(np.mean(masked_values))
-        std_val = float(np.std(masked_values))
-    
-    # Write output file
+        return {"min": 0.0, "max": 0.0, "mean": 0.0, "std": 0.0}
+    
+    return {
+        "min": float(np.min(masked_values)),
+        "max": float(np.max(masked_values)),
+        "mean": float(np.mean(masked_values)),
+        "std": float(np.std(masked_values)),
+    }
+
+
+def write_stats(out_txt, stats):
+    """Write min/max/mean/std in the .stat.txt format"""
     with open(out_txt, 'w') as f:
-        f.write(f"min={min_val}\n")
-        f.write(f"max={max_val}\n")
-        f.write(f"mean={mean_val}\n")
-        f.write(f"std={std_val}\n")
-    
-    logging.info(f"Statistics saved to {out_txt}")
+        f.write(f"min={stats['min']}\n")
+        f.write(f"max={stats['max']}\n")
+        f.write(f"mean={stats['mean']}\n")
+        f.write(f"std={stats['std']}\n")
 
 
 def calc_bounding_box_3d(img_in, out_txt):
@@ -69,12 +92,30 @@ def calc_bounding_box_3d(img_in, out_txt):
     image = sitk.ReadImage(img_in)
     image_array = sitk.GetArrayFromImage(image)
     
-    # Find non-zero region
-    non_zero_indices = np.nonzero(image_array)
+    bbox = _bounding_box(image_array)
+    
+    # Write output
+    with open(out_txt, 'w') as f:
+        f.write(f"bounding_box={bbox}\n")
+    
+    logging.info(f"Bounding box saved to {out_txt}")
+
+
+def _bounding_box(array):
+    """
+    Bounding box of the non-zero region of an array
+    
+    Args:
+        array: numpy array (z, y, x)
+        
+    Returns:
+        [x_min, y_min, z_min, x_max, y_max, z_max] as Python ints (max is exclusive)
+    """
+    non_zero_indices = np.nonzero(array)
     
     if len(non_zero_indices[0]) == 0:
         logging.warning("Image is empty!")
-        bbox = [0, 0, 0, image_array.shape[2], image_array.shape[1], image_array.shape[0]]
+        bbox = [0, 0, 0, array.shape[2], array.shape[1], array.shape[0]]
     else:
         z_min, z_max = np.min(non_zero_indices[0]), np.max(non_zero_indices[0])
         y_min, y_max = np.min(non_zero_indices[1]), np.max(non_zero_indices[1])
@@ -82,12 +123,33 @@ def calc_bounding_box_3d(img_in, out_txt):
         
         bbox = [x_min, y_min, z_min, x_max + 1, y_max + 1, z_max + 1]
     
-    # Write output (convert numpy types to native Python types)
-    bbox_python = [int(x) for x in bbox]
-    with open(out_txt, 'w') as f:
-        f.write(f"bounding_box={bbox_python}\n")
+    # Convert numpy types to native Python types
+    return [int(x) for x in bbox]
+
+
+def _clamp_bounding_box(bbox, size):
+    """
+    Clamp a bounding box to the image size
     
-    logging.info(f"Bounding box saved to {out_txt}")
+    Args:
+        bbox: [x_min, y_min, z_min, x_max, y_max, z_max]
+        size: Image size (x, y, z)
+        
+    Returns:
+        Tuple of (crop_index, crop_size), both in (x, y, z) order
+    """
+    x_min, y_min, z_min, x_max, y_max, z_max = [int(x) for x in bbox]
+    
+    x_min = max(0, min(int(x_min), size[0] - 1))
+    y_min = max(0, min(int(y_min), size[1] - 1))
+    z_min = max(0, min(int(z_min), size[2] - 1))
+    x_max = max(x_min + 1, min(int(x_max), size[0]))
+    y_max = max(y_min + 1, min(int(y_max), size[1]))
+    z_max = max(z_min + 1, min(int(z_max), size[2]))
+    
+    crop_index = [x_min, y_min, z_min]
+    crop_size = [x_max - x_min, y_max - y_min, z_max - z_min]
+    return crop_index, crop_size
 
 
 def crop_3d_boundingbox_f(img_in, boundingbox_txt, img_out):
@@ -125,25 +187,11 @@ def crop_3d_boundingbox_f(img_in, boundingbox_txt, img_out):
     if bbox is None or len(bbox) != 6:
         raise Exception(f"Could not parse bounding box file. Expected 6 values, got: {bbox}")
     
-    x_min, y_min, z_min, x_max, y_max, z_max = [int(x) for x in bbox]
-    
     # Read image
     image = sitk.ReadImage(img_in)
     
-    # Get image size
-    size = image.GetSize()
-    
     # Clamp bounding box to image size
-    x_min = max(0, min(int(x_min), size[0] - 1))
-    y_min = max(0, min(int(y_min), size[1] - 1))
-    z_min = max(0, min(int(z_min), size[2] - 1))
-    x_max = max(x_min + 1, min(int(x_max), size[0]))
-    y_max = max(y_min + 1, min(int(y_max), size[1]))
-    z_max = max(z_min + 1, min(int(z_max), size[2]))
-    
-    # Calculate crop size
-    crop_size = [x_max - x_min, y_max - y_min, z_max - z_min]
-    crop_index = [x_min, y_min, z_min]
+    crop_index, crop_size = _clamp_bounding_box(bbox, image.GetSize())
     
     # Use ExtractImageFilter for cropping (more reliable than array slicing)
     extract_filter = sitk.ExtractImageFilter()
@@ -229,40 +277,128 @@ def calc_image_moments_3d_f(img_in, out_txt):
     image = sitk.ReadImage(img_in)
     image_array = sitk.GetArrayFromImage(image)
     
-    # Get image spacing and origin
-    spacing = image.GetSpacing()
-    origin = image.GetOrigin()
+    cog, total_mass = _center_of_gravity(image_array, image.GetOrigin(), image.GetSpacing())
+    
+    _write_moments(out_txt, cog, total_mass)
+    
+    logging.info(f"Moments saved to {out_txt}")
+
+
+def _center_of_gravity(array, origin, spacing):
+    """
+    Center of gravity of an array in physical coordinates
     
-    # Calculate moments
+    Args:
+        array: numpy array (z, y, x) used as mass
+        origin: Physical origin of array[0, 0, 0] (x, y, z)
+        spacing: Pixel spacing (x, y, z)
+        
+    Returns:
+        Tuple of ([x, y, z] center of gravity, total mass)
+    """
     # For 3D: indices are (z, y, x)
-    total_mass = np.sum(image_array)
+    total_mass = np.sum(array)
     
     if total_mass == 0:
         logging.warning("Image has zero mass!")
-        cog = [0.0, 0.0, 0.0]
-    else:
-        # Calculate center of gravity in pixel coordinates
-        z_coords, y_coords, x_coords = np.meshgrid(
-            np.arange(image_array.shape[0]),
-            np.arange(image_array.shape[1]),
-            np.arange(image_array.shape[2]),
-            indexing='ij'
-        )
-        
-        cog_z = np.sum(z_coords * image_array) / total_mass
-        cog_y = np.sum(y_coords * image_array) / total_mass
-        cog_x = np.sum(x_coords * image_array) / total_mass
-        
-        # Convert to physical coordinates
-        cog = [
-            origin[0] + cog_x * spacing[0],
-            origin[1] + cog_y * spacing[1],
-            origin[2] + cog_z * spacing[2]
-        ]
-    
-    # Write output
+        return [0.0, 0.0, 0.0], total_mass
+    
+    # Calculate center of gravity in pixel coordinates
+    z_coords, y_coords, x_coords = np.meshgrid(
+        np.arange(array.shape[0]),
+        np.arange(array.shape[1]),
+        np.arange(array.shape[2]),
+        indexing='ij'
+    )
+    
+    cog_z = np.sum(z_coords * array) / total_mass
+    cog_y = np.sum(y_coords * array) / total_mass
+    cog_x = np.sum(x_coords * array) / total_mass
+    
+    # Convert to physical coordinates
+    cog = [
+        origin[0] + cog_x * spacing[0],
+        origin[1] + cog_y * spacing[1],
+        origin[2] + cog_z * spacing[2]
+    ]
+    return cog, total_mass
+
+
+def _write_moments(out_txt, cog, total_mass):
+    """Write center of gravity and total mass in the .mnt.txt format"""
     with open(out_txt, 'w') as f:
         f.write(f"Center of gravity=[{cog[0]}, {cog[1]}, {cog[2]}]\n")
         f.write(f"Total mass={total_mass}\n")
+
+
+def calc_centers_of_gravity_3d(image, label_array, labels, level0, th, level1, audit_files=None, details=None):
+    """
+    Calculate the center of gravity of thresholded CT inside each labelled ROI
     
-    logging.info(f"Moments saved to {out_txt}")
+    In-memory equivalent of calc_bounding_box_3d -> crop_3d_boundingbox_f ->
+    threshold_3d_f -> calc_image_moments_3d_f, applied to all ROIs of a key in
+    one call. The CT pixel data is fetched once and every ROI is cropped as a
+    view of that array, so no intermediate files are written or re-read.
+    
+    Args:
+        image: SimpleITK image or volumeio.MappedVolume (case CT)
+        label_array: Label map as numpy array (z, y, x) with the same shape as image
+        labels: Label values, one per ROI
+        level0: Value for pixels below threshold
+        th: Threshold value
+        level1: Value for pixels at or above threshold
+        audit_files: Optional list of (roi_txt, crop_img) paths, one per label.
+            When given, the .roi.txt, .crop.mha, .th.mha and .mnt.txt files of the
+            file-based pipeline are also written for inspection.
+        details: Optional list, one dictionary per label (bounding_box, center_of_gravity,
+            total_mass) is appended to it
+        
+    Returns:
+        List of [x, y, z] centers of gravity in physical coordinates, one per label
+    """
+    logging.info(f"Calculating centers of gravity for {len(labels)} ROIs")
+    
+    image_array = volume_array(image)
+    if image_array.shape != label_array.shape:
+        raise Exception(f"Label map shape {label_array.shape} does not match image shape {image_array.shape}")
+    
+    spacing = image.GetSpacing()
+    size = image.GetSize()
+    
+    cogs = []
+    for n, label in enumerate(labels):
+        # Get ROI from the label map
+        bbox = _bounding_box(label_array == label)
+        (x0, y0, z0), (sx, sy, sz) = _clamp_bounding_box(bbox, size)
+        
+        # Crop around the hole (origin follows ExtractImageFilter)
+        crop = image_array[z0:z0 + sz, y0:y0 + sy, x0:x0 + sx]
+        crop_origin = image.TransformIndexToPhysicalPoint([x0, y0, z0])
+        
+        # Threshold
+        thresholded = np.where(crop < th, level0, level1)
+        
+        # Measure the moment
+        cog, total_mass = _center_of_gravity(thresholded, crop_origin, spacing)
+        cogs.append(cog)
+        if details is not None:
+            details.append({
+                "bounding_box": list(bbox),
+                "center_of_gravity": [float(v) for v in cog],
+                "total_mass": float(total_mass),
+            })
+        
+        if audit_files:
+            roi_txt, crop_img = audit_files[n]
+            with open(roi_txt, 'w') as f:
+                f.write(f"bounding_box={bbox}\n")
+            for array, out_img in ((crop, crop_img), (thresholded, crop_img + ".th.mha")):
+                out = sitk.GetImageFromArray(array)
+                out.SetOrigin(crop_origin)
+                out.SetSpacing(spacing)
+                out.SetDirection(image.GetDirection())
+                sitk.WriteImage(out, out_img)
+            _write_moments(crop_img + ".th.mha.mnt.txt", cog, total_mass)
+            logging.info(f"Audit files saved for label {label}: {roi_txt}, {crop_img}")
+    
+    return cogs
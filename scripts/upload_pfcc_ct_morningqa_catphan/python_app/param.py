@@ -4,23 +4,52 @@ Parameter file reader - reads key=value configuration files
 """
 
 import os
+import logging
+import threading
+
+
+def _parse_bool(value):
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+def _parse_array(value):
+    return [float(v.strip()) for v in value.split(',') if v.strip()]
+
+
+# Value types of the typed getters and the schemas (type -> parser of the raw string)
+PARSERS = {
+    int: int,
+    float: float,
+    bool: _parse_bool,
+    str: str,
+    list: _parse_array,
+}
 
 
 class Param:
     """Simple parameter file reader"""
     
-    def __init__(self, param_file):
+    def __init__(self, param_file, schema=None):
         """
         Initialize parameter reader
         
         Args:
             param_file: Path to parameter file (key=value format)
+            schema: Dictionary key -> value type (int, float, bool, str or list of floats),
+                the values present in the file are validated and parsed once (optional)
         """
         self._file = param_file
         self._params = {}
+        self._typed = {}
+        self.signature = None
         
         if param_file and os.path.exists(param_file):
+            stat = os.stat(param_file)
+            self.signature = (stat.st_mtime_ns, stat.st_size)
             self._load_params()
+        
+        if schema:
+            self.validate(schema)
     
     def _load_params(self):
         """Load parameters from file"""
@@ -63,3 +92,96 @@ class Param:
         if not value:
             return []
         return [v.strip() for v in value.split(',') if v.strip()]
+    
+    def get_typed(self, key, value_type, default=None):
+        """
+        Get parameter value parsed as value_type (parsed once, then cached)
+        
+        Args:
+            key: Parameter key (case-insensitive)
+            value_type: int, float, bool, str or list (comma-separated floats)
+            default: Value if the parameter is missing or empty (an Exception is raised if None)
+        
+        Returns:
+            Parsed value (a list is a copy, so callers can modify it without changing the cache)
+        """
+        cache_key = (key.lower(), value_type)
+        if cache_key not in self._typed:
+            value = self.get_value(key)
+            if value == "":
+                if default is None:
+                    raise Exception(f"Parameter not found: {key} ({self._file})")
+                return default
+            try:
+                self._typed[cache_key] = PARSERS[value_type](value)
+            except ValueError:
+                raise Exception(f"Invalid {value_type.__name__} value of {key} ({self._file}): {value}")
+        
+        parsed = self._typed[cache_key]
+        return list(parsed) if isinstance(parsed, list) else parsed
+    
+    def get_int(self, key, default=None):
+        """Get parameter value as int (see get_typed)"""
+        return self.get_typed(key, int, default)
+    
+    def get_float(self, key, default=None):
+        """Get parameter value as float (see get_typed)"""
+        return self.get_typed(key, float, default)
+    
+    def get_bool(self, key, default=None):
+        """Get parameter value as bool (1/true/yes/on, see get_typed)"""
+        return self.get_typed(key, bool, default)
+    
+    def validate(self, schema):
+        """
+        Validate and parse the values of the schema keys present in the file
+        
+        Args:
+            schema: Dictionary key -> value type (see get_typed)
+        """
+        errors = []
+        for key, value_type in schema.items():
+            if self.get_value(key) == "":
+                continue
+            try:
+                self.get_typed(key, value_type)
+            except Exception as e:
+                errors.append(str(e))
+        if errors:
+            raise Exception("Invalid parameters:\n" + "\n".join(errors))
+
+
+# Parameter files of the process, keyed by path and reloaded when the file changes
+_params = {}
+_params_lock = threading.Lock()
+
+
+def load_param(param_file, schema=None):
+    """
+    Parameter file loaded and validated once per process (see Param), shared by all callers
+    until the file's modification time or size changes, so the jobs of a device do not
+    re-read and re-parse its param.txt. The returned Param must not be modified.
+    
+    Args:
+        param_file: Path to parameter file (key=value format)
+        schema: Dictionary key -> value type (optional, see Param)
+    
+    Returns:
+        Param (empty if the file does not exist)
+    """
+    if not param_file or not os.path.exists(param_file):
+        return Param(param_file, schema)
+    
+    stat = os.stat(param_file)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cache_key = (os.path.abspath(param_file), tuple(sorted((k.lower(), t.__name__) for k, t in (schema or {}).items())))
+    with _params_lock:
+        param = _params.get(cache_key)
+        if param is not None and param.signature == signature:
+            return param
+    
+    param = Param(param_file, schema)
+    logging.info(f"Parameters loaded: {param_file}")
+    with _params_lock:
+        _params[cache_key] = param
+    return param
@@ -5,151 +5,235 @@ Image registration using SimpleITK rigid body registration
 
 import os
 import csv
+import json
+import hashlib
+import time
 import logging
+import threading
 import numpy as np
 import SimpleITK as sitk
-from param import Param
+from param import load_param
+from volumeio import write_mhd_compressed
+from timing import read_process_io
 
 
-def write_mhd_compressed(image, output_file):
+# Registration metadata written next to the transform (cache key, final metric, ...)
+REGISTRATION_INFO_FILE = "registration.json"
+
+# Review images of the registered moving image (see write_registration_review_images)
+REVIEW_IMAGE_FILES = ["result.mhd", "result.zraw", "resampled.mha"]
+
+# Image hashes of the process, keyed by (path, mtime, size), so the unchanged baseline
+# images are not re-read for every registration cache key
+_image_hashes = {}
+_image_hashes_lock = threading.Lock()
+
+
+def read_registration_params(param=None):
     """
-    Write image as MHD file with compression enabled
+    Read the registration parameters from a param file
     
     Args:
-        image: SimpleITK image to write
-        output_file: Output file path (.mhd)
+        param: Param object, path to param.txt, or None for the defaults
+        
+    Returns:
+        Dictionary of registration parameters
     """
-    writer = sitk.ImageFileWriter()
-    writer.SetFileName(output_file)
-    writer.SetUseCompression(True)
-    writer.Execute(image)
+    params = {
+        "learningRate": 1.0,
+        "numberOfIterations": 200,
+        "convergenceMinimumValue": 1e-6,
+        "convergenceWindowSize": 10,
+        "warmStart": False,
+        "warmStartMetricTolerance": 0.2,
+        "samplingStrategy": "none",
+        "samplingPercentage": [],
+        "samplingSeed": 1,
+        "bodyMaskThreshold": None,
+        "bodyMaskMargin": 10.0,
+    }
+    if param is None:
+        return params
+    
+    # Load param if it's a file path (cached per process, see param.load_param)
+    param_obj = load_param(param) if isinstance(param, str) else param
+    
+    # Read parameters with defaults (parsed once per Param, see Param.get_typed)
+    for key, default in list(params.items()):
+        if not param_obj.get_value(f"registration_{key}"):
+            continue
+        value = param_obj.get_typed(f"registration_{key}", float if default is None else type(default))
+        params[key] = value.lower() if isinstance(value, str) else value
+    
+    return params
 
 
-def rigid_body_registration(fixed_image, fixed_mask, moving_image, moving_mask, out_dir, param_files=None, param=None):
+def hash_image(image_file):
     """
-    Perform rigid body registration using SimpleITK
+    SHA-256 over the pixel data and geometry of an image
     
-    Registers the moving image (baseline CT) to the fixed image (case CT) using
-    a rigid body transform (translation + rotation).
+    Independent of the file format, so re-writing an image compressed or
+    uncompressed (see volumeio) keeps its hash.
+    
+    Args:
+        image_file: Image path (missing or empty paths hash to a fixed value)
+        
+    Returns:
+        Hex digest
+    """
+    sha = hashlib.sha256()
+    if not image_file or not os.path.exists(image_file):
+        sha.update(b"<none>")
+        return sha.hexdigest()
+    
+    stat = os.stat(image_file)
+    memo_key = (os.path.abspath(image_file), stat.st_mtime_ns, stat.st_size)
+    with _image_hashes_lock:
+        if memo_key in _image_hashes:
+            return _image_hashes[memo_key]
+    
+    image = sitk.ReadImage(image_file)
+    sha.update(image.GetPixelIDTypeAsString().encode())
+    sha.update(repr((image.GetSize(), image.GetSpacing(), image.GetOrigin(), image.GetDirection())).encode())
+    sha.update(sitk.GetArrayViewFromImage(image).tobytes())
+    digest = sha.hexdigest()
+    # The data file of a MetaImage header can change on its own, only memoize single-file formats
+    if not image_file.lower().endswith(".mhd"):
+        with _image_hashes_lock:
+            _image_hashes[memo_key] = digest
+    return digest
+
+
+def registration_cache_key(fixed_image, fixed_mask, moving_image, moving_mask, params):
+    """
+    Cache key of a registration: hashes of the case CT, the baseline CT/mask images and the parameters
     
     Args:
         fixed_image: Path to fixed image (case CT)
+        fixed_mask: Path to fixed mask (or empty string)
         moving_image: Path to moving image (baseline CT)
-        fixed_mask: Path to fixed mask (optional, empty string if not used)
-        moving_mask: Path to moving mask (optional, empty string if not used)
-        out_dir: Output directory for registration results
-        param_files: List of parameter file paths (kept for compatibility, not used)
-        param: Param object or path to param.txt file (optional, for reading registration parameters)
+        moving_mask: Path to moving mask (or empty string)
+        params: Registration parameters (dictionary)
         
     Returns:
-        Path to transform file (saved as TransformParameters.0.txt for compatibility)
+        Hex digest
     """
-    logging.info(f"Running SimpleITK rigid body registration...")
-    logging.info(f"Fixed: {fixed_image}")
-    logging.info(f"Moving: {moving_image}")
-    logging.info(f"Output: {out_dir}")
-    
-    os.makedirs(out_dir, exist_ok=True)
-    
-    # Read images
-    fixed = sitk.ReadImage(fixed_image)
-    moving = sitk.ReadImage(moving_image)
-    
-    # Convert images to float type if needed (SimpleITK registration requires float)
-    fixed_pixel_type = fixed.GetPixelID()
-    moving_pixel_type = moving.GetPixelID()
-    
-    # Check if conversion is needed (registration works best with float32)
-    if fixed_pixel_type != sitk.sitkFloat32:
-        logging.info(f"Converting fixed image from {sitk.GetPixelIDValueAsString(fixed_pixel_type)} to Float32")
-        fixed = sitk.Cast(fixed, sitk.sitkFloat32)
+    sha = hashlib.sha256()
+    for file in (fixed_image, fixed_mask, moving_image, moving_mask):
+        sha.update(hash_image(file).encode())
+    sha.update(json.dumps(params, sort_keys=True).encode())
+    return sha.hexdigest()
+
+
+def read_registration_info(out_dir):
+    """Read registration.json from a registration output directory (empty dict if missing)"""
+    info_file = os.path.join(out_dir, REGISTRATION_INFO_FILE)
+    if not os.path.exists(info_file):
+        return {}
+    try:
+        with open(info_file, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Could not read {info_file}: {e}")
+        return {}
+
+
+def write_registration_info(out_dir, info):
+    """Write registration.json to a registration output directory"""
+    info_file = os.path.join(out_dir, REGISTRATION_INFO_FILE)
+    with open(info_file, 'w') as f:
+        json.dump(info, f, indent=2)
+
+
+def _values_per_level(values, num_of_levels):
+    """Per-level values for a pyramid; lists written for more levels keep their finest entries"""
+    if len(values) >= num_of_levels:
+        return values[-num_of_levels:]
+    return [values[0]] * (num_of_levels - len(values)) + values
+
+
+def create_body_mask(image, threshold, margin):
+    """
+    Phantom body mask by thresholding a CT image
     
-    if moving_pixel_type != sitk.sitkFloat32:
-        logging.info(f"Converting moving image from {sitk.GetPixelIDValueAsString(moving_pixel_type)} to Float32")
-        moving = sitk.Cast(moving, sitk.sitkFloat32)
+    Keeps the largest connected component above the threshold (the phantom, not
+    the couch) and dilates it by the margin.
     
-    # Read masks if provided
-    fixed_mask_img = None
-    moving_mask_img = None
-    if fixed_mask and fixed_mask.strip() and os.path.exists(fixed_mask):
-        fixed_mask_img = sitk.ReadImage(fixed_mask)
-        # Ensure mask is same size/spacing as fixed image
-        if fixed_mask_img.GetSpacing() != fixed.GetSpacing() or \
-           fixed_mask_img.GetOrigin() != fixed.GetOrigin() or \
-           fixed_mask_img.GetSize() != fixed.GetSize():
-            fixed_mask_img = sitk.Resample(fixed_mask_img, fixed, sitk.Transform(), 
-                                          sitk.sitkNearestNeighbor, 0.0, fixed_mask_img.GetPixelID())
-        logging.info(f"Using fixed mask: {fixed_mask}")
-    if moving_mask and moving_mask.strip() and os.path.exists(moving_mask):
-        moving_mask_img = sitk.ReadImage(moving_mask)
-        # Ensure mask is same size/spacing as moving image
-        if moving_mask_img.GetSpacing() != moving.GetSpacing() or \
-           moving_mask_img.GetOrigin() != moving.GetOrigin() or \
-           moving_mask_img.GetSize() != moving.GetSize():
-            moving_mask_img = sitk.Resample(moving_mask_img, moving, sitk.Transform(),
-                                          sitk.sitkNearestNeighbor, 0.0, moving_mask_img.GetPixelID())
-        logging.info(f"Using moving mask: {moving_mask}")
+    Args:
+        image: CT image (SimpleITK)
+        threshold: Lower HU threshold of the phantom body
+        margin: Dilation margin in mm
+        
+    Returns:
+        UInt8 mask image (1 = body)
+    """
+    body = sitk.BinaryThreshold(image, lowerThreshold=threshold, upperThreshold=1e10, insideValue=1, outsideValue=0)
+    body = sitk.RelabelComponent(sitk.ConnectedComponent(body), sortByObjectSize=True) == 1
+    radius = [max(1, int(round(margin / sp))) for sp in image.GetSpacing()]
+    body = sitk.BinaryDilate(body, radius)
+    return sitk.Cast(body, sitk.sitkUInt8)
+
+
+def _execute_registration(fixed, moving, fixed_mask_img, moving_mask_img, reg_params, initial_transform,
+                          shrink_factors, smoothing_sigmas, body_mask=None, timer=None, stage_name="registration"):
+    """
+    Run the Mattes MI / gradient descent optimization from an initial transform
     
+    Args:
+        fixed: Fixed image (Float32)
+        moving: Moving image (Float32)
+        fixed_mask_img: Fixed mask image or None
+        moving_mask_img: Moving mask image or None
+        reg_params: Registration parameters (see read_registration_params)
+        initial_transform: Euler3DTransform to start from
+        shrink_factors: Shrink factor per pyramid level
+        smoothing_sigmas: Smoothing sigma per pyramid level (physical units)
+        body_mask: Body mask in moving image space (optional), mapped into the fixed image
+            with the initial transform to restrict the metric samples if no fixed mask is given
+        timer: StageTimer to record each pyramid level in as "{stage_name}.level{n}" (optional)
+        stage_name: Stage name prefix of the levels
+        
+    Returns:
+        (final_transform, final_metric_value, iteration_data)
+    """
     # Initialize registration
     registration_method = sitk.ImageRegistrationMethod()
     
     # Set similarity metric (Mutual Information works well for CT images)
     registration_method.SetMetricAsMattesMutualInformation(numberOfHistogramBins=50)
     
+    # Metric sampling (all voxels unless random/regular sampling is configured)
+    strategy = reg_params["samplingStrategy"]
+    if strategy in ("random", "regular") and reg_params["samplingPercentage"]:
+        percentages = _values_per_level(reg_params["samplingPercentage"], len(shrink_factors))
+        registration_method.SetMetricSamplingStrategy(
+            registration_method.RANDOM if strategy == "random" else registration_method.REGULAR)
+        registration_method.SetMetricSamplingPercentagePerLevel(percentages, int(reg_params["samplingSeed"]))
+        logging.info(f"Metric sampling: {strategy} {percentages}")
+    elif strategy != "none":
+        logging.warning(f"Ignoring registration sampling strategy '{strategy}' (needs random or regular "
+                        f"and registration_samplingPercentage)")
+    
     # Set interpolator
     registration_method.SetInterpolator(sitk.sitkLinear)
     
-    # Read registration parameters from param file if provided
-    if param is None:
-        # Use default values
-        learningRate = 1.0
-        numberOfIterations = 200
-        convergenceMinimumValue = 1e-6
-        convergenceWindowSize = 10
-    else:
-        # Load param if it's a file path
-        if isinstance(param, str):
-            param_obj = Param(param)
-        else:
-            param_obj = param
-        
-        # Read parameters with defaults (get_value returns empty string if not found)
-        learningRate_str = param_obj.get_value("registration_learningRate")
-        learningRate = float(learningRate_str) if learningRate_str else 1.0
-        
-        numberOfIterations_str = param_obj.get_value("registration_numberOfIterations")
-        numberOfIterations = int(numberOfIterations_str) if numberOfIterations_str else 200
-        
-        convergenceMinimumValue_str = param_obj.get_value("registration_convergenceMinimumValue")
-        convergenceMinimumValue = float(convergenceMinimumValue_str) if convergenceMinimumValue_str else 1e-6
-        
-        convergenceWindowSize_str = param_obj.get_value("registration_convergenceWindowSize")
-        convergenceWindowSize = int(convergenceWindowSize_str) if convergenceWindowSize_str else 10
-        
-        logging.info(f"Registration parameters from param file: learningRate={learningRate}, "
-                    f"numberOfIterations={numberOfIterations}, convergenceMinimumValue={convergenceMinimumValue}, "
-                    f"convergenceWindowSize={convergenceWindowSize}")
-    
     # Set optimizer (gradient descent)
     registration_method.SetOptimizerAsGradientDescent(
-        learningRate=learningRate,
-        numberOfIterations=numberOfIterations,
-        convergenceMinimumValue=convergenceMinimumValue,
-        convergenceWindowSize=convergenceWindowSize
+        learningRate=reg_params["learningRate"],
+        numberOfIterations=reg_params["numberOfIterations"],
+        convergenceMinimumValue=reg_params["convergenceMinimumValue"],
+        convergenceWindowSize=reg_params["convergenceWindowSize"]
     )
     registration_method.SetOptimizerScalesFromPhysicalShift()
     
-    # Set initial transform (rigid body - translation + rotation)
-    initial_transform = sitk.CenteredTransformInitializer(
-        fixed,
-        moving,
-        sitk.Euler3DTransform(),
-        sitk.CenteredTransformInitializerFilter.GEOMETRY
-    )
     registration_method.SetInitialTransform(initial_transform, inPlace=False)
     
     # Set masks if provided (SimpleITK supports masks!)
-    # Note: Masks are already resampled above if needed
+    # Note: Masks are already resampled if needed
+    if fixed_mask_img is None and body_mask is not None:
+        fixed_mask_img = sitk.Resample(body_mask, fixed, initial_transform, sitk.sitkNearestNeighbor, 0,
+                                       sitk.sitkUInt8)
+        logging.info("Body mask mapped into the fixed image with the initial transform")
     if fixed_mask_img is not None:
         registration_method.SetMetricFixedMask(fixed_mask_img)
         logging.info("Fixed mask applied to registration")
@@ -159,7 +243,6 @@ def rigid_body_registration(fixed_image, fixed_mask, moving_image, moving_mask,
         logging.info("Moving mask applied to registration")
     
     # Setup optimization tracking
-    optimization_csv = os.path.join(out_dir, "optimization.csv")
     iteration_data = []
     iteration_count = [0]  # Use list to allow modification in nested function
     
@@ -182,19 +265,236 @@ def rigid_body_registration(fixed_image, fixed_mask, moving_image, moving_mask,
     # Add command observer to track iterations
     registration_method.AddCommand(sitk.sitkIterationEvent, iteration_callback)
     
+    # Time each pyramid level (a level ends when the next one starts or the optimization ends)
+    level = {"index": -1, "start": None, "io_start": None, "first_iteration": 0}
+    
+    def end_level():
+        if timer is None or level["index"] < 0:
+            return
+        timer.add(f"{stage_name}.level{level['index']}", time.perf_counter() - level["start"], level["io_start"],
+                  shrink_factor=shrink_factors[level["index"]], smoothing_sigma=smoothing_sigmas[level["index"]],
+                  iterations=iteration_count[0] - level["first_iteration"])
+    
+    def level_callback():
+        end_level()
+        level.update(index=level["index"] + 1, start=time.perf_counter(), io_start=read_process_io(),
+                     first_iteration=iteration_count[0])
+    
+    registration_method.AddCommand(sitk.sitkMultiResolutionIterationEvent, level_callback)
+    
     # Set multi-resolution approach for faster registration
-    # Start at 1/4 resolution, then 1/2, then full resolution
-    registration_method.SetShrinkFactorsPerLevel(shrinkFactors=[4, 2, 1])
-    registration_method.SetSmoothingSigmasPerLevel(smoothingSigmas=[2, 1, 0])
+    registration_method.SetShrinkFactorsPerLevel(shrinkFactors=shrink_factors)
+    registration_method.SetSmoothingSigmasPerLevel(smoothingSigmas=smoothing_sigmas)
     registration_method.SmoothingSigmasAreSpecifiedInPhysicalUnitsOn()
-    logging.info("Multi-resolution registration enabled: [4x, 2x, 1x] shrink factors")
+    logging.info(f"Multi-resolution registration enabled: {shrink_factors} shrink factors")
     
     # Execute registration
     logging.info("Starting registration optimization...")
     print("Starting registration optimization...", flush=True)
     final_transform = registration_method.Execute(fixed, moving)
+    end_level()
+    
+    return final_transform, registration_method.GetMetricValue(), iteration_data
+
+
+def read_warm_start_transform(reg_dir):
+    """
+    Read the rigid transform of a previous registration to seed the optimizer
+    
+    Args:
+        reg_dir: Registration output directory of a previous case (1.reg)
+        
+    Returns:
+        Euler3DTransform, or None if the transform cannot be read
+    """
+    transform_file = os.path.join(reg_dir, "TransformParameters.0.tfm")
+    if not os.path.exists(transform_file):
+        return None
+    try:
+        transform = sitk.ReadTransform(transform_file)
+        # Unwrap CompositeTransform
+        if hasattr(transform, 'GetNumberOfTransforms') and transform.GetNumberOfTransforms() > 0:
+            transform = transform.GetNthTransform(0)
+        seed_transform = sitk.Euler3DTransform()
+        seed_transform.SetFixedParameters(transform.GetFixedParameters())
+        seed_transform.SetParameters(transform.GetParameters())
+        return seed_transform
+    except Exception as e:
+        logging.warning(f"Could not read warm-start transform {transform_file}: {e}")
+        return None
+
+
+def is_warm_start_metric_acceptable(metric_value, reference_metric_value, tolerance):
+    """
+    Check a warm-start result against the final metric of the seed case
+    
+    The Mattes MI metric is negative (lower is better); the warm start is accepted
+    if it is at most `tolerance` (relative) worse than the seed case.
+    
+    Args:
+        metric_value: Final metric of the warm-start registration
+        reference_metric_value: Final metric of the seed case (None if unknown)
+        tolerance: Relative tolerance (e.g. 0.2 for 20%)
+        
+    Returns:
+        True if the warm-start transform can be used (False if the seed metric is unknown,
+        so an unchecked result is never used)
+    """
+    if reference_metric_value is None:
+        return False
+    return metric_value <= reference_metric_value + abs(reference_metric_value) * tolerance
+
+
+def rigid_body_registration(fixed_image, fixed_mask, moving_image, moving_mask, out_dir, param_files=None, param=None,
+                            force=False, warm_start_dir=None, moving_image_data=None, moving_mask_data=None,
+                            timer=None):
+    """
+    Perform rigid body registration using SimpleITK
+    
+    Registers the moving image (baseline CT) to the fixed image (case CT) using
+    a rigid body transform (translation + rotation).
+    
+    Args:
+        fixed_image: Path to fixed image (case CT)
+        moving_image: Path to moving image (baseline CT)
+        fixed_mask: Path to fixed mask (optional, empty string if not used)
+        moving_mask: Path to moving mask (optional, empty string if not used)
+        out_dir: Output directory for registration results
+        param_files: List of parameter file paths (kept for compatibility, not used)
+        param: Param object or path to param.txt file (optional, for reading registration parameters)
+        force: Re-run the optimization even if out_dir holds a transform for the same inputs
+        warm_start_dir: Registration directory (1.reg) of a previous case of the same device
+            to seed the optimizer from (optional, cold start if None)
+        moving_image_data: Moving image already loaded from moving_image (SimpleITK image, e.g. from
+            the baseline cache); read from the path if None
+        moving_mask_data: Moving mask already loaded from moving_mask (optional, as moving_image_data)
+        timer: StageTimer to record the pyramid levels in (optional, see timing.py)
+        
+    Returns:
+        Path to transform file (saved as TransformParameters.0.txt for compatibility)
+    """
+    logging.info(f"Running SimpleITK rigid body registration...")
+    logging.info(f"Fixed: {fixed_image}")
+    logging.info(f"Moving: {moving_image}")
+    logging.info(f"Output: {out_dir}")
+    
+    os.makedirs(out_dir, exist_ok=True)
+    
+    transform_params_file = os.path.join(out_dir, "TransformParameters.0.txt")
+    
+    # Reuse the transform if the images, masks and parameters are unchanged
+    reg_params = read_registration_params(param)
+    cache_key = registration_cache_key(fixed_image, fixed_mask, moving_image, moving_mask, reg_params)
+    cached_info = read_registration_info(out_dir)
+    if not force and cached_info.get("cache_key") == cache_key and \
+            os.path.exists(transform_params_file.replace('.txt', '.tfm')):
+        logging.info(f"Registration cache hit ({cache_key[:12]}), reusing {transform_params_file.replace('.txt', '.tfm')}")
+        return transform_params_file
+    if force:
+        logging.info("Registration forced, ignoring cached transform")
+    
+    # Read images
+    fixed = sitk.ReadImage(fixed_image)
+    moving = moving_image_data if moving_image_data is not None else sitk.ReadImage(moving_image)
+    
+    # Convert images to float type if needed (SimpleITK registration requires float)
+    fixed_pixel_type = fixed.GetPixelID()
+    moving_pixel_type = moving.GetPixelID()
+    
+    # Check if conversion is needed (registration works best with float32)
+    if fixed_pixel_type != sitk.sitkFloat32:
+        logging.info(f"Converting fixed image from {sitk.GetPixelIDValueAsString(fixed_pixel_type)} to Float32")
+        fixed = sitk.Cast(fixed, sitk.sitkFloat32)
+    
+    if moving_pixel_type != sitk.sitkFloat32:
+        logging.info(f"Converting moving image from {sitk.GetPixelIDValueAsString(moving_pixel_type)} to Float32")
+        moving = sitk.Cast(moving, sitk.sitkFloat32)
+    
+    # Read masks if provided
+    fixed_mask_img = None
+    moving_mask_img = None
+    if fixed_mask and fixed_mask.strip() and os.path.exists(fixed_mask):
+        fixed_mask_img = sitk.ReadImage(fixed_mask)
+        # Ensure mask is same size/spacing as fixed image
+        if fixed_mask_img.GetSpacing() != fixed.GetSpacing() or \
+           fixed_mask_img.GetOrigin() != fixed.GetOrigin() or \
+           fixed_mask_img.GetSize() != fixed.GetSize():
+            fixed_mask_img = sitk.Resample(fixed_mask_img, fixed, sitk.Transform(), 
+                                          sitk.sitkNearestNeighbor, 0.0, fixed_mask_img.GetPixelID())
+        logging.info(f"Using fixed mask: {fixed_mask}")
+    if moving_mask_data is not None or (moving_mask and moving_mask.strip() and os.path.exists(moving_mask)):
+        moving_mask_img = moving_mask_data if moving_mask_data is not None else sitk.ReadImage(moving_mask)
+        # Ensure mask is same size/spacing as moving image
+        if moving_mask_img.GetSpacing() != moving.GetSpacing() or \
+           moving_mask_img.GetOrigin() != moving.GetOrigin() or \
+           moving_mask_img.GetSize() != moving.GetSize():
+            moving_mask_img = sitk.Resample(moving_mask_img, moving, sitk.Transform(),
+                                          sitk.sitkNearestNeighbor, 0.0, moving_mask_img.GetPixelID())
+        logging.info(f"Using moving mask: {moving_mask}")
+    
+    # Phantom body mask from the baseline CT to restrict the metric samples (registration_bodyMaskThreshold)
+    body_mask = None
+    if reg_params["bodyMaskThreshold"] is not None:
+        body_mask = create_body_mask(moving, reg_params["bodyMaskThreshold"], reg_params["bodyMaskMargin"])
+        logging.info(f"Body mask: threshold={reg_params['bodyMaskThreshold']}, margin={reg_params['bodyMaskMargin']} mm")
+    
+    # Registration parameters (read from param file if provided)
+    if param is not None:
+        logging.info(f"Registration parameters from param file: learningRate={reg_params['learningRate']}, "
+                    f"numberOfIterations={reg_params['numberOfIterations']}, "
+                    f"convergenceMinimumValue={reg_params['convergenceMinimumValue']}, "
+                    f"convergenceWindowSize={reg_params['convergenceWindowSize']}")
+    
+    # Warm start: seed the optimizer with the transform of a previous case and skip the
+    # coarsest pyramid level; fall back to the cold path if the metric is poor
+    final_transform = None
+    warm_start_info = None
+    if warm_start_dir:
+        seed_transform = read_warm_start_transform(warm_start_dir)
+        reference_metric_value = read_registration_info(warm_start_dir).get("final_metric_value")
+        if seed_transform is not None and reference_metric_value is None:
+            logging.warning(f"No final metric in {warm_start_dir} to check a warm start against, "
+                            f"using cold registration")
+        elif seed_transform is not None:
+            logging.info(f"Warm-start registration from {warm_start_dir}")
+            print(f"Warm-start registration from {warm_start_dir}", flush=True)
+            warm_transform, warm_metric_value, warm_iteration_data = _execute_registration(
+                fixed, moving, fixed_mask_img, moving_mask_img, reg_params, seed_transform,
+                shrink_factors=[2, 1], smoothing_sigmas=[1, 0], body_mask=body_mask,
+                timer=timer, stage_name="registration.warm")
+            accepted = is_warm_start_metric_acceptable(warm_metric_value, reference_metric_value,
+                                                       reg_params["warmStartMetricTolerance"])
+            warm_start_info = {
+                "seed": warm_start_dir,
+                "metric_value": warm_metric_value,
+                "reference_metric_value": reference_metric_value,
+                "iterations": len(warm_iteration_data),
+                "accepted": accepted,
+            }
+            if accepted:
+                final_transform = warm_transform
+                final_metric_value = warm_metric_value
+                iteration_data = warm_iteration_data
+            else:
+                logging.warning(f"Warm-start metric {warm_metric_value:.6f} is poor "
+                                f"(seed case {reference_metric_value:.6f}), falling back to cold registration")
+    
+    if final_transform is None:
+        # Set initial transform (rigid body - translation + rotation)
+        initial_transform = sitk.CenteredTransformInitializer(
+            fixed,
+            moving,
+            sitk.Euler3DTransform(),
+            sitk.CenteredTransformInitializerFilter.GEOMETRY
+        )
+        # Start at 1/4 resolution, then 1/2, then full resolution
+        final_transform, final_metric_value, iteration_data = _execute_registration(
+            fixed, moving, fixed_mask_img, moving_mask_img, reg_params, initial_transform,
+            shrink_factors=[4, 2, 1], smoothing_sigmas=[2, 1, 0], body_mask=body_mask,
+            timer=timer, stage_name="registration.cold")
     
     # Save optimization data to CSV
+    optimization_csv = os.path.join(out_dir, "optimization.csv")
     if iteration_data:
         with open(optimization_csv, 'w', newline='') as csvfile:
             writer = csv.DictWriter(csvfile, fieldnames=['iteration', 'cost_function'])
@@ -203,49 +503,16 @@ def rigid_body_registration(fixed_image, fixed_mask, moving_image, moving_mask,
         logging.info(f"Optimization data saved to: {optimization_csv}")
         print(f"Optimization data saved to: {optimization_csv}", flush=True)
     
-    # Get final metric value
-    final_metric_value = registration_method.GetMetricValue()
     logging.info(f"Registration completed. Final metric value: {final_metric_value:.6f}")
     
-    # Apply transform to moving image to create result
-    resampler = sitk.ResampleImageFilter()
-    resampler.SetReferenceImage(fixed)
-    resampler.SetInterpolator(sitk.sitkLinear)
-    resampler.SetDefaultPixelValue(0)
-    resampler.SetTransform(final_transform)
-    
-    result = resampler.Execute(moving)
-    
-    # Write result image (float) with compression
-    result_file = os.path.join(out_dir, "result.mhd")
-    write_mhd_compressed(result, result_file)
-    logging.info(f"Registered image saved: {result_file} (compressed)")
-    
-    # Save resampled image as int pixel type for review
-    # Determine appropriate integer type based on image value range
-    result_array = sitk.GetArrayFromImage(result)
-    min_val = float(np.min(result_array))
-    max_val = float(np.max(result_array))
-    
-    # Choose appropriate integer type
-    if min_val >= -32768 and max_val <= 32767:
-        pixel_type = sitk.sitkInt16
-    elif min_val >= 0 and max_val <= 65535:
-        pixel_type = sitk.sitkUInt16
-    else:
-        pixel_type = sitk.sitkInt32
-    
-    # Cast to integer type
-    result_int = sitk.Cast(result, pixel_type)
-    
-    # Write resampled image
-    resampled_file = os.path.join(out_dir, "resampled.mha")
-    sitk.WriteImage(result_int, resampled_file)
-    logging.info(f"Resampled image (int) saved: {resampled_file}")
+    # Review images (result.mhd, resampled.mha) are written on demand by write_registration_review_images;
+    # remove those of a previous transform so they are never stale
+    for name in REVIEW_IMAGE_FILES:
+        stale_file = os.path.join(out_dir, name)
+        if os.path.exists(stale_file):
+            os.remove(stale_file)
     
     # Save transform for later use (compatible with apply_transform function)
-    transform_params_file = os.path.join(out_dir, "TransformParameters.0.txt")
-    
     # Save transform as SimpleITK transform file
     sitk.WriteTransform(final_transform, transform_params_file.replace('.txt', '.tfm'))
     
@@ -283,11 +550,88 @@ def rigid_body_registration(fixed_image, fixed_mask, moving_image, moving_mask,
         f.write(f"# Moving image path: {moving_image}\n")
         f.write(f"# Final metric value: {final_metric_value:.6f}\n")
     
+    # Record the cache key so an unchanged re-run can skip the optimizer
+    write_registration_info(out_dir, {
+        "cache_key": cache_key,
+        "parameters": reg_params,
+        "final_metric_value": final_metric_value,
+        "warm_start": warm_start_info,
+        "fixed_image": fixed_image,
+        "moving_image": moving_image,
+    })
+    
     logging.info(f"Transform parameters saved: {transform_params_file}")
     return transform_params_file
 
 
-def apply_transform(input_image, out_dir, transform_param, fixed_image_path=None):
+def write_registration_review_images(reg_dir, fixed_image=None, moving_image=None):
+    """
+    Write the registered moving image for review (not needed by the analysis)
+    
+    Resamples the moving image (baseline CT) onto the fixed image (case CT) with the
+    transform in reg_dir and writes result.mhd (float, compressed) and resampled.mha (int).
+    
+    Args:
+        reg_dir: Registration output directory (1.reg)
+        fixed_image: Path to fixed image (defaults to the one recorded in registration.json)
+        moving_image: Path to moving image (defaults to the one recorded in registration.json)
+        
+    Returns:
+        (result_file, resampled_file)
+    """
+    info = read_registration_info(reg_dir)
+    fixed_image = fixed_image or info.get("fixed_image")
+    moving_image = moving_image or info.get("moving_image")
+    transform_file = os.path.join(reg_dir, "TransformParameters.0.tfm")
+    if not fixed_image or not moving_image:
+        raise Exception(f"Fixed/moving image not given and not recorded in {reg_dir}")
+    if not os.path.exists(transform_file):
+        raise Exception(f"Transform file not found: {transform_file}")
+    
+    fixed = sitk.ReadImage(fixed_image)
+    moving = sitk.Cast(sitk.ReadImage(moving_image), sitk.sitkFloat32)
+    final_transform = sitk.ReadTransform(transform_file)
+    
+    # Apply transform to moving image to create result
+    resampler = sitk.ResampleImageFilter()
+    resampler.SetReferenceImage(fixed)
+    resampler.SetInterpolator(sitk.sitkLinear)
+    resampler.SetDefaultPixelValue(0)
+    resampler.SetTransform(final_transform)
+    
+    result = resampler.Execute(moving)
+    
+    # Write result image (float) with compression
+    result_file = os.path.join(reg_dir, "result.mhd")
+    write_mhd_compressed(result, result_file)
+    logging.info(f"Registered image saved: {result_file} (compressed)")
+    
+    # Save resampled image as int pixel type for review
+    # Determine appropriate integer type based on image value range
+    result_array = sitk.GetArrayFromImage(result)
+    min_val = float(np.min(result_array))
+    max_val = float(np.max(result_array))
+    
+    # Choose appropriate integer type
+    if min_val >= -32768 and max_val <= 32767:
+        pixel_type = sitk.sitkInt16
+    elif min_val >= 0 and max_val <= 65535:
+        pixel_type = sitk.sitkUInt16
+    else:
+        pixel_type = sitk.sitkInt32
+    
+    # Cast to integer type
+    result_int = sitk.Cast(result, pixel_type)
+    
+    # Write resampled image
+    resampled_file = os.path.join(reg_dir, "resampled.mha")
+    sitk.WriteImage(result_int, resampled_file)
+    logging.info(f"Resampled image (int) saved: {resampled_file}")
+    
+    return result_file, resampled_file
+
+
+def apply_transform(input_image, out_dir, transform_param, fixed_image_path=None, result_name="result.mha"):
     """
     Apply transformation to an image using SimpleITK
     
@@ -295,23 +639,28 @@ def apply_transform(input_image, out_dir, transform_param, fixed_image_path=None
     The output is resampled to match the fixed image space.
     
     Args:
-        input_image: Path to input image to transform (mask from baseline)
+        input_image: Path to input image to transform (mask from baseline), or the SimpleITK image itself
         out_dir: Output directory
         transform_param: Path to transform parameters file (from registration)
         fixed_image_path: Optional path to fixed image (case CT) for reference space
+        result_name: File name of the transformed image in out_dir (use distinct names
+            when several transforms share out_dir concurrently)
         
     Returns:
         Path to transformed image
     """
     logging.info(f"Applying transformation using SimpleITK...")
-    logging.info(f"Input: {input_image}")
+    if isinstance(input_image, sitk.Image):
+        logging.info(f"Input: image in memory {input_image.GetSize()}")
+    else:
+        logging.info(f"Input: {input_image}")
     logging.info(f"Transform: {transform_param}")
     logging.info(f"Output: {out_dir}")
     
     os.makedirs(out_dir, exist_ok=True)
     
     # Read input image (mask to transform)
-    image = sitk.ReadImage(input_image)
+    image = input_image if isinstance(input_image, sitk.Image) else sitk.ReadImage(input_image)
     
     # Try to read transform from .tfm file first (SimpleITK native format)
     transform_file = transform_param.replace('.txt', '.tfm')
@@ -377,7 +726,7 @@ def apply_transform(input_image, out_dir, transform_param, fixed_image_path=None
     result = resampler.Execute(image)
     
     # Write result
-    result_file = os.path.join(out_dir, "result.mha")
+    result_file = os.path.join(out_dir, result_name)
     sitk.WriteImage(result, result_file)
     
     logging.info(f"Transformation completed. Result: {result_file}")
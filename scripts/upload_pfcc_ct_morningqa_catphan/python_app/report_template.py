@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Report template - {{{placeholder}}} templates compiled once and rendered in a single pass
+"""
+
+import os
+import re
+import logging
+import threading
+
+
+# Placeholders of the report templates: {{{name}}}
+PLACEHOLDER_PATTERN = re.compile(r"\{\{\{(.*?)\}\}\}")
+
+
+class ReportTemplate:
+    """
+    Report template split into literal text and placeholders
+
+    The replace words of the device (replace_words_for_report) are applied to the literal
+    text when the template is compiled and to the placeholder values when it is rendered,
+    one word after the other in their configured order (so a replacement containing a
+    later word is replaced again). The rendered report reads the same as replacing the
+    placeholders first and the words afterwards, unless a word spans the boundary between
+    literal text and a placeholder value.
+    """
+
+    def __init__(self, text, replace_words=None):
+        """
+        Compile a template
+
+        Args:
+            text: Template text
+            replace_words: List of (word, replacement) pairs, applied in order (optional)
+        """
+        self.replace_words = [(word, new) for word, new in (replace_words or []) if word]
+
+        # Even indices: literal text (words replaced), odd indices: placeholder names
+        parts = PLACEHOLDER_PATTERN.split(text)
+        self._parts = [self._replace_words(part) if i % 2 == 0 else part for i, part in enumerate(parts)]
+        self.placeholders = set(parts[1::2])
+
+    def _replace_words(self, text):
+        """Apply the replace words to text, in order"""
+        for word, new in self.replace_words:
+            text = text.replace(word, new)
+        return text
+
+    def render(self, values):
+        """
+        Fill the placeholders
+
+        Args:
+            values: Dictionary placeholder name -> text; placeholders without a value are kept as is
+
+        Returns:
+            Rendered text
+        """
+        out = []
+        for i, part in enumerate(self._parts):
+            if i % 2 == 0:
+                out.append(part)
+            elif part in values:
+                out.append(self._replace_words(str(values[part])))
+            else:
+                out.append(self._replace_words("{{{" + part + "}}}"))
+        return "".join(out)
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def get_report_template(template_file, replace_words=None):
+    """
+    Compiled template of a file, cached per process until the file or the replace words change
+
+    Args:
+        template_file: Template path (e.g. ./_data/devices/{device_id}/report_templates/full/report.html)
+        replace_words: List of (word, replacement) pairs (optional)
+
+    Returns:
+        ReportTemplate
+    """
+    stat = os.stat(template_file)
+    replace_words = tuple(replace_words or [])
+    path = os.path.abspath(template_file)
+    signature = (stat.st_mtime_ns, stat.st_size, replace_words)
+    with _templates_lock:
+        cached = _templates.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+    with open(template_file, 'r') as f:
+        template = ReportTemplate(f.read(), replace_words)
+    logging.info(f"Report template compiled: {template_file} ({len(template.placeholders)} placeholders)")
+    with _templates_lock:
+        _templates[path] = (signature, template)
+    return template
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Analysis results - measurement values compared with the baseline, shared by the HTML report and JSON output
+"""
+
+import os
+import numpy as np
+
+
+def read_result_csv(csv_file):
+    """
+    Read a measurement results CSV (header line with the ids, line with the values)
+
+    Args:
+        csv_file: CSV path
+
+    Returns:
+        (ids, values) lists of strings, or None if the file does not exist
+    """
+    if not os.path.exists(csv_file):
+        return None
+    with open(csv_file, 'r') as f:
+        lines = f.readlines()
+    return lines[0].strip().split(','), lines[1].strip().split(',')
+
+
+def write_result_csv(csv_file, ids, values):
+    """
+    Write a measurement results CSV (header line with the ids, line with the values)
+
+    Args:
+        csv_file: CSV path
+        ids: Column ids (header)
+        values: Values (written with str())
+    """
+    with open(csv_file, 'w') as f:
+        f.write(",".join(ids) + "\n")
+        f.write(",".join(str(v) for v in values) + "\n")
+
+
+class SectionResults:
+    """
+    Results of one report section compared with the baseline
+
+    Attributes:
+        name: Section key in analysis_results.json (e.g. "hu_consistency")
+        placeholder: Report template placeholder of the table rows (e.g. "HU")
+        num_format: Number format of the table ("0.0", "0.00", or other for str())
+        tolerance: Tolerance of the absolute difference
+        ids: Measurement ids (e.g. "HU1", "geo1->geo2")
+        labels: Display labels (id2label, the id if no label)
+        values: Case values (float64 array)
+        reference: Baseline values (float64 array)
+        difference: values - reference
+        passed: abs(difference) < tolerance (bool array)
+    """
+
+    def __init__(self, name, placeholder, num_format, tolerance, ids, labels, values, reference):
+        self.name = name
+        self.placeholder = placeholder
+        self.num_format = num_format
+        self.tolerance = tolerance
+        self.ids = list(ids)
+        self.labels = list(labels)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.reference = np.asarray(reference, dtype=np.float64)
+        self.difference = self.values - self.reference
+        self.passed = np.abs(self.difference) < tolerance
+
+    def __len__(self):
+        return len(self.ids)
+
+    def all_passed(self):
+        """Whether every value is within tolerance"""
+        return bool(np.all(self.passed))
+
+    def rows(self):
+        """One dictionary per value (id, label, value, reference, difference, tolerance, passed)"""
+        return [
+            {
+                "id": self.ids[i],
+                "label": self.labels[i],
+                "value": float(self.values[i]),
+                "reference": float(self.reference[i]),
+                "difference": float(self.difference[i]),
+                "tolerance": self.tolerance,
+                "passed": bool(self.passed[i]),
+            }
+            for i in range(len(self))
+        ]
+
+    def to_json(self):
+        """Rows with the values rounded for analysis_results.json"""
+        return [
+            dict(row, value=round(row["value"], 4), reference=round(row["reference"], 4),
+                 difference=round(row["difference"], 4))
+            for row in self.rows()
+        ]
+
+
+class AnalysisResults:
+    """
+    Results of a case: metadata and the compared results of each report section (in report order)
+    """
+
+    def __init__(self, metadata, sections):
+        """
+        Args:
+            metadata: Dictionary (study_date, study_time, operator, device_name)
+            sections: List of SectionResults
+        """
+        self.metadata = metadata
+        self.sections = {section.name: section for section in sections}
+
+    def overall_passed(self):
+        """Whether every value of every section is within tolerance"""
+        return all(section.all_passed() for section in self.sections.values())
+
+    def to_json(self):
+        """Content of analysis_results.json"""
+        results = {"metadata": self.metadata}
+        for name, section in self.sections.items():
+            results[name] = {
+                "tolerance": section.tolerance,
+                "results": section.to_json(),
+            }
+        results["overall_passed"] = self.overall_passed()
+        return results
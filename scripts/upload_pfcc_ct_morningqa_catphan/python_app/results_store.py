@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Results store - all measurements of a case in one JSON file, written atomically
+"""
+
+import os
+import json
+import logging
+import threading
+
+
+# Measurements of a case in the analysis folder
+RESULTS_STORE_FILE = "measurements.json"
+RESULTS_STORE_VERSION = 1
+
+# Sections of the store
+#   stats:   mask name -> {"min", "max", "mean", "std"} (replaces {mask}.stat.txt)
+#   rois:    mask name -> {"bounding_box", "center_of_gravity", "total_mass"} (replaces .roi.txt/.mnt.txt)
+#   results: results CSV name -> {"ids", "values"} (the values of the CSVs the report is generated from)
+RESULTS_STORE_SECTIONS = ["stats", "rois", "results"]
+
+
+class ResultsStore:
+    """
+    Measurements of a case, collected in memory by the analysis stage and saved as one file
+
+    Thread safe, so the measurements run in parallel can record into the same store.
+    """
+
+    def __init__(self, store_file):
+        """
+        Args:
+            store_file: Store path (e.g. {case}/3.analysis/measurements.json)
+        """
+        self.store_file = store_file
+        self.result_dir = os.path.abspath(os.path.dirname(store_file))
+        self._lock = threading.Lock()
+        self._data = {section: {} for section in RESULTS_STORE_SECTIONS}
+
+    @classmethod
+    def load(cls, store_file):
+        """
+        Read a saved store
+
+        Returns:
+            ResultsStore, or None if the file does not exist or is of another version
+        """
+        if not os.path.exists(store_file):
+            return None
+        with open(store_file, 'r') as f:
+            data = json.load(f)
+        if data.get("version") != RESULTS_STORE_VERSION:
+            logging.warning(f"Results store {store_file} is of version {data.get('version')}, ignored")
+            return None
+        store = cls(store_file)
+        for section in RESULTS_STORE_SECTIONS:
+            store._data[section] = data.get(section, {})
+        return store
+
+    def put(self, section, name, record):
+        """
+        Record a measurement
+
+        Args:
+            section: Store section (see RESULTS_STORE_SECTIONS)
+            name: Mask name (e.g. "HU1") or results CSV name (e.g. "HU.csv")
+            record: JSON-serializable dictionary
+        """
+        with self._lock:
+            self._data[section][name] = record
+
+    def get(self, section, name):
+        """Recorded measurement, None if not recorded"""
+        with self._lock:
+            return self._data[section].get(name)
+
+    def put_results(self, filename, ids, values):
+        """Record the values of a results CSV (ids, values as floats)"""
+        self.put("results", filename, {"ids": list(ids), "values": [float(v) for v in values]})
+
+    def get_results(self, filename):
+        """
+        Values of a results CSV
+
+        Returns:
+            (ids, values), or None if not recorded
+        """
+        record = self.get("results", filename)
+        if record is None:
+            return None
+        return record["ids"], record["values"]
+
+    def save(self):
+        """Write the store (atomically, so readers never see a partial file)"""
+        with self._lock:
+            data = {"version": RESULTS_STORE_VERSION}
+            data.update(self._data)
+            tmp_file = f"{self.store_file}.{os.getpid()}.tmp"
+            with open(tmp_file, 'w') as f:
+                json.dump(data, f, indent=1)
+        os.replace(tmp_file, self.store_file)
+        logging.info(f"Measurements saved to: {self.store_file}")
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Import the CTQA modules (python_app) as the scripts do
+sys.path.insert(0, str(Path(__file__).parent.parent))
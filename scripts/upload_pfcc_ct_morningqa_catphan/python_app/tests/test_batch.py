@@ -0,0 +1,79 @@
+import os
+import numpy as np
+import SimpleITK as sitk
+
+from batch import case_input_hash
+from volumeio import write_image
+
+
+def device(tmp_path):
+    """param.txt, baseline and compiled baseline folders of a device"""
+    param_file = tmp_path / "param.txt"
+    param_file.write_text("num_of_HU_masks=2\n")
+    baseline_dir = tmp_path / "baseline"
+    baseline_dir.mkdir()
+    (baseline_dir / "CT.nrrd").write_bytes(b"baseline")
+    compiled_dir = tmp_path / "baseline_compiled"
+    compiled_dir.mkdir()
+    (compiled_dir / "compiled.json").write_text("{}")
+    return str(param_file), str(baseline_dir), str(compiled_dir)
+
+
+def ct_image(value=0):
+    return sitk.GetImageFromArray(np.full((4, 8, 8), value, dtype=np.int16))
+
+
+def test_dicom_case_hash_is_unchanged_by_its_converted_ct(tmp_path):
+    param_file, baseline_dir, compiled_dir = device(tmp_path)
+    case_dir = tmp_path / "case"
+    case_dir.mkdir()
+    for i in range(3):
+        (case_dir / f"CT.{i}.dcm").write_bytes(b"dicom")
+    before = case_input_hash(param_file, baseline_dir, str(case_dir), compiled_dir)
+
+    # A first run converts the DICOM files to CT.mhd and writes its outputs
+    write_image(ct_image(), str(case_dir / "CT.mhd"), "zlib")
+    (case_dir / ".series_index.json").write_text("{}")
+
+    assert case_input_hash(param_file, baseline_dir, str(case_dir), compiled_dir) == before
+
+
+def test_inputs_hash_follows_the_inputs_not_the_series_index(tmp_path):
+    param_file, baseline_dir, compiled_dir = device(tmp_path)
+    inputs_dir = tmp_path / "case" / "0.inputs"
+    inputs_dir.mkdir(parents=True)
+    (inputs_dir / "CT.1.dcm").write_bytes(b"dicom")
+    before = case_input_hash(param_file, baseline_dir, str(tmp_path / "case"), compiled_dir)
+
+    (inputs_dir / ".series_index.json").write_text("{}")
+    assert case_input_hash(param_file, baseline_dir, str(tmp_path / "case"), compiled_dir) == before
+
+    (inputs_dir / "CT.2.dcm").write_bytes(b"dicom")
+    assert case_input_hash(param_file, baseline_dir, str(tmp_path / "case"), compiled_dir) != before
+
+
+def test_ct_case_hash_is_unchanged_by_archiving(tmp_path):
+    param_file, baseline_dir, compiled_dir = device(tmp_path)
+    case_dir = tmp_path / "case"
+    case_dir.mkdir()
+    write_image(ct_image(), str(case_dir / "CT.mhd"), "raw")
+    before = case_input_hash(param_file, baseline_dir, str(case_dir), compiled_dir)
+
+    write_image(ct_image(), str(case_dir / "CT.mhd"), "zlib")
+    assert case_input_hash(param_file, baseline_dir, str(case_dir), compiled_dir) == before
+
+    write_image(ct_image(1), str(case_dir / "CT.mhd"), "zlib")
+    assert case_input_hash(param_file, baseline_dir, str(case_dir), compiled_dir) != before
+
+
+def test_recompiled_baseline_changes_the_hash(tmp_path):
+    param_file, baseline_dir, compiled_dir = device(tmp_path)
+    case_dir = tmp_path / "case"
+    case_dir.mkdir()
+    write_image(ct_image(), str(case_dir / "CT.mhd"), "raw")
+    before = case_input_hash(param_file, baseline_dir, str(case_dir), compiled_dir)
+
+    compiled_file = os.path.join(compiled_dir, "compiled.json")
+    with open(compiled_file, "w") as f:
+        f.write('{"version": 1}')
+    assert case_input_hash(param_file, baseline_dir, str(case_dir), compiled_dir) != before
@@ -0,0 +1,63 @@
+import logging
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+from baseline import build_label_map
+from ctqa import CTQA
+
+
+def write_masks(directory, key, arrays):
+    """Write mask arrays (z, y, x) as {key}1.mha, {key}2.mha, ..."""
+    files = []
+    for i, array in enumerate(arrays, 1):
+        mask_file = str(directory / f"{key}{i}.mha")
+        sitk.WriteImage(sitk.GetImageFromArray(array.astype(np.uint8)), mask_file)
+        files.append(mask_file)
+    return files
+
+
+def box(shape, z, y, x):
+    array = np.zeros(shape, dtype=np.uint8)
+    array[z, y, x] = 1
+    return array
+
+
+def test_read_label_map_of_disjoint_masks(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    shape = (4, 8, 8)
+    write_masks(tmp_path, "geo", [box(shape, slice(1, 3), slice(0, 2), slice(0, 2)),
+                                  box(shape, slice(1, 3), slice(4, 6), slice(4, 6))])
+
+    label_array = CTQA().read_label_map(str(tmp_path), "mha", "geo", 2)
+
+    assert np.count_nonzero(label_array == 1) == 8
+    assert np.count_nonzero(label_array == 2) == 8
+    assert label_array[1, 0, 0] == 1 and label_array[1, 4, 4] == 2
+
+
+def test_read_label_map_rejects_overlapping_masks(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    shape = (4, 8, 8)
+    write_masks(tmp_path, "geo", [box(shape, slice(1, 3), slice(0, 4), slice(0, 4)),
+                                  box(shape, slice(1, 3), slice(2, 6), slice(2, 6))])
+
+    with pytest.raises(Exception, match="geo2 overlaps mask geo1"):
+        CTQA().read_label_map(str(tmp_path), "mha", "geo", 2)
+
+
+def test_build_label_map_later_mask_wins_and_rois_use_whole_masks(tmp_path, caplog):
+    shape = (4, 8, 8)
+    files = write_masks(tmp_path, "HU", [box(shape, slice(0, 2), slice(0, 4), slice(0, 4)),
+                                         box(shape, slice(0, 2), slice(2, 6), slice(2, 6))])
+
+    with caplog.at_level(logging.WARNING):
+        label_map, rois = build_label_map(files)
+
+    label_array = sitk.GetArrayFromImage(label_map)
+    assert label_array[0, 3, 3] == 2  # shared voxel: later mask
+    assert label_array[0, 0, 0] == 1
+    assert "overlaps earlier masks (8 voxels)" in caplog.text
+    # ROIs are those of the masks as drawn, not of what is left in the label map
+    assert rois[0]["voxels"] == 32 and rois[0]["bbox_size"] == [4, 4, 2]
+    assert rois[1]["voxels"] == 32 and rois[1]["bbox_index"] == [2, 2, 0]
@@ -0,0 +1,68 @@
+import os
+import pytest
+
+from param import Param, load_param
+
+
+def write_param(tmp_path, text, name="param.txt"):
+    param_file = tmp_path / name
+    param_file.write_text(text)
+    return str(param_file)
+
+
+def test_typed_values(tmp_path):
+    param = Param(write_param(tmp_path, "num_of_HU_masks=8\nHU_tol=5\nwarmStart=yes\nlevels=0.05, 0.1,0.2\nname=GE\n"))
+
+    assert param.get_int("NUM_OF_HU_MASKS") == 8
+    assert param.get_float("HU_tol") == 5.0
+    assert param.get_bool("warmStart") is True
+    assert param.get_typed("levels", list) == [0.05, 0.1, 0.2]
+    assert param.get_typed("name", str) == "GE"
+
+
+def test_missing_and_invalid_values(tmp_path):
+    param = Param(write_param(tmp_path, "HU_tol=five\nempty=\n"))
+
+    assert param.get_float("geo_tol", 0.5) == 0.5
+    assert param.get_int("empty", 3) == 3
+    with pytest.raises(Exception, match="Parameter not found: geo_tol"):
+        param.get_float("geo_tol")
+    with pytest.raises(Exception, match="Invalid float value of HU_tol"):
+        param.get_float("HU_tol")
+
+
+def test_schema_lists_every_invalid_value(tmp_path):
+    param_file = write_param(tmp_path, "num_of_HU_masks=8.5\nHU_tol=x\ngeo_tol=1\n")
+
+    with pytest.raises(Exception) as error:
+        Param(param_file, {"num_of_HU_masks": int, "HU_tol": float, "geo_tol": float, "DT_tol": float})
+    assert "num_of_HU_masks" in str(error.value) and "HU_tol" in str(error.value)
+    assert "geo_tol" not in str(error.value) and "DT_tol" not in str(error.value)
+
+
+def test_cached_lists_are_not_shared_with_callers(tmp_path):
+    param = load_param(write_param(tmp_path, "levels=0.05,0.1\n"))
+
+    levels = param.get_typed("levels", list)
+    levels.append(1.0)
+    levels[0] = 0.0
+
+    assert param.get_typed("levels", list) == [0.05, 0.1]
+    assert load_param(str(tmp_path / "param.txt")).get_typed("levels", list) == [0.05, 0.1]
+
+
+def test_load_param_is_shared_until_the_file_changes(tmp_path):
+    param_file = write_param(tmp_path, "HU_tol=5\n")
+    schema = {"HU_tol": float}
+
+    first = load_param(param_file, schema)
+    assert load_param(param_file, schema) is first
+
+    with open(param_file, "w") as f:
+        f.write("HU_tol=7.5\n")
+    stat = os.stat(param_file)
+    os.utime(param_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    reloaded = load_param(param_file, schema)
+    assert reloaded is not first
+    assert reloaded.get_float("HU_tol") == 7.5
@@ -0,0 +1,96 @@
+import pytest
+
+from ctqa import CTQA, REPORT_TOLERANCE_KEYS
+from report_template import ReportTemplate
+from results import SectionResults
+
+
+TEMPLATE = """<html><h1>CatPhan QA {{{date}}} {{{time}}} by {{{user}}}</h1>
+<p>HU tolerance {{{HU_tol}}}, RMTF tolerance {{{HC_RMTF_tol}}}, uniformity {{{UF.uniformity_tol}}}</p>
+<table>{{{HU}}}</table>
+<table>{{{geo}}}</table>
+<table>{{{UF.uniformity}}}</table>
+<table>{{{HC.RMTF}}}</table>
+<p>Pass means within tolerance. {{{not_a_value}}}</p></html>
+"""
+
+# Results of a case: placeholder -> (labels, case values, baseline values, tolerance, number format)
+RESULTS = {
+    "HU": (["Air", "PMP", "LDPE", "Poly"], [-998.2, -187.9, -96.4, -35.0], [-1000.0, -190.1, -98.0, -40.5], 5.0, "0.0"),
+    "geo": (["geo1->geo2", "geo2->geo1"], [50.04, 49.91], [50.0, 50.0], 0.5, "0.0"),
+    "UF.uniformity": (["Uniformity"], [0.0121], [0.0104], 0.01, "0.00"),
+    "HC.RMTF": ([f"HC{i}" for i in range(1, 16)], [1.0 - 0.06 * i for i in range(15)],
+                [1.0 - 0.061 * i for i in range(15)], 0.05, "0.00"),
+}
+
+VALUES = {"date": "20260101", "time": "070000", "user": "JK"}
+VALUES.update({tol_key: "5" for tol_key in REPORT_TOLERANCE_KEYS})
+
+
+def legacy_table_rows(labels, values1, values0, tol, num_format):
+    """Table rows as generated before the report template (CTQA.gen_html_table_rows_from_csv)"""
+    rows = []
+    for label, value1, value0 in zip(labels, values1, values0):
+        diff = value1 - value0
+        pass_fail = "Pass" if abs(diff) < tol else "Fail"
+        if num_format == "0.0":
+            value1_str, value0_str, diff_str = f"{value1:.1f}", f"{value0:.1f}", f"{diff:.1f}"
+        elif num_format == "0.00":
+            value1_str, value0_str, diff_str = f"{value1:.2f}", f"{value0:.2f}", f"{diff:.2f}"
+        else:
+            value1_str, value0_str, diff_str = str(value1), str(value0), str(diff)
+        if pass_fail == "Pass":
+            pass_cell = '<td class="pass">Pass<span class="glyphicon glyphicon-ok" aria-hidden="true"></span></td>'
+        else:
+            pass_cell = '<td class="fail">Fail<span class="glyphicon glyphicon-remove" aria-hidden="true"></span></td>'
+        rows.append(f"""<tr>
+    <td>{label}</td>
+    <td>{value1_str}</td>
+    <td>{value0_str}</td>
+    <td>{diff_str}</td>
+    {pass_cell}
+</tr>""")
+    return "\n".join(rows)
+
+
+def legacy_report(text, values, tables, replace_words):
+    """Report as generated before the report template: chained str.replace, then the words in order"""
+    for name, value in list(values.items()) + list(tables.items()):
+        text = text.replace("{{{" + name + "}}}", value)
+    for word, new in replace_words:
+        text = text.replace(word, new)
+    return text
+
+
+def render(replace_words):
+    """(report rendered with ReportTemplate, report of the legacy renderer) of the fixture results"""
+    ctqa = CTQA()
+    values = dict(VALUES)
+    tables = {}
+    for placeholder, (labels, case_values, reference, tol, num_format) in RESULTS.items():
+        section = SectionResults(placeholder, placeholder, num_format, tol, labels, labels, case_values, reference)
+        values[placeholder] = ctqa.gen_html_table_rows(section.rows(), num_format)
+        tables[placeholder] = legacy_table_rows(labels, case_values, reference, tol, num_format)
+    rendered = ReportTemplate(TEMPLATE, replace_words).render(values)
+    return rendered, legacy_report(TEMPLATE, VALUES, tables, replace_words)
+
+
+@pytest.mark.parametrize("replace_words", [
+    [],
+    [("CatPhan", "Catphan 604")],
+    # A replacement containing a later word is replaced again, as with the chained str.replace
+    [("Pass", "OK"), ("OK", "Within tolerance")],
+    # Overlapping words are applied in their configured order, not longest first
+    [("HU", "Hounsfield"), ("HU tolerance", "never matched"), ("PMP", "HU PMP")],
+])
+def test_report_matches_the_legacy_renderer(tmp_path, monkeypatch, replace_words):
+    monkeypatch.chdir(tmp_path)
+    rendered, legacy = render(replace_words)
+    assert rendered == legacy
+
+
+def test_sections_render_one_row_per_value(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    rendered, _ = render([])
+    assert rendered.count("<tr>") == sum(len(result[0]) for result in RESULTS.values())
+    assert "{{{not_a_value}}}" in rendered
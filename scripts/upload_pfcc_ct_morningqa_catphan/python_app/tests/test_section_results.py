@@ -0,0 +1,53 @@
+import os
+import pytest
+
+from ctqa import CTQA
+from results import write_result_csv
+
+
+@pytest.fixture
+def dirs(tmp_path, monkeypatch):
+    """(CTQA, baseline dir, case 3.analysis dir) with 3 HU values in each"""
+    monkeypatch.chdir(tmp_path)
+    baseline_dir = tmp_path / "baseline"
+    case_result_dir = tmp_path / "case" / "3.analysis"
+    baseline_dir.mkdir()
+    case_result_dir.mkdir(parents=True)
+    (baseline_dir / "id2label.txt").write_text("HU1=Air\nHU2=PMP\n")
+    write_result_csv(str(baseline_dir / "HU.csv"), ["HU1", "HU2", "HU3"], [-1000.0, -190.0, -98.0])
+    write_result_csv(str(case_result_dir / "HU.csv"), ["HU1", "HU2", "HU3"], [-998.0, -188.0, -60.0])
+    return CTQA(device_id="dev"), str(baseline_dir), str(case_result_dir)
+
+
+def test_section_compares_each_value(dirs):
+    ctqa, baseline_dir, case_result_dir = dirs
+
+    section = ctqa.compare_section_results(case_result_dir, baseline_dir, 3, 5.0, "HU.csv")
+
+    assert section.labels == ["Air", "PMP", "HU3"]
+    assert list(section.passed) == [True, True, False]
+    assert not section.all_passed()
+
+
+@pytest.mark.parametrize("missing", ["baseline", "case"])
+def test_missing_results_fail_the_report(dirs, missing):
+    ctqa, baseline_dir, case_result_dir = dirs
+    os.remove(os.path.join(baseline_dir if missing == "baseline" else case_result_dir, "HU.csv"))
+
+    with pytest.raises(Exception, match="results not found"):
+        ctqa.compare_section_results(case_result_dir, baseline_dir, 3, 5.0, "HU.csv")
+    with pytest.raises(Exception, match="results not found"):
+        ctqa.gen_html_table_rows_from_csv(case_result_dir, baseline_dir, 3, 5.0, "HU.csv")
+    assert ctqa.collect_csv_results(case_result_dir, baseline_dir, 3, 5.0, "HU.csv") == []
+
+
+def test_short_results_fail_the_report(dirs):
+    ctqa, baseline_dir, case_result_dir = dirs
+    write_result_csv(os.path.join(case_result_dir, "HU.csv"), ["HU1", "HU2"], [-998.0, -188.0])
+
+    with pytest.raises(Exception, match="2 values in .*HU.csv, 3 expected"):
+        ctqa.compare_section_results(case_result_dir, baseline_dir, 3, 5.0, "HU.csv")
+    # num_of_HU_masks larger than the baseline
+    with pytest.raises(Exception, match="3 values in .*HU.csv, 4 expected"):
+        ctqa.compare_section_results(case_result_dir, baseline_dir, 4, 5.0, "HU.csv")
+    assert len(ctqa.collect_csv_results(case_result_dir, baseline_dir, 3, 5.0, "HU.csv")) == 2
@@ -0,0 +1,61 @@
+import json
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+from volumeio import (ZLIB_FLEVELS, MappedVolume, archive_images, mhd_compression_level, open_mapped_volume,
+                      write_image, write_mapped_volume)
+
+
+def image():
+    rng = np.random.default_rng(0)
+    return sitk.GetImageFromArray(rng.integers(-1000, 1000, (8, 32, 32)).astype(np.int16))
+
+
+def test_compression_level_of_each_format(tmp_path):
+    for image_format in ("raw", "fast", "zlib"):
+        mhd_file = str(tmp_path / f"{image_format}.mhd")
+        write_image(image(), mhd_file, image_format)
+        assert mhd_compression_level(mhd_file) == ZLIB_FLEVELS.get(image_format)
+
+
+def test_archive_recompresses_raw_and_fast_images_only(tmp_path):
+    files = {}
+    for image_format in ("raw", "fast", "zlib"):
+        files[image_format] = str(tmp_path / f"{image_format}.mhd")
+        write_image(image(), files[image_format], image_format)
+
+    assert archive_images(list(files.values())) == 2
+
+    for mhd_file in files.values():
+        assert mhd_compression_level(mhd_file) == ZLIB_FLEVELS["zlib"]
+        assert np.array_equal(sitk.GetArrayFromImage(sitk.ReadImage(mhd_file)), sitk.GetArrayFromImage(image()))
+    assert archive_images(list(files.values())) == 0
+
+
+def test_mapped_volume_round_trip(tmp_path):
+    mhd_file = str(tmp_path / "CT.mhd")
+    write_image(image(), mhd_file, "raw")
+
+    volume = open_mapped_volume(mhd_file, str(tmp_path / "CT.npy"))
+
+    assert np.array_equal(volume.array, sitk.GetArrayFromImage(image()))
+    assert volume.GetSize() == image().GetSize()
+
+
+def test_failed_sidecar_write_keeps_the_previous_files(tmp_path, monkeypatch):
+    npy_file = str(tmp_path / "CT.npy")
+    write_mapped_volume(image(), npy_file)
+    with open(npy_file + ".json") as f:
+        sidecar = f.read()
+
+    def crash(*args, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr(json, "dump", crash)
+    with pytest.raises(OSError):
+        write_mapped_volume(image(), npy_file)
+
+    with open(npy_file + ".json") as f:
+        assert f.read() == sidecar
+    assert MappedVolume(npy_file).GetSpacing() == (1.0, 1.0, 1.0)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["CT.npy", "CT.npy.json"]
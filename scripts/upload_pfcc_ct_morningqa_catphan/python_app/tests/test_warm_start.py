@@ -0,0 +1,42 @@
+import json
+
+from ctqa import CTQA
+from registration import REGISTRATION_INFO_FILE, is_warm_start_metric_acceptable
+
+
+def make_case(cases_dir, name, final_metric_value=-0.5):
+    """Analyzed case with a registration transform (and its final metric unless None)"""
+    reg_dir = cases_dir / name / "1.reg"
+    reg_dir.mkdir(parents=True)
+    (reg_dir / "TransformParameters.0.tfm").write_text("")
+    if final_metric_value is not None:
+        (reg_dir / REGISTRATION_INFO_FILE).write_text(json.dumps({"final_metric_value": final_metric_value}))
+    (cases_dir / name / "3.analysis").mkdir()
+    (cases_dir / name / "3.analysis" / "analysis_results.json").write_text("{}")
+    return cases_dir / name
+
+
+def test_warm_start_metric_is_checked_against_the_seed_case():
+    assert is_warm_start_metric_acceptable(-0.50, -0.50, 0.2)
+    assert is_warm_start_metric_acceptable(-0.41, -0.50, 0.2)
+    assert not is_warm_start_metric_acceptable(-0.39, -0.50, 0.2)
+
+
+def test_warm_start_is_rejected_without_a_seed_metric():
+    assert not is_warm_start_metric_acceptable(-0.9, None, 0.2)
+
+
+def test_warm_start_seed_is_the_newest_older_case_with_a_metric(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cases_dir = tmp_path / "_data" / "devices" / "dev" / "cases"
+    make_case(cases_dir, "20260101_070000")
+    make_case(cases_dir, "20260102_070000", final_metric_value=None)
+    current = make_case(cases_dir, "20260103_070000")
+    make_case(cases_dir, "20260104_070000")
+
+    ctqa = CTQA(device_id="dev")
+
+    seed = ctqa.find_warm_start_dir(str(current))
+    assert seed.endswith("20260101_070000/1.reg")
+    # The oldest case has no earlier case to start from, even though later ones exist
+    assert ctqa.find_warm_start_dir(str(cases_dir / "20260101_070000")) is None
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Stage timing and profiling - durations and I/O of the CTQA processing stages
+"""
+
+import os
+import json
+import time
+import pstats
+import logging
+import cProfile
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+
+
+# Per-stage timings of a run, written to the analysis folder
+TIMINGS_FILE = "timings.json"
+
+# Profile of a run (cProfile binary for snakeviz/pstats, text summary)
+PROFILE_FILE = "profile.prof"
+PROFILE_TEXT_FILE = "profile.txt"
+
+
+def read_process_io():
+    """
+    Bytes read and written by this process so far (rchar/wchar of /proc/self/io)
+
+    Counts all read/write calls (including page cache hits), not only disk transfers.
+
+    Returns:
+        (read_bytes, written_bytes), or None where /proc/self/io is not available
+    """
+    try:
+        with open("/proc/self/io", 'r') as f:
+            counters = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+class StageTimer:
+    """
+    Collects the duration and I/O of named processing stages
+
+    Thread safe, so stages run in parallel (e.g. the per-key mask transfer) can record
+    into the same timer. The I/O counters are per process: stages that overlap in time
+    each include the bytes of the others.
+    """
+
+    def __init__(self):
+        self.started_at = datetime.now().isoformat()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.stages = []
+
+    def add(self, name, seconds, io_start=None, **info):
+        """
+        Record a stage
+
+        Args:
+            name: Stage name (e.g. "registration", "transfer.HU")
+            seconds: Duration
+            io_start: read_process_io() at the start of the stage (optional, adds the bytes read/written)
+            **info: Additional fields of the stage record
+        """
+        record = {"name": name, "seconds": round(seconds, 4), "thread": threading.current_thread().name}
+        io_end = read_process_io() if io_start is not None else None
+        if io_end is not None:
+            record["read_bytes"] = io_end[0] - io_start[0]
+            record["written_bytes"] = io_end[1] - io_start[1]
+        record.update(info)
+        with self._lock:
+            self.stages.append(record)
+        logging.info(f"Stage {name}: {seconds:.3f} s")
+
+    @contextmanager
+    def stage(self, name, **info):
+        """
+        Time the enclosed block as a stage (recorded even if the block raises)
+
+        Yields a dictionary the block can add fields of the stage record to.
+        """
+        start = time.perf_counter()
+        io_start = read_process_io()
+        try:
+            yield info
+        finally:
+            self.add(name, time.perf_counter() - start, io_start, **info)
+
+    def total_seconds(self):
+        """Seconds since the timer was created"""
+        return time.perf_counter() - self._start
+
+    def to_dict(self):
+        """Timings as a JSON-serializable dictionary"""
+        with self._lock:
+            stages = list(self.stages)
+        return {
+            "started_at": self.started_at,
+            "total_seconds": round(self.total_seconds(), 4),
+            "io_counters": "/proc/self/io" if read_process_io() is not None else None,
+            "stages": stages,
+        }
+
+    def write(self, out_file):
+        """Write the timings as JSON (atomically)"""
+        tmp_file = f"{out_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_file, out_file)
+        logging.info(f"Timings saved to: {out_file}")
+
+
+@contextmanager
+def profiled(out_dir, enabled=True):
+    """
+    Profile the enclosed block with cProfile
+
+    Writes profile.prof (load with pstats or snakeviz) and profile.txt (top functions by
+    cumulative time) to out_dir. Only the calling thread is profiled; run with one worker
+    thread (max_workers=1) to include the mask transfer and measurements.
+
+    Args:
+        out_dir: Output directory (created if missing)
+        enabled: Run the block without profiling if False
+    """
+    if not enabled:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(out_dir, exist_ok=True)
+        prof_file = os.path.join(out_dir, PROFILE_FILE)
+        profiler.dump_stats(prof_file)
+        with open(os.path.join(out_dir, PROFILE_TEXT_FILE), 'w') as f:
+            pstats.Stats(profiler, stream=f).sort_stats("cumulative").print_stats(40)
+        logging.info(f"Profile saved to: {prof_file}")
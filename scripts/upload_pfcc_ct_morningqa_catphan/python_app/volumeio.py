@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Volume I/O - intermediate and archival MetaImage (.mhd) files, memory-mapped volumes
+"""
+
+import os
+import json
+import logging
+import numpy as np
+import SimpleITK as sitk
+
+
+# MetaImage variants: zlib (default level, archival), fast (zlib level 1) or raw (uncompressed)
+IMAGE_FORMATS = ["zlib", "fast", "raw"]
+
+# Format of images re-read within a run (CT.mhd, composites, masks)
+DEFAULT_INTERMEDIATE_FORMAT = "raw"
+
+# Format of images kept after a run
+ARCHIVE_FORMAT = "zlib"
+
+# Compression level class (FLEVEL of the zlib stream header: 0 fastest .. 3 maximum) of the
+# data written by write_image in each compressed format
+ZLIB_FLEVELS = {"fast": 0, "zlib": 1}
+
+
+def _data_files(output_file):
+    """Possible data files of a MetaImage header (uncompressed, compressed)"""
+    base = os.path.splitext(output_file)[0]
+    return base + ".raw", base + ".zraw"
+
+
+def write_image(image, output_file, image_format=ARCHIVE_FORMAT):
+    """
+    Write image as MHD file in one of IMAGE_FORMATS
+
+    The data file of a previous write in another format (.raw/.zraw) is removed.
+
+    Args:
+        image: SimpleITK image to write
+        output_file: Output file path (.mhd)
+        image_format: "zlib", "fast" or "raw"
+    """
+    if image_format not in IMAGE_FORMATS:
+        raise Exception(f"Unknown image format: {image_format} (expected one of {IMAGE_FORMATS})")
+
+    writer = sitk.ImageFileWriter()
+    writer.SetFileName(output_file)
+    writer.SetUseCompression(image_format != "raw")
+    if image_format == "fast":
+        writer.SetCompressionLevel(1)
+    writer.Execute(image)
+
+    if output_file.lower().endswith(".mhd"):
+        raw_file, zraw_file = _data_files(output_file)
+        stale_file = zraw_file if image_format == "raw" else raw_file
+        if os.path.exists(stale_file):
+            os.remove(stale_file)
+
+
+def write_mhd_compressed(image, output_file):
+    """
+    Write image as MHD file with compression enabled
+
+    Args:
+        image: SimpleITK image to write
+        output_file: Output file path (.mhd)
+    """
+    write_image(image, output_file, ARCHIVE_FORMAT)
+
+
+def is_compressed_mhd(mhd_file):
+    """Check the CompressedData field of a MetaImage header"""
+    with open(mhd_file, 'r', errors='ignore') as f:
+        for line in f:
+            if line.startswith("CompressedData"):
+                return line.split("=", 1)[1].strip().lower() == "true"
+    return False
+
+
+def mhd_compression_level(mhd_file):
+    """
+    Compression level class of a MetaImage file, from the zlib header of its data file
+
+    Returns:
+        FLEVEL of the zlib stream (0: fastest, 1: fast, 2: default, 3: maximum; see ZLIB_FLEVELS),
+        None if the data is not compressed or its level cannot be read
+    """
+    if not is_compressed_mhd(mhd_file):
+        return None
+    data_file = None
+    with open(mhd_file, 'r', errors='ignore') as f:
+        for line in f:
+            if line.startswith("ElementDataFile"):
+                data_file = line.split("=", 1)[1].strip()
+    if not data_file or data_file == "LOCAL":
+        return None
+    try:
+        with open(os.path.join(os.path.dirname(mhd_file), data_file), 'rb') as f:
+            header = f.read(2)
+    except OSError:
+        return None
+    if len(header) < 2 or header[0] & 0x0f != 8:
+        return None
+    return header[1] >> 6
+
+
+def archive_images(mhd_files):
+    """
+    Re-write MHD files in the archival format unless they are already compressed at least as much
+    (uncompressed and "fast" images are re-written, ARCHIVE_FORMAT images are left as is)
+
+    Args:
+        mhd_files: List of .mhd file paths
+
+    Returns:
+        Number of files re-written
+    """
+    count = 0
+    archive_level = ZLIB_FLEVELS[ARCHIVE_FORMAT]
+    for mhd_file in mhd_files:
+        if not os.path.exists(mhd_file):
+            continue
+        level = mhd_compression_level(mhd_file)
+        if level is not None and level >= archive_level:
+            continue
+        write_image(sitk.ReadImage(mhd_file), mhd_file, ARCHIVE_FORMAT)
+        count += 1
+    logging.info(f"Archived {count} of {len(mhd_files)} images ({ARCHIVE_FORMAT})")
+    return count
+
+
+class MappedVolume:
+    """
+    Read-only memory-mapped volume (.npy) with the geometry from its JSON sidecar
+
+    Offers the geometry accessors of a SimpleITK image, so it can stand in for
+    one in the analysis functions. Threads and processes opening the same file
+    share its pages instead of each holding a copy.
+    """
+
+    def __init__(self, npy_file):
+        with open(npy_file + ".json", 'r') as f:
+            geometry = json.load(f)
+        self.file = npy_file
+        self.array = np.load(npy_file, mmap_mode='r')
+        self._spacing = tuple(geometry["spacing"])
+        self._origin = tuple(geometry["origin"])
+        self._direction = tuple(geometry["direction"])
+        self._index_to_point = np.array(self._direction).reshape(3, 3) @ np.diag(self._spacing)
+
+    def GetSize(self):
+        """Size in (x, y, z) order"""
+        return tuple(int(s) for s in self.array.shape[::-1])
+
+    def GetSpacing(self):
+        return self._spacing
+
+    def GetOrigin(self):
+        return self._origin
+
+    def GetDirection(self):
+        return self._direction
+
+    def TransformIndexToPhysicalPoint(self, index):
+        """Physical point of an (x, y, z) index (origin + direction * spacing * index)"""
+        point = np.array(self._origin) + self._index_to_point @ np.array(index, dtype=float)
+        return tuple(float(p) for p in point)
+
+
+def volume_array(image):
+    """Pixel array (z, y, x) of a SimpleITK image (view) or MappedVolume (memory map)"""
+    if isinstance(image, MappedVolume):
+        return image.array
+    return sitk.GetArrayViewFromImage(image)
+
+
+def write_mapped_volume(image, npy_file):
+    """
+    Write the pixels of a SimpleITK image as .npy and its geometry as a JSON sidecar (npy_file + ".json")
+
+    Both files are written to temporary files and renamed into place, so a crash
+    mid-write never leaves a truncated file that a later run would open.
+
+    Args:
+        image: SimpleITK image
+        npy_file: Output file path (.npy)
+    """
+    tmp_file = f"{npy_file}.{os.getpid()}.tmp.npy"
+    tmp_sidecar = f"{npy_file}.{os.getpid()}.tmp.json"
+    try:
+        np.save(tmp_file, sitk.GetArrayViewFromImage(image))
+        with open(tmp_sidecar, 'w') as f:
+            json.dump({
+                "spacing": list(image.GetSpacing()),
+                "origin": list(image.GetOrigin()),
+                "direction": list(image.GetDirection()),
+            }, f)
+        os.replace(tmp_sidecar, npy_file + ".json")
+        os.replace(tmp_file, npy_file)
+    finally:
+        for f in (tmp_file, tmp_sidecar):
+            if os.path.exists(f):
+                os.remove(f)
+
+
+def open_mapped_volume(image_file, npy_file):
+    """
+    Memory-mapped copy of an image, written once next to it
+
+    The .npy file is (re)written if missing or older than the image file.
+
+    Args:
+        image_file: Source image path (e.g. CT.mhd)
+        npy_file: Memory-mapped copy (e.g. CT.npy)
+
+    Returns:
+        MappedVolume
+    """
+    source_files = [image_file] + [f for f in _data_files(image_file) if os.path.exists(f)]
+    source_mtime = max(os.path.getmtime(f) for f in source_files)
+    if not os.path.exists(npy_file) or not os.path.exists(npy_file + ".json") or \
+            os.path.getmtime(npy_file) < source_mtime:
+        logging.info(f"Writing memory-mapped volume: {npy_file}")
+        write_mapped_volume(sitk.ReadImage(image_file), npy_file)
+    return MappedVolume(npy_file)
+
+
+def remove_mapped_volume(npy_file):
+    """Remove a memory-mapped volume and its sidecar"""
+    for f in (npy_file, npy_file + ".json"):
+        if os.path.exists(f):
+            os.remove(f)